@@ -0,0 +1,20 @@
+from API_Connector.api_abstract import connectToAPI
+
+
+class BudgetedAPI(connectToAPI):
+    """
+    Limits the concurrent requests of a connector by a semaphore, which can be shared by several connectors, also
+    across processes (e.g. multiprocessing.Manager().BoundedSemaphore), to keep one bounded LLM request budget.
+
+    :param connector: The connector sending the requests.
+    :param budget: Semaphore with one slot per allowed concurrent request.
+    """
+
+    def __init__(self, connector: connectToAPI, budget) -> None:
+        super().__init__(connector.dummy, connector.url)
+        self.connector = connector
+        self.budget = budget
+
+    def send_prompt(self, model: str, prompt: list[dict], top_p: float = 1, temp: float = 1, **kwargs) -> str:
+        with self.budget:
+            return self.connector.send_prompt(model=model, prompt=prompt, top_p=top_p, temp=temp, **kwargs)
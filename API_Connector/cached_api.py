@@ -0,0 +1,106 @@
+import hashlib
+import json
+import pathlib
+import sqlite3
+import threading
+import time
+
+from API_Connector.api_abstract import connectToAPI
+from Constants import Constants
+from utils.json_utils import IncrementalJsonListParser
+
+
+class CachedAPI(connectToAPI):
+    """
+    Persistent response cache wrapped around another connector.
+
+    Responses are stored in a SQLite file keyed by a hash of the URL of the wrapped connector and the parameters of
+    the request as sent: model, messages, temperature, top_p, max_tokens (Constants.CONTEXT_LENGTH) and streaming, since
+    a streamed answer ends with the JSON of the names.
+    If the stored responses exceed max_size_bytes, the least recently used entries are evicted.
+
+    :param connector: The connector used for cache misses.
+    :param cache_path: Path of the SQLite cache file.
+    :param max_size_bytes: Maximum total size of the cached responses.
+    """
+
+    def __init__(self, connector: connectToAPI,
+                 cache_path: str | pathlib.Path = Constants.LLM_CACHE_PATH,
+                 max_size_bytes: int = Constants.LLM_CACHE_MAX_BYTES):
+        super().__init__(connector.dummy, connector.url)
+        self.connector = connector
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        pathlib.Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(cache_path, check_same_thread=False)
+        self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                                key TEXT PRIMARY KEY,
+                                response TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                last_access REAL NOT NULL)""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self._db.commit()
+
+    def send_prompt(self, model: str, prompt: list[dict], top_p: float = 1, temp: float = 1, **kwargs) -> str:
+        key = self.cache_key(model=model, prompt=prompt, top_p=top_p, temp=temp,
+                             stream=kwargs.get('stream', Constants.STREAM_RESPONSES))
+        response = self._get(key)
+        if response is not None:
+            if kwargs.get('on_name') is not None:
+                # the callers expect the names as if the answer was streamed
+                for name in IncrementalJsonListParser().feed(response):
+                    kwargs['on_name'](name)
+            return response
+        response = self.connector.send_prompt(model=model, prompt=prompt, top_p=top_p, temp=temp, **kwargs)
+        if response is not None:
+            self._put(key, response)
+        return response
+
+    def cache_key(self, model: str, prompt: list[dict], top_p: float, temp: float,
+                  stream: bool = Constants.STREAM_RESPONSES) -> str:
+        key_data = {'url': self.connector.url, 'model': model, 'messages': prompt, 'temperature': temp, 'top_p': top_p,
+                    'max_tokens': Constants.CONTEXT_LENGTH, 'stream': stream}
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def _get(self, key: str) -> str | None:
+        with self._lock:
+            row = self._db.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            return row[0]
+
+    def _put(self, key: str, response: str) -> None:
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses (key, response, size, last_access) VALUES (?, ?, ?, ?)",
+                             (key, response, size, time.time()))
+            self._evict()
+            self._db.commit()
+
+    def _evict(self) -> None:
+        """Deletes the least recently used responses until the cache fits into max_size_bytes."""
+        # keeps the most recently used responses up to max_size_bytes, DELETE ... LIMIT is not in every SQLite build
+        self._db.execute("""DELETE FROM responses WHERE key IN (
+                                SELECT key FROM (
+                                    SELECT key, SUM(size) OVER (ORDER BY last_access DESC, key) AS kept_size
+                                    FROM responses)
+                                WHERE kept_size > ?)""", (self.max_size_bytes,))
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            entries, size = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {'hits': self.hits, 'misses': self.misses, 'entries': entries, 'size_bytes': size}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,222 @@
+import threading
+import time
+from functools import lru_cache
+
+from API_Connector.api_abstract import connectToAPI
+from API_Connector.openAI import RETRYABLE_ERRORS, _emit_once
+from Constants import Constants
+
+
+@lru_cache(maxsize=None)
+def get_shared_load_balancer(urls: tuple) -> 'LoadBalancedAPI':
+    """Returns the load balancer over the urls shared process-wide."""
+    return LoadBalancedAPI.from_urls(list(urls))
+
+
+class Backend:
+    """One LLM backend of the load balancer with its concurrency cap, health state and stats."""
+
+    def __init__(self, connector: connectToAPI, max_in_flight: int) -> None:
+        self.connector = connector
+        self.max_in_flight = max_in_flight
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0  # monotonic time until the backend gets no requests
+        self.ejections = 0
+        self.requests = 0
+        self.failures = 0
+        self.busy_seconds = 0.0
+        self.latencies: list = []  # of the last successful requests
+        self.created = time.monotonic()
+
+    def is_available(self, now: float) -> bool:
+        return self.ejected_until <= now and self.outstanding < self.max_in_flight
+
+    def get_stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        successes = self.requests - self.failures
+        return {'url': self.connector.url,
+                'requests': self.requests,
+                'failures': self.failures,
+                'outstanding': self.outstanding,
+                'ejected': self.ejected_until > time.monotonic(),
+                'ejections': self.ejections,
+                'latency_mean_s': sum(latencies) / len(latencies) if latencies else None,
+                'latency_p95_s': latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+                'requests_per_minute': 60 * successes / max(time.monotonic() - self.created, 1e-9)}
+
+
+class LoadBalancedAPI(connectToAPI):
+    """
+    Fans the requests out across several LLM backends, e.g. Ollama instances on different machines.
+
+    Every request goes to the healthy backend with the fewest outstanding requests (relative to its cap), up to
+    max_in_flight requests per backend; if all backends are busy the request waits. A backend failing
+    eject_after_failures times in a row is ejected for eject_seconds, after that it is re-admitted and ejected again
+    for twice as long if the next request fails too. A failed request is retried on another backend. Only the
+    RETRYABLE_ERRORS count as failures, including streams breaking off after some names, any other error (e.g. a 400
+    for a too long prompt or a wrong API key) is raised at once without retrying or ejecting the backend.
+
+    :param backends: Connectors of the backends, e.g. ConnectOpenAI instances without own retries.
+    :param max_in_flight: Maximum number of concurrent requests per backend, one value or one per backend.
+    :param eject_after_failures: Number of consecutive failures after which a backend is ejected.
+    :param eject_seconds: Duration of the first ejection in seconds.
+    :param max_eject_seconds: Maximum duration of an ejection in seconds.
+    :param latency_window: Number of latencies per backend kept for the stats.
+    """
+
+    def __init__(self, backends: list,
+                 max_in_flight: int | list = Constants.LLM_BACKEND_MAX_IN_FLIGHT,
+                 eject_after_failures: int = Constants.LLM_BACKEND_EJECT_FAILURES,
+                 eject_seconds: float = Constants.LLM_BACKEND_EJECT_SECONDS,
+                 max_eject_seconds: float = 600.0,
+                 latency_window: int = 1000):
+        if not backends:
+            raise ValueError('At least one backend is needed.')
+        super().__init__(False, [backend.url for backend in backends])
+        caps = max_in_flight if isinstance(max_in_flight, list) else [max_in_flight] * len(backends)
+        self.backends = [Backend(connector, cap) for connector, cap in zip(backends, caps)]
+        self.eject_after_failures = eject_after_failures
+        self.eject_seconds = eject_seconds
+        self.max_eject_seconds = max_eject_seconds
+        self.latency_window = latency_window
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_urls(cls, urls: list, **kwargs) -> 'LoadBalancedAPI':
+        """Creates the load balancer over ConnectOpenAI backends, the retries are done across the backends."""
+        from API_Connector.openAI import ConnectOpenAI
+        return cls([ConnectOpenAI(dummy=False, url=url, max_retries=0) for url in urls], **kwargs)
+
+    def send_prompt(self, model: str, prompt: list[dict], top_p: float = 1, temp: float = 1, **kwargs) -> str:
+        if kwargs.get('on_name') is not None:
+            # the names streamed by a backend before it failed are not emitted again by the next backend
+            kwargs['on_name'] = _emit_once(kwargs['on_name'])
+        tried: set = set()
+        while True:
+            backend = self._acquire(tried)
+            start_time = time.monotonic()
+            try:
+                response = backend.connector.send_prompt(model=model, prompt=prompt, top_p=top_p, temp=temp,
+                                                         **kwargs)
+            except RETRYABLE_ERRORS as e:
+                self._release(backend, time.monotonic() - start_time, failed=True)
+                tried.add(id(backend))
+                print(f'LLM backend {backend.connector.url} failed ({type(e).__name__}: {e})')
+                if len(tried) >= len(self.backends):
+                    raise
+                continue
+            except Exception:
+                # the request was rejected, which says nothing about the health of the backend
+                self._release(backend, time.monotonic() - start_time, failed=None)
+                raise
+            self._release(backend, time.monotonic() - start_time, failed=False)
+            return response
+
+    def _acquire(self, tried: set) -> Backend:
+        """Waits for the least loaded available backend not tried yet and reserves a slot on it."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                candidates = [backend for backend in self.backends if id(backend) not in tried]
+                available = [backend for backend in candidates if backend.is_available(now)]
+                if available:
+                    backend = min(available, key=lambda b: (b.outstanding / b.max_in_flight, b.outstanding))
+                    backend.outstanding += 1
+                    return backend
+                if all(backend.ejected_until > now for backend in candidates):
+                    # nothing healthy left: try the backend re-admitted first instead of failing
+                    backend = min(candidates, key=lambda b: b.ejected_until)
+                    if backend.outstanding < backend.max_in_flight:
+                        backend.outstanding += 1
+                        return backend
+                next_readmission = min((b.ejected_until for b in candidates if b.ejected_until > now), default=now)
+                self._condition.wait(timeout=max(next_readmission - now, 0.05) if next_readmission > now else None)
+
+    def _release(self, backend: Backend, seconds: float, failed: bool | None) -> None:
+        """Frees the slot of the request, failed is None for a rejected request not changing the health state."""
+        with self._condition:
+            backend.outstanding -= 1
+            backend.requests += 1
+            backend.busy_seconds += seconds
+            if failed is None:
+                pass
+            elif failed:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.consecutive_failures >= self.eject_after_failures:
+                    ejections_in_row = backend.consecutive_failures - self.eject_after_failures
+                    duration = min(self.eject_seconds * 2 ** ejections_in_row, self.max_eject_seconds)
+                    backend.ejected_until = time.monotonic() + duration
+                    backend.ejections += 1
+                    print(f'LLM backend {backend.connector.url} ejected for {duration:.0f}s')
+            else:
+                backend.consecutive_failures = 0
+                backend.latencies.append(seconds)
+                del backend.latencies[:-self.latency_window]
+            self._condition.notify_all()
+
+    def get_stats(self) -> list:
+        """Returns the stats of every backend."""
+        with self._condition:
+            return [backend.get_stats() for backend in self.backends]
+
+
+if __name__ == "__main__":
+    # Self-check against local OpenAI compatible stub servers: a failing, a fast and a slow backend.
+    from concurrent.futures import ThreadPoolExecutor
+    from benchmarks.llm_stub_server import StubLLMServer
+
+    class RejectingConnector(connectToAPI):
+        def send_prompt(self, model: str, prompt: list[dict], top_p: float = 1, temp: float = 1, **kwargs) -> str:
+            raise ValueError('prompt too long')
+
+    prompt = [{'role': 'user', 'content': 'As shown by Smith (2019, p. 4).'}]
+    expected = '[{"First Name": "-", "Last Name": "Smith"}]'
+    with StubLLMServer(error_rate=1.0) as failing, \
+            StubLLMServer(latency=0.01, latency_distribution='fixed', tokens_per_second=0) as fast, \
+            StubLLMServer(latency=0.1, latency_distribution='fixed', tokens_per_second=0) as slow:
+        balancer = LoadBalancedAPI.from_urls([failing.url, fast.url, slow.url], max_in_flight=2,
+                                             eject_after_failures=2, eject_seconds=60)
+        # one request at a time, all backends are idle and the failing one comes first: it gets exactly the requests
+        # until its ejection, each is retried on the fast backend
+        answers = [balancer.send_prompt(model='stub', prompt=prompt, stream=False) for _ in range(2)]
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            answers += executor.map(lambda _: balancer.send_prompt(model='stub', prompt=prompt, stream=False),
+                                    range(60))
+        stats = balancer.get_stats()
+        for backend_stats in stats:
+            print(backend_stats)
+        assert answers == [expected] * 62, 'every request must be answered by a healthy backend'
+        assert stats[0]['ejected'] and stats[0]['requests'] == 2, 'the failing backend must be ejected'
+        assert stats[1]['requests'] > stats[2]['requests'], 'the fast backend must get the most requests'
+        assert all(s['outstanding'] == 0 for s in stats)
+
+        # a rejected request is neither retried nor does it eject the backend
+        balancer = LoadBalancedAPI([RejectingConnector(False, 'rejecting'), balancer.backends[1].connector],
+                                   eject_after_failures=1)
+        try:
+            balancer.send_prompt(model='stub', prompt=prompt, stream=False)
+            raise AssertionError('the rejection must be raised')
+        except ValueError:
+            pass
+        stats = balancer.get_stats()
+        assert stats[0]['failures'] == 0 and not stats[0]['ejected'], 'a rejection is no backend failure'
+        assert stats[1]['requests'] == 0, 'a rejection must not be retried on another backend'
+
+    # a stream breaking off after some names (lost connection or error event) is retried on another backend without
+    # emitting these names again
+    prompt = [{'role': 'user', 'content': 'As shown by Smith (2019, p. 4) and Jones et al. (2020).'}]
+    expected_names = [{'First Name': '-', 'Last Name': 'Smith'}, {'First Name': '-', 'Last Name': 'Jones'}]
+    instant = {'latency': 0, 'latency_distribution': 'fixed', 'tokens_per_second': 0}
+    with StubLLMServer(**instant, stream_abort_rate=1.0) as aborting, StubLLMServer(**instant) as healthy:
+        balancer = LoadBalancedAPI.from_urls([aborting.url, healthy.url], eject_after_failures=4, eject_seconds=60)
+        for _ in range(4):
+            names: list = []
+            balancer.send_prompt(model='stub', prompt=prompt, stream=True, on_name=names.append)
+            assert names == expected_names, f'every name must be emitted once, got {names}'
+        stats = balancer.get_stats()
+        assert stats[0]['failures'] == 4 and stats[0]['ejected'], 'the backend breaking off streams must be ejected'
+        assert aborting.get_stats()['statuses'] == {'aborted': 4}
+        assert healthy.get_stats()['statuses'] == {200: 4}
+    print('load balancer self-check passed')
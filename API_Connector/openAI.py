@@ -1,28 +1,334 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from functools import lru_cache
 
+import httpx
 import openai
 from API_Connector.api_abstract import connectToAPI
 from Constants import Constants
+from utils.json_utils import IncrementalJsonListParser
 
 
-# os.environ['OPENAI_API_KEY'] = 'xxx'
+class StreamInterruptedError(openai.APIConnectionError):
+    """
+    The stream of an accepted request broke off before the answer was complete: the connection was lost, a read timed
+    out or the server sent an error event. Retryable like a failed connection.
+    """
+
+    def __init__(self, error: Exception, request: httpx.Request) -> None:
+        super().__init__(message=f'Stream interrupted ({type(error).__name__}: {error})', request=request)
+
+
+# errors worth a retry: rate limits (429), server errors (5xx), timeouts and connection errors, also in the middle of
+# a stream (StreamInterruptedError is an APIConnectionError)
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+# errors raised while reading a stream: httpx errors are not wrapped by the openai client there and an error event of
+# the server is raised as a plain openai.APIError
+STREAM_ERRORS = (httpx.TransportError, openai.APIError)
+
+
+@lru_cache(maxsize=None)
+def get_shared_connector(url: str = Constants.LLM_URL) -> 'ConnectOpenAI':
+    """Returns the connector of the url shared process-wide, e.g. by all UI requests, with its connection pool."""
+    return ConnectOpenAI(dummy=False, url=url)
+
+
+def _emit_once(on_name):
+    """
+    Wraps the on_name callback of a request, so the names already emitted before a stream failed are not emitted
+    again by the retry.
+    """
+    if on_name is None:
+        return None
+    emitted: set = set()
+
+    def emit(name: dict) -> None:
+        key = json.dumps(name, sort_keys=True, ensure_ascii=False, default=str)
+        if key not in emitted:
+            emitted.add(key)
+            on_name(name)
+    return emit
+
+
+class _StreamCollector:
+    """
+    Feeds a streamed answer into the incremental JSON parser and collects the stream stats.
+
+    The completion tokens of the usage data are only sent with the last chunk of a stream, which an early stop never
+    reads. For these answers the generated tokens are the content deltas received, as the servers stream one token
+    per delta and stop generating when the connection is closed. They would have generated up to max_tokens at most,
+    the difference is reported as output_tokens_saved_max.
+
+    :param on_name: Optional callback called with every name dictionary as soon as it is streamed.
+    :param max_tokens: max_tokens of the request.
+    """
+
+    def __init__(self, on_name=None, max_tokens: int = Constants.CONTEXT_LENGTH) -> None:
+        self.on_name = on_name
+        self.max_tokens = max_tokens
+        self.parser = IncrementalJsonListParser()
+        self.start_time = time.perf_counter()
+        self.time_to_first_name = None
+        self.deltas = 0
+        self.completion_tokens = None  # from the usage data of the last chunk
+
+    def feed(self, chunk) -> bool:
+        """Consumes a streamed completion chunk, returns True when the answer is complete."""
+        if getattr(chunk, 'usage', None) is not None:
+            self.completion_tokens = chunk.usage.completion_tokens
+        if not chunk.choices or not chunk.choices[0].delta.content:
+            return False
+        self.deltas += 1
+        for name in self.parser.feed(chunk.choices[0].delta.content):
+            if self.time_to_first_name is None:
+                self.time_to_first_name = time.perf_counter() - self.start_time
+            if self.on_name is not None:
+                self.on_name(name)
+        return self.parser.done
+
+    def get_stats(self) -> dict:
+        stopped_early = self.parser.done and self.completion_tokens is None
+        output_tokens = self.completion_tokens if self.completion_tokens is not None else self.deltas
+        return {'time_to_first_name_s': self.time_to_first_name,
+                'total_s': time.perf_counter() - self.start_time,
+                'names': len(self.parser.objects),
+                'deltas': self.deltas,
+                'completion_tokens': self.completion_tokens,
+                'output_tokens': output_tokens,
+                'output_tokens_saved_max': max(self.max_tokens - output_tokens, 0) if stopped_early else 0,
+                'stopped_early': stopped_early}
 
 
 class ConnectOpenAI(connectToAPI):
-    def __init__(self, dummy, url):
+    """
+    Connector to an OpenAI compatible endpoint. Every instance owns its clients with a keep-alive connection pool,
+    so connectors to different endpoints do not share any state. Requests failing with 429, 5xx, timeout or
+    connection errors are retried with jittered exponential backoff.
+
+    :param dummy: Unused, see connectToAPI.
+    :param url: URL of the OpenAI compatible endpoint.
+    :param max_connections: Size of the connection pool.
+    :param connect_timeout: Timeout in seconds for opening a connection.
+    :param max_retries: Number of retries of a failed request.
+    :param retry_base_delay: Delay in seconds before the first retry, doubled for every further retry.
+    :param retry_max_delay: Maximum delay in seconds between two retries.
+    :param stats_window: Number of streamed answers whose stats are kept, see get_stats.
+    """
+
+    def __init__(self, dummy=False, url=Constants.LLM_URL,
+                 max_connections: int = Constants.LLM_POOL_MAX_CONNECTIONS,
+                 connect_timeout: float = Constants.LLM_CONNECT_TIMEOUT,
+                 max_retries: int = Constants.LLM_MAX_RETRIES,
+                 retry_base_delay: float = Constants.LLM_RETRY_BASE_DELAY,
+                 retry_max_delay: float = Constants.LLM_RETRY_MAX_DELAY,
+                 stats_window: int = 1000):
         super().__init__(dummy, url)
-        openai.api_key = "EMPTY"  # load savely from envioment later one
-        openai.base_url = url
-        # try to use openaio client ???
+        self.api_key = os.environ.get('OPENAI_API_KEY', 'EMPTY')
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.client = openai.OpenAI(api_key=self.api_key, base_url=url, max_retries=0,
+                                    http_client=httpx.Client(limits=self._limits(), timeout=self._timeout()))
+        # the connections of an async client are bound to the event loop they were opened in, so one client per loop
+        self._async_clients: dict = {}
+        self.retries = 0
+        self.answers = 0  # number of streamed answers so far, marks the start of a run for get_stats
+        self.stream_stats: deque = deque(maxlen=stats_window)  # one dict per streamed answer, the latest ones
+        self._stats_lock = threading.Lock()
 
-    def send_prompt(self, model: str, prompt: list[dict], top_p: float = 1, temp: float = 1) -> str:
-        response = openai.chat.completions.create(model=model,
-                                                  messages=prompt,
-                                                  stream=False,
-                                                  top_p=top_p,
-                                                  max_tokens=Constants.CONTEXT_LENGTH,
-                                                  temperature=temp)
+    def send_prompt(self, model: str, prompt: list[dict], top_p: float = 1, temp: float = 1,
+                    timeout: float | None = None, stream: bool = Constants.STREAM_RESPONSES,
+                    on_name=None) -> str:
+        """
+        Sends the prompt and returns the answer of the model.
 
-        return response.choices[0].message.content
+        :param model: Name of the model.
+        :param prompt: Prompt history.
+        :param top_p: Nucleus sampling mass.
+        :param temp: Sampling temperature.
+        :param timeout: Timeout of the request in seconds, None for no timeout.
+        :param stream: Stream the answer and stop the generation as soon as the JSON of the names is complete.
+        :param on_name: Optional callback called with every name dictionary as soon as it is streamed.
+        :return: The answer, when streamed only up to the end of the JSON.
+        """
+        on_name = _emit_once(on_name)
+        for attempt in range(self.max_retries + 1):
+            try:
+                if stream:
+                    return self._send_prompt_streamed(model, prompt, top_p, temp, timeout, on_name)
+                response = self.client.chat.completions.create(model=model,
+                                                               messages=prompt,
+                                                               stream=False,
+                                                               top_p=top_p,
+                                                               max_tokens=Constants.CONTEXT_LENGTH,
+                                                               temperature=temp,
+                                                               timeout=self._timeout(timeout))
+                return response.choices[0].message.content
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                time.sleep(self._retry_delay(attempt, e))
+
+    async def async_send_prompt(self, model: str, prompt: list[dict], top_p: float = 1, temp: float = 1,
+                                timeout: float | None = None, stream: bool = Constants.STREAM_RESPONSES,
+                                on_name=None) -> str:
+        """Async variant of send_prompt, see there."""
+        async_client = self._get_async_client()
+        on_name = _emit_once(on_name)
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await async_client.chat.completions.create(model=model,
+                                                                      messages=prompt,
+                                                                      stream=stream,
+                                                                      top_p=top_p,
+                                                                      max_tokens=Constants.CONTEXT_LENGTH,
+                                                                      temperature=temp,
+                                                                      timeout=self._timeout(timeout),
+                                                                      **self._stream_options(stream))
+                if not stream:
+                    return response.choices[0].message.content
+                collector = _StreamCollector(on_name)
+                try:
+                    async for chunk in response:
+                        if collector.feed(chunk):
+                            break
+                except STREAM_ERRORS as e:
+                    raise StreamInterruptedError(e, response.response.request) from e
+                finally:
+                    await response.close()  # closing the connection stops the generation on the server
+                self._add_stream_stats(collector.get_stats())
+                return collector.parser.text
+            except RETRYABLE_ERRORS as e:
+                if attempt >= self.max_retries:
+                    raise
+                await asyncio.sleep(self._retry_delay(attempt, e))
+
+    def _send_prompt_streamed(self, model: str, prompt: list[dict], top_p: float, temp: float,
+                              timeout: float | None, on_name) -> str:
+        collector = _StreamCollector(on_name)
+        response = self.client.chat.completions.create(model=model,
+                                                       messages=prompt,
+                                                       stream=True,
+                                                       top_p=top_p,
+                                                       max_tokens=Constants.CONTEXT_LENGTH,
+                                                       temperature=temp,
+                                                       timeout=self._timeout(timeout),
+                                                       **self._stream_options(True))
+        try:
+            for chunk in response:
+                if collector.feed(chunk):
+                    break
+        except STREAM_ERRORS as e:
+            raise StreamInterruptedError(e, response.response.request) from e
+        finally:
+            response.close()  # closing the connection stops the generation on the server
+        self._add_stream_stats(collector.get_stats())
+        return collector.parser.text
+
+    def _get_async_client(self) -> openai.AsyncOpenAI:
+        """
+        Returns the async client of the running event loop, created on first use. The clients of closed loops (e.g. of
+        finished asyncio.run calls) are dropped, their connections can not be used any more.
+        """
+        loop = asyncio.get_running_loop()
+        with self._stats_lock:
+            for closed_loop in [old_loop for old_loop in self._async_clients if old_loop.is_closed()]:
+                del self._async_clients[closed_loop]
+            async_client = self._async_clients.get(loop)
+            if async_client is None:
+                async_client = openai.AsyncOpenAI(api_key=self.api_key, base_url=self.url, max_retries=0,
+                                                  http_client=httpx.AsyncClient(limits=self._limits(),
+                                                                                timeout=self._timeout()))
+                self._async_clients[loop] = async_client
+        return async_client
+
+    def _retry_delay(self, attempt: int, error: Exception) -> float:
+        """Full jitter exponential backoff, a Retry-After header of the server is respected as minimum."""
+        with self._stats_lock:
+            self.retries += 1
+        delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('retry-after') if response is not None else None
+        if retry_after is not None:
+            try:
+                delay = max(delay, min(float(retry_after), self.retry_max_delay))
+            except ValueError:
+                pass
+        print(f'LLM request failed ({type(error).__name__}), retry {attempt + 1}/{self.max_retries} '
+              f'in {delay:.2f}s')
+        return delay
+
+    @staticmethod
+    def _stream_options(stream: bool) -> dict:
+        """Asks for the usage data at the end of a stream, see _StreamCollector."""
+        return {'stream_options': {'include_usage': True}} if stream else {}
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+
+    def _timeout(self, read_timeout: float | None = None) -> httpx.Timeout:
+        return httpx.Timeout(read_timeout, connect=self.connect_timeout)
+
+    def _add_stream_stats(self, stats: dict) -> None:
+        print(f'Stream stats: {stats}')
+        with self._stats_lock:
+            self.answers += 1
+            self.stream_stats.append(stats)
+
+    def get_stream_stats(self, since: int = 0) -> list:
+        """
+        Returns the stats of the answers streamed after the first since answers, as far as they are still kept.
+
+        :param since: Value of self.answers at the start of the run.
+        """
+        with self._stats_lock:
+            new_answers = min(self.answers - since, len(self.stream_stats))
+            return list(self.stream_stats)[len(self.stream_stats) - new_answers:] if new_answers > 0 else []
+
+    def get_stats(self, since: int = 0) -> dict:
+        """
+        Returns the summary of the answers streamed in a run and the number of retries of all runs.
+        Runs on the shared connector at the same time are counted together.
+
+        :param since: Value of self.answers at the start of the run, 0 for all answers kept.
+        """
+        stats = self.get_stream_stats(since)
+        first_name_times = [s['time_to_first_name_s'] for s in stats if s['time_to_first_name_s'] is not None]
+        return {'answers': len(stats),
+                'stopped_early': sum(s['stopped_early'] for s in stats),
+                'mean_time_to_first_name_s':
+                    sum(first_name_times) / len(first_name_times) if first_name_times else None,
+                'deltas': sum(s['deltas'] for s in stats),
+                'output_tokens': sum(s['output_tokens'] for s in stats),
+                'output_tokens_saved_max': sum(s['output_tokens_saved_max'] for s in stats),
+                'retries': self.retries}
+
+    async def aclose(self) -> None:
+        """Closes the async client of the running event loop."""
+        with self._stats_lock:
+            async_client = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if async_client is not None:
+            await async_client.close()
+
+    def close(self) -> None:
+        """
+        Closes the connection pools, only needed for connectors that are not shared. The async clients of event loops
+        still running are closed with aclose inside their loop, the ones of closed loops can only be dropped.
+        """
+        self.client.close()
+        with self._stats_lock:
+            async_clients = list(self._async_clients.items())
+            self._async_clients.clear()
+        for loop, async_client in async_clients:
+            if not loop.is_closed() and not loop.is_running():
+                loop.run_until_complete(async_client.close())
 
 
 if __name__ == "__main__":
@@ -33,5 +339,14 @@ if __name__ == "__main__":
     ]
 
     answer = api_connection.send_prompt(model='llama3.2:latest',
-                                        prompt=messages)
+                                        prompt=messages, stream=False)
     print(answer)
+
+    async def send_async() -> str:
+        try:
+            return await api_connection.async_send_prompt(model='llama3.2:latest', prompt=messages, stream=False)
+        finally:
+            await api_connection.aclose()
+
+    print(asyncio.run(send_async()))
+    api_connection.close()
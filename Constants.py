@@ -13,12 +13,82 @@ class Constants:
     # We generally recommend altering this or temperature but not both.
     TOP_P = 1.0
 
+    # Maximum number of concurrent requests sent to the LLM server, 1 sends the chunks one after another
+    LLM_MAX_IN_FLIGHT = 1
+    # Timeout in seconds for a single LLM request, None waits forever
+    LLM_REQUEST_TIMEOUT = 300.0
+    # Several OpenAI compatible backends (e.g. Ollama on different machines) used instead of LLM_URL if set.
+    # Requests go to the backend with the fewest outstanding requests, backends failing repeatedly are ejected
+    LLM_BACKEND_URLS = []
+    LLM_BACKEND_MAX_IN_FLIGHT = 2
+    LLM_BACKEND_EJECT_FAILURES = 3
+    LLM_BACKEND_EJECT_SECONDS = 30.0
+    # Keep-alive connection pool of every connector and the timeout for opening a connection
+    LLM_POOL_MAX_CONNECTIONS = 16
+    LLM_CONNECT_TIMEOUT = 10.0
+    # Retries of requests failing with 429, 5xx, timeout or connection errors, with jittered exponential backoff
+    LLM_MAX_RETRIES = 3
+    LLM_RETRY_BASE_DELAY = 1.0
+    LLM_RETRY_MAX_DELAY = 30.0
+    # Background jobs of the UI: documents indexed at the same time, the cap of concurrent LLM requests shared
+    # fairly by all running jobs, and how many finished jobs are kept for how long (seconds)
+    JOB_MAX_RUNNING = 2
+    JOB_MAX_IN_FLIGHT = 4
+    JOB_MAX_FINISHED = 20
+    JOB_RETENTION_SECONDS = 3600
+    # Stream the LLM answers, parse the names as they arrive and stop the generation as soon as the JSON list is
+    # closed or the "no name found" sentinel appears
+    STREAM_RESPONSES = True
+    # Persistent cache of LLM responses, reruns on unchanged documents do not send any request
+    USE_LLM_CACHE = True
+    LLM_CACHE_PATH = ".cache/llm_responses.sqlite"
+    LLM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    # Number of short chunks sent together in one request (chunk-tagged JSON answer), 1 sends every chunk alone.
+    # The system prompt and examples are sent once per batch instead of once per chunk
+    CHUNK_BATCH_SIZE = 1
+    # Skip chunks without name or citation signals (capitalized names, years in parentheses, et al., vgl./See, ...)
+    # instead of sending them to the LLM, a chunk is sent if its score is at least the threshold
+    USE_CHUNK_PREFILTER = False
+    CHUNK_PREFILTER_THRESHOLD = 2.0
+    # Extract the authors of unambiguous citations like "Krieber (2017, p. 45)" with regular expressions and only
+    # send the remaining text to the LLM, chunks without other name signals are not sent at all
+    USE_CITATION_FAST_PATH = False
+
+    # Number of processes extracting the PDF text, None uses all CPUs and 1 extracts in the main process
+    PDF_EXTRACT_WORKERS = None
+    # Documents with fewer pages are always extracted in the main process to avoid the process spawn overhead
+    PDF_PARALLEL_MIN_PAGES = 200
+    # On-disk cache of the extracted page texts, keyed by the content hash of the PDF
+    USE_PDF_TEXT_CACHE = True
+    PDF_TEXT_CACHE_DIR = ".cache/page_text"
+    PDF_TEXT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+    # Journal of the finished chunks of every run, a rerun after a crash resumes at the first unfinished chunk.
+    # Unfinished runs not touched for RUN_JOURNAL_STALE_DAYS are deleted by: python -m utils.run_journal clean
+    USE_RUN_JOURNAL = True
+    RUN_JOURNAL_DIR = ".cache/runs"
+    RUN_JOURNAL_STALE_DAYS = 7
+
     TEXT_SPLIT_MAX_TOKEN_LENGTH = 1024
     AVG_TOKEN_CHARACKTER_COUNT = 3.25
     PARAGRAPH_SPLIT_OVERLAP = 150
+    # Plan the chunk budget from the context length of the model, the prompt overhead and the output reserve
+    # instead of using the fixed TEXT_SPLIT_MAX_TOKEN_LENGTH
+    PLAN_CHUNKS_FROM_CONTEXT = True
+    OUTPUT_TOKEN_RESERVE = 512
+    CONTEXT_SAFETY_MARGIN = 0.05
+    # Smallest planned chunk budget, a smaller window leaves too little text per request to be worth it
+    MIN_CHUNK_TOKEN_LENGTH = 256
+    CHUNK_TOKEN_COUNT_TYP = 'estimate'
     MODEL_NAME = 'llama3.2:latest' #'phi3:14b-medium-128k-instruct-q8_0'  # 'llama3.2:latest'  # 'mistral:7b'
 
     EXTRACT_COLUMN_KEYS = ["First Name", "Last Name"]
+    # Column with the pages of the text chunk a name was extracted from
+    SOURCE_PAGES_COLUMN = "Source Pages"
+    # 'full' searches every name in the whole document, 'scoped' only on the pages of the chunks the name was
+    # extracted from and 'scoped_fallback' searches the whole document for names not found on those pages
+    NAME_PAGE_SEARCH_MODE = 'full'
+    # Pages before and after the chunk pages that are also searched in the scoped modes
+    NAME_SCOPE_PAGE_MARGIN = 1
     SYSTEM_PROMPT = """You are an expert in extracting author names from quotations or references in texts
     and returning them in json format.
     Analyse the provided texts carefully and check if there are any quotation or references to AUTHORS NAMES,
@@ -47,6 +117,17 @@ class Constants:
     TEXT:
     """
 
+    BATCH_USER_BASE_PROMPT = """ Please extract author names from quotations or references from each of the
+    following text chunks. Every chunk starts with a line "### CHUNK <id>".
+    Do NOT extract names of countries, places, organizations, parties, or other non-person entities.
+    It is imperative that your answer ONLY contain a valid json object with the id of EVERY chunk as key and the
+    list of names from referenced authors in that chunk as value, like this:
+    {"0": [{"First Name": "first_name", "Last Name": "last_name"}, ... ], "1": [], ... }.
+    If there is no name from a person in a chunk, return an empty list for it.
+    
+    TEXT CHUNKS:
+    """
+
     EXAMLES_USER = [
         "So if one asks is there anything faster than light. The answer is: No!, as shown by Albert Einstein and Paul Hawking. However there biggest contribution to science, but in winning the gold medal for France, Germany and the USA.",
         "Based on the works of Saint Augustine, Dr. Francianos has shown that the Theology is the search for answers that are bigger than us. In contrast, Veltranova (2023) critiques Francianos for what she describes as an 'overemphasis on existential abstraction'",
@@ -59,6 +140,13 @@ class Constants:
         '[{"First Name": "-", "Last Name": "Krieber"},  {"First Name": "-", "Last Name": "Mandrel"},  {"First Name": "-", "Last Name": "Osterlich"}],'
         '[{"First Name": "Hans Günther", "Last Name": "Mayer"}]']
 
+    # Few-shot example of the batch prompt with the grouped answer format of BATCH_USER_BASE_PROMPT
+    BATCH_EXAMPLES_USER = [
+        "### CHUNK 0\n" + EXAMLES_USER[0] + "\n### CHUNK 1\nThe turnout rose from 61 to 68 percent between 2017 and 2021, see Table 2.\n### CHUNK 2\n" + EXAMLES_USER[1]]
+    BATCH_EXAMPLES_ASSISTANT = [
+        '{"0": [{"First Name": "Albert", "Last Name": "Einstein"}, {"First Name": "Paul", "Last Name": "Hawking"}], "1": [], '
+        '"2": [{"First Name": "Augustine", "Last Name": "-"}, {"First Name": "-", "Last Name": "Francianos"}, {"First Name": "-", "Last Name": "Veltranova"}]}']
+
     FOOTNOTE_RE_PATTERNS = [r'\d+\t\nSee name+',
                             r'\d+\t\nvgl\. name+',
                             r'\d+\t\nname+']
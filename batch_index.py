@@ -0,0 +1,225 @@
+"""
+Headless batch indexing of many PDFs, e.g. a whole series of volumes overnight.
+
+Every document runs through the whole pipeline (extraction, chunking, LLM, name page lookup) in a worker process,
+all workers share one bounded budget of concurrent LLM requests. The names of every document are written to
+<output dir>/<document path below the common folder of all documents>.csv (or .parquet) and a summary of throughput
+and failures to <output dir>/summary.json. Documents with identical content are indexed once, the others get a copy
+of the result.
+
+Usage: python batch_index.py "volumes/*.pdf" other_volumes/ --output-dir index_results --workers 4 --max-in-flight 4
+"""
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import pathlib
+import shutil
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+import pipeline
+from Constants import Constants
+from utils.text_cache import PageTextCache
+
+_request_budget = None  # semaphore shared by all worker processes
+
+
+def find_pdfs(inputs: list) -> list:
+    """
+    Resolves directories (all PDFs in them, recursively), glob patterns and file paths to a sorted list of PDFs.
+
+    :param inputs: List of directories, glob patterns or file paths.
+    :return: Sorted list of unique absolute PDF paths.
+    """
+    pdf_paths = set()
+    for path_str in inputs:
+        path = pathlib.Path(path_str)
+        if path.is_dir():
+            pdf_paths.update(p.resolve() for p in path.rglob('*') if p.suffix.lower() == '.pdf')
+        elif path.is_file():
+            pdf_paths.add(path.resolve())
+        else:
+            pdf_paths.update(pathlib.Path(p).resolve() for p in glob.glob(path_str, recursive=True)
+                             if p.lower().endswith('.pdf'))
+    return sorted(pdf_paths)
+
+
+def make_output_paths(pdf_paths: list, output_dir: pathlib.Path, output_format: str) -> list:
+    """
+    Returns the output path of every document: its path below the common folder of all documents, so same-named
+    PDFs in different folders get different files, e.g. vol1/intro.pdf -> <output dir>/vol1/intro.csv.
+
+    :raises ValueError: If two documents would be written to the same file.
+    """
+    pdf_paths = [pathlib.Path(pdf_path).resolve() for pdf_path in pdf_paths]
+    root = pathlib.Path(os.path.commonpath([pdf_path.parent for pdf_path in pdf_paths])) if pdf_paths else None
+    output_paths = [output_dir / pdf_path.relative_to(root).with_suffix(f'.{output_format}')
+                    for pdf_path in pdf_paths]
+    seen: dict = {}
+    for pdf_path, output_path in zip(pdf_paths, output_paths):
+        key = os.path.normcase(output_path)  # Windows paths differing only in case are the same file
+        if key in seen:
+            raise ValueError(f'{seen[key]} and {pdf_path} would both be written to {output_path}')
+        seen[key] = pdf_path
+    return output_paths
+
+
+def group_identical(pdf_paths: list) -> dict:
+    """
+    Groups the documents by content. Identical documents would run with the same run journal, which only one run at a
+    time may write, and would give the same result anyway.
+
+    :param pdf_paths: List of PDF paths.
+    :return: Dict from the index of the first document of every content to the indices of the identical ones.
+    """
+    groups: dict = {}
+    for index, pdf_path in enumerate(pdf_paths):
+        groups.setdefault(PageTextCache.make_key(pdf_path, {}), []).append(index)
+    return {indices[0]: indices[1:] for indices in groups.values()}
+
+
+def copy_result(result: dict, pdf_path: pathlib.Path, output_path: pathlib.Path) -> dict:
+    """Returns the result of an identical document for pdf_path, with a copy of its output file if it succeeded."""
+    copied = dict(result, pdf=str(pdf_path), identical_to=result['pdf'], seconds=0.0)
+    if result['error'] is None:
+        try:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(result['output'], output_path)
+            copied['output'] = str(output_path)
+        except OSError as e:
+            copied.update(output=None, error=f'{type(e).__name__}: {e}')
+    return copied
+
+
+def _init_worker(request_budget) -> None:
+    global _request_budget
+    _request_budget = request_budget
+
+
+def index_document(pdf_path: pathlib.Path, output_path: pathlib.Path, exclude_pages: list, pages_offset: int,
+                   max_in_flight: int) -> dict:
+    """
+    Indexes one document in a worker process and writes its names to output_path (.csv or .parquet).
+
+    :return: Dict with the result of the document, including the error if it failed.
+    """
+    start_time = time.perf_counter()
+    result = {'pdf': str(pdf_path), 'output': None, 'pages': 0, 'chunks': 0, 'names': 0, 'error': None}
+    try:
+        names_df = pd.DataFrame()
+        for names_df, progress in pipeline.stream_index_for_names(str(pdf_path), exclude_pages=exclude_pages,
+                                                                 pages_offset=pages_offset,
+                                                                 max_in_flight=max_in_flight,
+                                                                 request_budget=_request_budget,
+                                                                 extract_workers=1):
+            result['pages'] = progress['total_pages']
+            result['chunks'] = progress['chunks_done']
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        if output_path.suffix == '.parquet':
+            names_df.to_parquet(output_path)
+        else:
+            names_df.to_csv(output_path)
+        result['output'] = str(output_path)
+        result['names'] = len(names_df)
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+        traceback.print_exc()
+    result['seconds'] = time.perf_counter() - start_time
+    return result
+
+
+def run_batch(pdf_paths: list, output_dir: pathlib.Path, output_format: str = 'csv', workers: int = 2,
+              max_in_flight: int = Constants.LLM_MAX_IN_FLIGHT, exclude_pages: list | None = None,
+              pages_offset: int = 0) -> dict:
+    """
+    Indexes all documents with a process pool and writes the summary.
+
+    :param pdf_paths: List of PDF paths.
+    :param output_dir: Directory of the results.
+    :param output_format: 'csv' or 'parquet'.
+    :param workers: Number of documents processed at the same time.
+    :param max_in_flight: Maximum number of concurrent LLM requests of all workers together.
+    :param exclude_pages: Page numbers to skip in the page lookup.
+    :param pages_offset: Offset added to all found page numbers.
+    :return: The summary.
+    :raises ValueError: If two documents would be written to the same file, see make_output_paths.
+    """
+    output_paths = make_output_paths(pdf_paths, output_dir, output_format)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    start_time = time.perf_counter()
+    identical = group_identical(pdf_paths)
+    results = []
+    with multiprocessing.Manager() as manager:
+        request_budget = manager.BoundedSemaphore(max_in_flight)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(request_budget,)) as executor:
+            futures = {executor.submit(index_document, pdf_paths[index], output_paths[index], exclude_pages or [],
+                                       pages_offset, max_in_flight): index for index in identical}
+            for future in as_completed(futures):
+                result = future.result()
+                document_results = [result] + [copy_result(result, pdf_paths[index], output_paths[index])
+                                               for index in identical[futures[future]]]
+                for document_result in document_results:
+                    results.append(document_result)
+                    status = f"failed: {document_result['error']}" if document_result['error'] \
+                        else f"{document_result['names']} names"
+                    if 'identical_to' in document_result:
+                        status += f" (identical to {document_result['identical_to']})"
+                    print(f"[{len(results)}/{len(pdf_paths)}] {document_result['pdf']}: {status} "
+                          f"in {document_result['seconds']:.0f}s")
+
+    seconds = time.perf_counter() - start_time
+    succeeded = [r for r in results if r['error'] is None]
+    summary = {'documents': len(results),
+               'succeeded': len(succeeded),
+               'failed': len(results) - len(succeeded),
+               'pages': sum(r['pages'] for r in succeeded),
+               'names': sum(r['names'] for r in succeeded),
+               'seconds': seconds,
+               'documents_per_hour': 3600 * len(succeeded) / seconds if seconds > 0 else 0.0,
+               'pages_per_hour': 3600 * sum(r['pages'] for r in succeeded) / seconds if seconds > 0 else 0.0,
+               'failures': [{'pdf': r['pdf'], 'error': r['error']} for r in results if r['error'] is not None],
+               'results': sorted(results, key=lambda r: r['pdf'])}
+    (output_dir / 'summary.json').write_text(json.dumps(summary, indent=2), encoding='utf-8')
+    return summary
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Indexes the person names of many PDFs without the UI.')
+    parser.add_argument('inputs', nargs='+', help='PDF files, directories or glob patterns')
+    parser.add_argument('--output-dir', default='index_results', help='directory of the results')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default='csv', help='output format per document')
+    parser.add_argument('--workers', type=int, default=2, help='documents processed at the same time')
+    parser.add_argument('--max-in-flight', type=int, default=max(Constants.LLM_MAX_IN_FLIGHT, 2),
+                        help='concurrent LLM requests of all workers together')
+    parser.add_argument('--pages-offset', type=int, default=0, help='offset added to all found page numbers')
+    parser.add_argument('--exclude-pages', type=int, nargs='*', default=[], help='page numbers to skip')
+    args = parser.parse_args()
+
+    if args.format == 'parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error('--format parquet needs pyarrow, install it or use --format csv')
+    pdf_paths = find_pdfs(args.inputs)
+    if not pdf_paths:
+        parser.error('no PDF files found')
+
+    print(f'Indexing {len(pdf_paths)} documents with {args.workers} workers and {args.max_in_flight} LLM requests')
+    try:
+        summary = run_batch(pdf_paths, pathlib.Path(args.output_dir), args.format, args.workers, args.max_in_flight,
+                            args.exclude_pages, args.pages_offset)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Done: {summary['succeeded']}/{summary['documents']} documents, {summary['names']} names, "
+          f"{summary['documents_per_hour']:.1f} documents/h, {summary['pages_per_hour']:.0f} pages/h")
+    for failure in summary['failures']:
+        print(f"FAILED {failure['pdf']}: {failure['error']}")
+
+
+if __name__ == "__main__":
+    main()
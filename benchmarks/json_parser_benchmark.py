@@ -0,0 +1,134 @@
+"""
+Regression corpus and benchmark of JsonStrToDict: the previous regex based parser with its recursive repair loop
+(copied below as reference) and the current single pass lenient parser.
+
+Run from the repository root: python -m benchmarks.json_parser_benchmark
+"""
+import contextlib
+import io
+import json
+import re
+import time
+
+from utils.json_utils import JsonStrToDict
+from utils.other_utils import flatten_list
+
+# (answer, expected result of json_to_dict), the first cases are the examples of utils/json_utils.py
+REGRESSION_CORPUS = [
+    ('[{"name": "Alice", "age": 30}, {"name": "Bob", "age": 25}]',
+     [{'name': 'Alice', 'age': 30}, {'name': 'Bob', 'age': 25}]),
+    ('Random text before [{"name": "Charlie", "age": "35"}] and after', [{'name': 'Charlie', 'age': '35'}]),
+    ('Malformed JSON [{"name": "Dana", "age": 40,] Missing bracket', [{'name': 'Dana', 'age': 40}]),
+    ('{"name": "Eve", "age": 28}', [{'name': 'Eve', 'age': 28}]),
+    (None, []),
+    ('No JSON here', []),
+    ('[{"name": "Frank", "age": 33}], [{"name": "Grace", "age": "25"}]',
+     [{'name': 'Frank', 'age': 33}, {'name': 'Grace', 'age': '25'}]),
+    ('[{"name": "Heidi", "age": 45}, {"name": "Ivan", "age":, "city": "Berlin"}]',
+     [{'name': 'Heidi', 'age': 45}, {'name': 'Ivan', 'age': None, 'city': 'Berlin'}]),
+    ('[{"name": "Judy", "age": 29}, {"name": "Karl", "age": 31,}]',
+     [{'name': 'Judy', 'age': 29}, {'name': 'Karl', 'age': 31}]),
+    ('Invalid JSON [{name: "Leo", age: 22}, {name: "Mona", age: 27}]',
+     [{'name': 'Leo', 'age': 22}, {'name': 'Mona', 'age': 27}]),
+    # typical LLM answers
+    ('no name found', []),
+    ('Here: [{"First Name": "-", "Last Name": "O\'Neil"}]', [{'First Name': '-', 'Last Name': "O'Neil"}]),
+    ("[{'First Name': 'Hans Günther', 'Last Name': 'Mayer'},]",
+     [{'First Name': 'Hans Günther', 'Last Name': 'Mayer'}]),
+    ('[[{"First Name": "-", "Last Name": "Krieber"}]]', [{'First Name': '-', 'Last Name': 'Krieber'}]),
+    ('[{"First Name": "A", "Last Name": "B"},\n {"First Name": "C"', [{'First Name': 'A', 'Last Name': 'B'}]),
+    ('[{"First Name": "-", "Last Name": "Krieber"}],\n[{"First Name": "Hans", "Last Name": "Mayer"}] I hope this helps',
+     [{'First Name': '-', 'Last Name': 'Krieber'}, {'First Name': 'Hans', 'Last Name': 'Mayer'}]),
+]
+
+
+class LegacyJsonStrToDict:
+    """The parser before the rewrite, without its docstrings."""
+
+    def __init__(self, max_attempts: int = 3):
+        self.max_attempts = max_attempts
+
+    def json_to_dict(self, json_str: str) -> list:
+        if json_str is None:
+            return []
+        json_str = json_str.replace("\n", "").replace("'", '"')
+        match_all = re.findall(r"\[.*?]", json_str)
+        if len(match_all) == 0:
+            match_all = re.findall(r"\{.*?}", json_str)
+            match_all = re.findall(r"\[.*?]", str(match_all))
+        json_list = []
+        if match_all:
+            for element in match_all:
+                try:
+                    json_list.extend(json.loads(element))
+                except json.JSONDecodeError:
+                    if self.max_attempts > 0:
+                        return self.json_to_dict(self.fix_json_string(str(match_all)))
+        return json_list
+
+    def fix_json_string(self, json_str: str) -> str:
+        json_str = re.sub(r'[^\{\}\[\]\,\"\:\w\s\.\-]', "", json_str)
+        potential_objects = re.findall(r"\{.*?}", json_str) or re.findall(r"\[.*?]", json_str)
+        if not potential_objects:
+            return "[]"
+        data_list = []
+        for obj_str in potential_objects:
+            obj_str = re.sub(r"'", '"', obj_str)
+            obj_str = re.sub(r"(\w+)\s*:", r'"\1":', obj_str)
+            obj_str = re.sub(r':\s*([^,"\{\}\[\]]+)\s*(,|\})', r': "\1"\2', obj_str)
+            try:
+                data_list.append(json.loads(obj_str))
+            except json.JSONDecodeError:
+                split_string = flatten_list([s.split('"') for s in obj_str.split(",")])
+                split_string = flatten_list([s.split(":") for s in split_string])
+                split_string = [s for s in split_string if any(c.isalnum() for c in s)]
+                rebuilt = str(dict(zip(split_string[0::2], split_string[1::2])))
+                try:
+                    data_list.append(json.loads(rebuilt))
+                except json.JSONDecodeError:
+                    pass
+        return json.dumps(data_list)
+
+
+def run_regression() -> bool:
+    """Checks the current parser against the corpus, returns True if all answers are parsed as expected."""
+    parser = JsonStrToDict()
+    failures = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = [parser.json_to_dict(answer) for answer, _ in REGRESSION_CORPUS]
+    for (answer, expected), result in zip(REGRESSION_CORPUS, results):
+        if result != expected:
+            failures += 1
+            print(f'FAILED {answer!r}\n  expected {expected}\n  got      {result}')
+    print(f'regression corpus: {len(REGRESSION_CORPUS) - failures}/{len(REGRESSION_CORPUS)} passed')
+    return failures == 0
+
+
+def make_answer(names: int, malformed: bool) -> str:
+    """LLM-like answer with prose around a list of names, optionally with single quotes and trailing commas."""
+    if malformed:
+        objects = ", ".join(f"{{'First Name': 'First{i}', Last Name: 'Last{i}',}}" for i in range(names))
+    else:
+        objects = ", ".join(f'{{"First Name": "First{i}", "Last Name": "Last{i}"}}' for i in range(names))
+    return f'Here are the names from the text: [{objects}] I hope this helps.'
+
+
+def run_benchmark(name_counts: tuple = (10, 100, 1000), repeat: int = 20) -> None:
+    parsers = [('legacy', LegacyJsonStrToDict()), ('current', JsonStrToDict())]
+    print(f"{'names':>6} | {'answer':<9} | {'parser':<8} | {'parsed':>6} | {'time':>10}")
+    for names in name_counts:
+        for malformed in (False, True):
+            answer = make_answer(names, malformed)
+            for parser_name, parser in parsers:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    for _ in range(repeat):
+                        result = parser.json_to_dict(answer)
+                    seconds = (time.perf_counter() - start) / repeat
+                print(f"{names:>6} | {'malformed' if malformed else 'valid':<9} | {parser_name:<8} | "
+                      f"{len(result):>6} | {seconds * 1000:>8.3f}ms")
+
+
+if __name__ == "__main__":
+    run_regression()
+    run_benchmark()
@@ -0,0 +1,348 @@
+"""
+Local fake of the OpenAI compatible /v1/chat/completions endpoint for load tests without a GPU.
+
+Answers with the cited names found in the last user message (JSON list, or a JSON object keyed by chunk id for
+batched prompts), streamed or not, after a configurable latency and at a configurable tokens/s rate. Errors, 429
+rate limits, malformed answers and streams breaking off are injected with configurable probabilities, and the number
+of requests served at the same time can be capped like on a real GPU server.
+
+Run from the repository root, then point Constants.LLM_URL to http://127.0.0.1:8000/v1/:
+    python -m benchmarks.llm_stub_server --port 8000 --latency 0.5 --tokens-per-second 40 --rate-limit-rate 0.05
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Constants import Constants
+from utils.citation_extractor import NAME, YEAR, CitationExtractor
+
+CHUNK_MARKER = re.compile(r'^### CHUNK (\d+)\n', re.MULTILINE)
+NARRATIVE_CITATION = re.compile(rf'\b({NAME})\s+({NAME})\s*\(\s*{YEAR}')
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    """Does not print the connections closed by the client, e.g. after the streaming early stop."""
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address) -> None:
+        if not isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            super().handle_error(request, client_address)
+
+
+def find_names(text: str, extractor: CitationExtractor) -> list:
+    """Names an LLM would answer for the text: "First Last (2017" with first name, other citations without."""
+    names = {last: first for first, last in NARRATIVE_CITATION.findall(text)}
+    rows, _ = extractor.extract(text)
+    for row in rows:
+        names.setdefault(row[Constants.EXTRACT_COLUMN_KEYS[1]], '-')
+    return [{Constants.EXTRACT_COLUMN_KEYS[0]: first, Constants.EXTRACT_COLUMN_KEYS[1]: last}
+            for last, first in names.items()]
+
+
+def malform(answer: str, rng: random.Random) -> str:
+    """Turns a valid JSON answer into one of the typical malformed LLM answers."""
+    kind = rng.choice(('quotes', 'prose', 'truncated'))
+    if kind == 'quotes':
+        return answer.replace('"', "'").replace('}', ',}')
+    if kind == 'prose':
+        return f'Sure! Here are the names from the text:\n{answer}\nI hope this helps.'
+    return answer[:max(len(answer) * 2 // 3, 1)]
+
+
+class StubLLMServer:
+    """
+    OpenAI compatible stub server on a background thread.
+
+    :param port: Port to listen on, 0 picks a free port.
+    :param latency: Mean time to the first token in seconds.
+    :param latency_distribution: 'fixed', 'uniform' (0.5 to 1.5 times the mean), 'exponential' or 'lognormal'.
+    :param tokens_per_second: Generation speed of the answer tokens, 0 answers at once.
+    :param error_rate: Probability of a 500 or 503 error.
+    :param rate_limit_rate: Probability of a 429 answer.
+    :param retry_after: Retry-After header of the 429 answers in seconds, None sends none.
+    :param malformed_rate: Probability of a malformed answer (single quotes, prose around it or cut off).
+    :param stream_abort_rate: Probability of a streamed answer breaking off after half of its tokens, by closing the
+                              connection or by an error event.
+    :param max_concurrency: Number of requests generated at the same time, further requests queue. None is unlimited.
+    :param seed: Seed of the random injections.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.2, latency_distribution: str = 'lognormal',
+                 tokens_per_second: float = 50.0, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float | None = 0.1, malformed_rate: float = 0.0, stream_abort_rate: float = 0.0,
+                 max_concurrency: int | None = None, seed: int = 0) -> None:
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f'latency_distribution must be one of {LATENCY_DISTRIBUTIONS}')
+        self.latency = latency
+        self.latency_distribution = latency_distribution
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.malformed_rate = malformed_rate
+        self.stream_abort_rate = stream_abort_rate
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.extractor = CitationExtractor()
+        self.requests: list = []  # one dict per request: status, start, end, queue_s, output_tokens
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.server = QuietHTTPServer(('127.0.0.1', port), self._make_handler())
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_port}/v1/'
+
+    def start(self) -> 'StubLLMServer':
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> 'StubLLMServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.requests = []
+
+    def get_stats(self) -> dict:
+        """Counts per status, latency percentiles of the successful requests and the time any request was served."""
+        with self._lock:
+            requests = list(self.requests)
+        latencies = sorted(r['end'] - r['start'] for r in requests if r['status'] == 200)
+        statuses: dict = {}
+        for request in requests:
+            statuses[request['status']] = statuses.get(request['status'], 0) + 1
+        return {'requests': len(requests),
+                'statuses': statuses,
+                'latency_p50_s': percentile(latencies, 0.5),
+                'latency_p95_s': percentile(latencies, 0.95),
+                'latency_p99_s': percentile(latencies, 0.99),
+                'queue_mean_s': sum(r['queue_s'] for r in requests) / len(requests) if requests else None,
+                'output_tokens': sum(r['output_tokens'] for r in requests),
+                'busy_s': busy_time([(r['start'], r['end']) for r in requests])}
+
+    def _sample_latency(self) -> float:
+        with self._lock:
+            if self.latency_distribution == 'uniform':
+                return self._rng.uniform(0.5 * self.latency, 1.5 * self.latency)
+            if self.latency_distribution == 'exponential':
+                return self._rng.expovariate(1 / self.latency) if self.latency > 0 else 0.0
+            if self.latency_distribution == 'lognormal' and self.latency > 0:
+                sigma = 0.5
+                return self._rng.lognormvariate(0, sigma) * self.latency / math.exp(sigma ** 2 / 2)  # mean = latency
+            return self.latency
+
+    def _draw(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _answer(self, prompt: list) -> str:
+        user_text = next((m['content'] for m in reversed(prompt) if m.get('role') == 'user'), '')
+        markers = list(CHUNK_MARKER.finditer(user_text))
+        if markers:
+            ends = [m.start() for m in markers[1:]] + [len(user_text)]
+            answer = json.dumps({m.group(1): find_names(user_text[m.end():end], self.extractor)
+                                 for m, end in zip(markers, ends)})
+        else:
+            names = find_names(user_text, self.extractor)
+            answer = json.dumps(names) if names else 'no name found'
+        if self._draw() < self.malformed_rate:
+            with self._lock:
+                answer = malform(answer, self._rng)
+        return answer
+
+    def _record(self, status: int, start: float, queue_s: float = 0.0, output_tokens: int = 0) -> None:
+        with self._lock:
+            self.requests.append({'status': status, 'start': start, 'end': time.perf_counter(), 'queue_s': queue_s,
+                                  'output_tokens': output_tokens})
+
+    def _make_handler(self):
+        stub = self
+
+        class StubHandler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like a real server
+
+            def do_POST(self):
+                start = time.perf_counter()
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path.rstrip('/') != '/v1/chat/completions':
+                    # e.g. the /api/show request for the context length: neither counted nor delayed nor failed
+                    self._send_json(404, {'error': {'message': f'{self.path} not found', 'type': 'not_found'}})
+                    return
+                draw = stub._draw()
+                if draw < stub.rate_limit_rate:
+                    headers = {'Retry-After': str(stub.retry_after)} if stub.retry_after is not None else {}
+                    self._send_json(429, {'error': {'message': 'rate limited', 'type': 'rate_limit'}}, headers)
+                    stub._record(429, start)
+                    return
+                if draw < stub.rate_limit_rate + stub.error_rate:
+                    status = 500 if stub._draw() < 0.5 else 503
+                    self._send_json(status, {'error': {'message': 'injected error', 'type': 'server_error'}})
+                    stub._record(status, start)
+                    return
+                if stub.slots is not None:
+                    stub.slots.acquire()
+                queue_s = time.perf_counter() - start
+                pieces: list = []
+                status = 200
+                try:
+                    answer = stub._answer(request.get('messages', []))
+                    pieces = re.findall(r'.{1,4}', answer, re.DOTALL)  # about one token each
+                    time.sleep(stub._sample_latency())
+                    if request.get('stream'):
+                        if stub._draw() < stub.stream_abort_rate:
+                            status = 'aborted'
+                            pieces = pieces[:len(pieces) // 2]
+                        self._stream(pieces, request.get('model', 'stub'), aborted=status == 'aborted',
+                                     include_usage=(request.get('stream_options') or {}).get('include_usage', False))
+                    else:
+                        if stub.tokens_per_second > 0:
+                            time.sleep(len(pieces) / stub.tokens_per_second)
+                        self._send_json(200, completion(answer, request.get('model', 'stub'), len(pieces)))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client stopped reading, e.g. streaming early stop
+                finally:
+                    if stub.slots is not None:
+                        stub.slots.release()
+                stub._record(status, start, queue_s, len(pieces))
+
+            def _stream(self, pieces: list, model: str, aborted: bool = False, include_usage: bool = False) -> None:
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for piece in pieces:
+                    if stub.tokens_per_second > 0:
+                        time.sleep(1 / stub.tokens_per_second)
+                    self._write_chunk(f'data: {json.dumps(completion_chunk(piece, model))}\n\n')
+                if aborted:
+                    if stub._draw() < 0.5:
+                        self._write_chunk(f'data: {json.dumps({"error": {"message": "injected stream error"}})}\n\n')
+                        self.wfile.write(b'0\r\n\r\n')
+                    self.close_connection = True  # else the chunked body ends without its last chunk
+                    return
+                self._write_chunk(f'data: {json.dumps(completion_chunk(None, model))}\n\n')
+                if include_usage:
+                    self._write_chunk(f'data: {json.dumps(usage_chunk(len(pieces), model))}\n\n')
+                self._write_chunk('data: [DONE]\n\n')
+                self.wfile.write(b'0\r\n\r\n')
+
+            def _write_chunk(self, data: str) -> None:
+                encoded = data.encode('utf-8')
+                self.wfile.write(f'{len(encoded):x}\r\n'.encode() + encoded + b'\r\n')
+                self.wfile.flush()
+
+            def _send_json(self, status: int, body: dict, headers: dict | None = None) -> None:
+                encoded = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(encoded)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(encoded)
+
+            def log_message(self, *args):
+                pass
+
+        return StubHandler
+
+
+def usage(completion_tokens: int) -> dict:
+    return {'prompt_tokens': 0, 'completion_tokens': completion_tokens, 'total_tokens': completion_tokens}
+
+
+def completion(content: str, model: str, completion_tokens: int = 0) -> dict:
+    return {'id': 'chatcmpl-stub', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+            'usage': usage(completion_tokens)}
+
+
+def completion_chunk(content: str | None, model: str) -> dict:
+    delta = {'content': content} if content is not None else {}
+    return {'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+            'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if content is not None else 'stop'}]}
+
+
+def usage_chunk(completion_tokens: int, model: str) -> dict:
+    """Last chunk of a stream requested with stream_options include_usage."""
+    return {'id': 'chatcmpl-stub', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+            'choices': [], 'usage': usage(completion_tokens)}
+
+
+def percentile(sorted_values: list, fraction: float) -> float | None:
+    return sorted_values[int(fraction * (len(sorted_values) - 1))] if sorted_values else None
+
+
+def busy_time(intervals: list) -> float:
+    """Length of the union of the (start, end) intervals, i.e. the time at least one request was served."""
+    busy = 0.0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                busy += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        busy += current_end - current_start
+    return busy
+
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the settings of the stub server to the command line parser, see StubLLMServer."""
+    parser.add_argument('--latency', type=float, default=0.2, help='Mean time to the first token in seconds.')
+    parser.add_argument('--latency-distribution', default='lognormal', choices=LATENCY_DISTRIBUTIONS)
+    parser.add_argument('--tokens-per-second', type=float, default=50.0, help='Generation speed, 0 answers at once.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of a 500/503 error.')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Probability of a 429 answer.')
+    parser.add_argument('--retry-after', type=float, default=0.1, help='Retry-After of the 429 answers in seconds.')
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help='Probability of a malformed answer.')
+    parser.add_argument('--stream-abort-rate', type=float, default=0.0,
+                        help='Probability of a streamed answer breaking off after half of its tokens.')
+    parser.add_argument('--server-concurrency', type=int, default=None,
+                        help='Requests generated at the same time, like the slots of a GPU server.')
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def server_from_arguments(args: argparse.Namespace, port: int = 0) -> StubLLMServer:
+    return StubLLMServer(port=port, latency=args.latency, latency_distribution=args.latency_distribution,
+                         tokens_per_second=args.tokens_per_second, error_rate=args.error_rate,
+                         rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                         malformed_rate=args.malformed_rate, stream_abort_rate=args.stream_abort_rate,
+                         max_concurrency=args.server_concurrency, seed=args.seed)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='OpenAI compatible stub server for load tests.')
+    parser.add_argument('--port', type=int, default=8000)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+    with server_from_arguments(args, args.port) as stub:
+        print(f'Stub LLM server listening on {stub.url}, Ctrl+C to stop')
+        try:
+            while True:
+                time.sleep(10)
+                print(stub.get_stats())
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+End-to-end load test of the indexing pipeline against the local stub LLM server, for tuning concurrency and batching
+without GPU time. Synthetic PDFs (see stage_benchmark.make_pdf) are indexed with main.index_for_names (or the
+streaming pipeline.stream_index_for_names) for every max_in_flight and batch size setting.
+
+Reported per setting: documents/hour, chunk latency percentiles as seen by the server and by the client, requests
+per status, and the client side overhead, i.e. the share of the wall time in which the server had no request
+to work on (extraction, chunking, prompt building, parsing, page lookup and HTTP overhead).
+
+Run from the repository root:
+    python -m benchmarks.load_test --docs 3 --pages 50 --max-in-flight 1 4 8 --latency 0.3 --rate-limit-rate 0.02
+"""
+import argparse
+import contextlib
+import io
+import json
+import pathlib
+import tempfile
+import time
+
+from API_Connector import openAI
+from Constants import Constants
+from benchmarks.llm_stub_server import add_server_arguments, percentile, server_from_arguments
+from benchmarks.stage_benchmark import RESULTS_DIR, make_names, make_pdf
+
+
+def index_document(pdf_path: pathlib.Path, pipeline_name: str, max_in_flight: int, batch_size: int) -> int:
+    """Indexes the document, returns the number of names found."""
+    if pipeline_name == 'stream':
+        import pipeline
+        names_df = None
+        for names_df, _ in pipeline.stream_index_for_names(pdf_path, max_in_flight=max_in_flight,
+                                                           batch_size=batch_size):
+            pass
+        return 0 if names_df is None else len(names_df)
+    import main
+    return len(main.index_for_names(pdf_path, max_in_flight=max_in_flight, batch_size=batch_size))
+
+
+def run_setting(stub, pdf_paths: list, pipeline_name: str, max_in_flight: int, batch_size: int,
+                verbose: bool) -> dict:
+    """Indexes all documents with one setting and returns its measurements."""
+    stub.reset_stats()
+    connector = openAI.get_shared_connector(stub.url)
+    stats_since = connector.answers
+    names = failed = 0
+    start = time.perf_counter()
+    for pdf_path in pdf_paths:
+        try:
+            with contextlib.redirect_stdout(None if verbose else io.StringIO()):
+                names += index_document(pdf_path, pipeline_name, max_in_flight, batch_size)
+        except Exception as e:
+            failed += 1
+            print(f'{pdf_path.name} failed: {type(e).__name__}: {e}')
+    wall = time.perf_counter() - start
+    server_stats = stub.get_stats()
+    client_latencies = sorted(s['total_s'] for s in connector.get_stream_stats(since=stats_since))
+    return {'pipeline': pipeline_name,
+            'max_in_flight': max_in_flight,
+            'batch_size': batch_size,
+            'docs': len(pdf_paths),
+            'failed_docs': failed,
+            'names': names,
+            'wall_s': wall,
+            'docs_per_hour': 3600 * (len(pdf_paths) - failed) / wall,
+            'client_latency_p50_s': percentile(client_latencies, 0.5),
+            'client_latency_p95_s': percentile(client_latencies, 0.95),
+            'client_latency_p99_s': percentile(client_latencies, 0.99),
+            'client_overhead_share': max(wall - server_stats['busy_s'], 0.0) / wall,
+            'server': server_stats}
+
+
+def print_results(results: list) -> None:
+    def ms(seconds):
+        return f'{seconds * 1000:.0f}' if seconds is not None else '-'
+
+    print(f"{'in flight':>9} | {'batch':>5} | {'docs/h':>8} | {'failed':>6} | {'names':>5} | "
+          f"{'server p50/p95/p99 ms':>21} | {'client p50/p95/p99 ms':>21} | {'overhead':>8} | statuses")
+    for r in results:
+        server = r['server']
+        server_latency = f"{ms(server['latency_p50_s'])}/{ms(server['latency_p95_s'])}/{ms(server['latency_p99_s'])}"
+        client_latency = f"{ms(r['client_latency_p50_s'])}/{ms(r['client_latency_p95_s'])}/" \
+                         f"{ms(r['client_latency_p99_s'])}"
+        print(f"{r['max_in_flight']:>9} | {r['batch_size']:>5} | {r['docs_per_hour']:>8.0f} | {r['failed_docs']:>6} | "
+              f"{r['names']:>5} | {server_latency:>21} | {client_latency:>21} | "
+              f"{r['client_overhead_share']:>8.0%} | {server['statuses']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test of the indexing pipeline against a stub LLM server.')
+    parser.add_argument('--docs', type=int, default=3, help='Number of synthetic documents per setting.')
+    parser.add_argument('--pages', type=int, default=50, help='Pages per document.')
+    parser.add_argument('--names', type=int, default=200, help='Size of the name list cited in the documents.')
+    parser.add_argument('--citation-density', type=float, default=0.1, help='Share of the lines with a citation.')
+    parser.add_argument('--max-in-flight', type=int, nargs='+', default=[1, 4], help='Concurrency settings to test.')
+    parser.add_argument('--batch-size', type=int, nargs='+', default=[1], help='Batch sizes to test.')
+    parser.add_argument('--pipeline', default='index', choices=['index', 'stream'],
+                        help='main.index_for_names or the streaming pipeline.stream_index_for_names.')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the pipeline.')
+    parser.add_argument('--output', type=pathlib.Path, help='Result file, default benchmarks/results/<timestamp>.json.')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    # every setting must send its requests to the stub, nothing may come from a cache or an earlier run
+    Constants.LLM_BACKEND_URLS = []
+    Constants.USE_LLM_CACHE = False
+    Constants.USE_RUN_JOURNAL = False
+    Constants.USE_PDF_TEXT_CACHE = False
+    results = []
+    with server_from_arguments(args) as stub, tempfile.TemporaryDirectory() as tmp_dir:
+        Constants.LLM_URL = stub.url
+        names = make_names(args.names)
+        pdf_paths = []
+        for doc_nr in range(args.docs):
+            pdf_paths.append(pathlib.Path(tmp_dir) / f'load_test_{doc_nr}.pdf')
+            make_pdf(pdf_paths[-1], args.pages, names, args.citation_density, seed=doc_nr)
+        for batch_size in args.batch_size:
+            for max_in_flight in args.max_in_flight:
+                print(f'Running max_in_flight={max_in_flight} batch_size={batch_size} ...')
+                results.append(run_setting(stub, pdf_paths, args.pipeline, max_in_flight, batch_size, args.verbose))
+    print_results(results)
+
+    output_path = args.output or RESULTS_DIR / f"load_test_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    settings = {key: value for key, value in vars(args).items() if key != 'output'}
+    output_path.write_text(json.dumps({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'settings': settings,
+                                       'results': results}, indent=2, default=str), encoding='utf-8')
+    print(f'Results written to {output_path}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark of TextTokenSplitter: chunks per document and split time of the previous character based splitter
+(copied below as reference) and the current token budget filling splitter.
+
+Run from the repository root: python -m benchmarks.splitter_benchmark
+"""
+import math
+import random
+import time
+
+from Constants import Constants
+from utils.str_utils import TextTokenSplitter, clean_text, split_with_overlap
+from utils.token_counter import TokenCounter
+
+
+def legacy_split_text_by_token_paragraphs(text: str) -> list:
+    """The splitter before the rewrite: string concatenation and a character length compared to the token budget."""
+    paragraphs = [split.strip() for split in text.split('\n') if len(split) > 0]
+    token_counter = TokenCounter()
+    tokens_per_paragraph = [token_counter.count_tokens(para) for para in paragraphs]
+    paragraphs_fitted: list = []
+    current_chunk: str = ""
+    for tokens, paragraph in zip(tokens_per_paragraph, paragraphs):
+        if tokens == 0:
+            continue
+        if len(current_chunk) + tokens + 2 < Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH:
+            current_chunk = current_chunk + "\n" + paragraph if current_chunk else paragraph
+        else:
+            if current_chunk:
+                paragraphs_fitted.append(current_chunk)
+            if tokens > Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH:
+                parts = split_with_overlap(paragraph, math.ceil(tokens / Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH),
+                                           Constants.PARAGRAPH_SPLIT_OVERLAP)
+                paragraphs_fitted.append(clean_text(parts[0], 'end'))
+                paragraphs_fitted.extend(clean_text(part, 'both') for part in parts[1:-1])
+                paragraphs_fitted.append(clean_text(parts[-1], 'start'))
+            else:
+                paragraphs_fitted.append(paragraph)
+            current_chunk = ""
+    if current_chunk:
+        paragraphs_fitted.append(current_chunk)
+    return paragraphs_fitted
+
+
+def make_document(pages: int, seed: int = 0) -> str:
+    """Book-like text: about 40 lines per page, some long paragraphs and citations."""
+    rng = random.Random(seed)
+    words = ['theology', 'framework', 'epistemic', 'the', 'of', 'and', 'divine', 'argument', 'analysis', 'modal']
+    lines = []
+    for page in range(pages):
+        lines.append(f'{page + 1} Running Header')
+        for _ in range(40):
+            length = rng.randint(400, 900) if rng.random() < 0.02 else rng.randint(5, 16)
+            line = ' '.join(rng.choice(words) for _ in range(length))
+            if rng.random() < 0.1:
+                line += f' as noted by Krieber ({rng.randint(1950, 2024)}, p. {rng.randint(1, 400)}).'
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def run_benchmark(page_counts: tuple = (10, 100, 400)) -> None:
+    token_counter = TokenCounter()
+    print(f'budget {Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH} tokens (estimate counter)')
+    print(f"{'pages':>6} | {'splitter':<8} | {'chunks':>7} | {'avg tokens':>10} | {'split time':>10}")
+    for pages in page_counts:
+        text = make_document(pages)
+        for name, split in [('legacy', legacy_split_text_by_token_paragraphs),
+                            ('current', TextTokenSplitter().split_text_by_token_paragraphs)]:
+            start = time.perf_counter()
+            chunks = split(text)
+            seconds = time.perf_counter() - start
+            avg_tokens = sum(token_counter.count_tokens_batch(chunks)) / max(len(chunks), 1)
+            print(f'{pages:>6} | {name:<8} | {len(chunks):>7} | {avg_tokens:>10.0f} | {seconds * 1000:>8.1f}ms')
+
+
+if __name__ == "__main__":
+    run_benchmark()
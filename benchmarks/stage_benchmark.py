@@ -0,0 +1,254 @@
+"""
+Microbenchmarks of the CPU bound pipeline stages on synthetic PDFs: text extraction, splitting, token counting,
+JSON parsing of the LLM answers, page lookup of the names and cleaning of the names DataFrame.
+
+The PDFs are generated with pymupdf for every combination of page count and name list size, with configurable
+citation density and footnotes. The timings are stored as JSON, so two runs can be compared and the scaling curves
+(pages x names) plotted.
+
+Run from the repository root:
+    python -m benchmarks.stage_benchmark --pages 10 100 400 --names 50 500
+    python -m benchmarks.stage_benchmark --compare benchmarks/results/<earlier run>.json
+    python -m benchmarks.stage_benchmark --plot benchmarks/results/<run>.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import pathlib
+import platform
+import random
+import re
+import statistics
+import subprocess
+import tempfile
+import time
+
+import pandas as pd
+import pymupdf
+
+from Constants import Constants
+from indexer.index_from_list import find_name_pages
+from utils.json_utils import JsonStrToDict
+from utils.other_utils import clean_pandas_df
+from utils.pdf_document import PdfDocument
+from utils.str_utils import TextTokenSplitter, get_total_pdf_text
+from utils.token_counter import TokenCounter
+
+RESULTS_DIR = pathlib.Path(__file__).parent / 'results'
+STAGES = ('get_total_pdf_text', 'split_text_by_token_paragraphs', 'count_tokens', 'json_to_dict',
+          'find_name_pages', 'clean_pandas_df')
+WORDS = ['theology', 'framework', 'epistemic', 'the', 'of', 'and', 'divine', 'argument', 'analysis', 'modal',
+         'revelation', 'tradition', 'concept', 'in', 'is', 'a', 'reason', 'faith', 'history', 'critique']
+SYLLABLES = ['kri', 'ber', 'man', 'drel', 'os', 'ter', 'lich', 'hau', 'sen', 'wal', 'dorf', 'ro', 'sen', 'ta',
+             'mei', 'er', 'gold', 'stein', 'lin', 'de', 'mann', 'bach', 'hof', 'ner']
+LINES_PER_PAGE = 60
+
+
+def make_names(count: int, seed: int = 0) -> list:
+    """Unique (first name, last name) pairs built from syllables."""
+    rng = random.Random(seed)
+    names: dict = {}
+    while len(names) < count:
+        first = ''.join(rng.choice(SYLLABLES) for _ in range(2)).capitalize()
+        last = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+        names[(first, last)] = None
+    return list(names)
+
+
+def make_pdf(path: pathlib.Path, pages: int, names: list, citation_density: float = 0.1,
+             footnotes_per_page: int = 2, seed: int = 0) -> None:
+    """
+    Writes a book-like PDF: LINES_PER_PAGE lines per page, a share citation_density of them citing a random name
+    ("Hans Krieber (2017, p. 45)" or "(Krieber, 2017)"), and footnotes citing names at the bottom of every page.
+    """
+    rng = random.Random(seed)
+    doc = pymupdf.open()
+    for page_nr in range(pages):
+        lines = [f'{page_nr + 1}    Running Header']
+        for _ in range(LINES_PER_PAGE):
+            line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 14)))
+            if rng.random() < citation_density:
+                first, last = rng.choice(names)
+                year, cited_page = rng.randint(1950, 2024), rng.randint(1, 400)
+                line += f' as argued by {first} {last} ({year}, p. {cited_page}).' if rng.random() < 0.5 \
+                    else f' (see {last}, {year}).'
+            lines.append(line)
+        for footnote_nr in range(footnotes_per_page):
+            first, last = rng.choice(names)
+            lines.append(f'{page_nr * footnotes_per_page + footnote_nr + 1}\tSee {first} {last}, '
+                         f'{rng.choice(WORDS).capitalize()}, p. {rng.randint(1, 400)}.')
+        page = doc.new_page()
+        page.insert_text((36, 36), '\n'.join(lines), fontsize=6)
+    doc.save(path)
+    doc.close()
+
+
+def make_answers(chunks: list, names: list, malformed_share: float = 0.2, seed: int = 0) -> list:
+    """LLM-like answers with the names cited in every chunk, a share of them with single quotes and trailing commas."""
+    rng = random.Random(seed)
+    last_names = {last: first for first, last in names}
+    last_name_regex = re.compile(r'\b(' + '|'.join(map(re.escape, last_names)) + r')\b')
+    answers = []
+    for chunk in chunks:
+        cited = dict.fromkeys(last_name_regex.findall(chunk))
+        if not cited:
+            answers.append('no name found')
+        elif rng.random() < malformed_share:
+            objects = ', '.join(f"{{'First Name': '{last_names[last]}', 'Last Name': '{last}',}}" for last in cited)
+            answers.append(f'Here are the names: [{objects},]')
+        else:
+            answers.append(json.dumps([{'First Name': last_names[last], 'Last Name': last} for last in cited]))
+    return answers
+
+
+def time_stage(function, repeat: int) -> tuple:
+    """Runs the function repeat times with its prints suppressed, returns (last result, list of seconds)."""
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = function()
+            seconds.append(time.perf_counter() - start)
+    return result, seconds
+
+
+def run_case(pdf_path: pathlib.Path, names: list, count_typ: str, repeat: int) -> dict:
+    """Times all stages on one synthetic PDF, returns {stage: (items, seconds)}."""
+    document = PdfDocument.from_pdf(pdf_path, workers=1, text_cache=None)
+    timings = {}
+    text, seconds = time_stage(lambda: get_total_pdf_text(pdf_path), repeat)
+    timings['get_total_pdf_text'] = (len(document), seconds)
+
+    splitter = TextTokenSplitter(count_typ=count_typ)
+    chunks, seconds = time_stage(lambda: splitter.split_text_by_token_paragraphs(text), repeat)
+    timings['split_text_by_token_paragraphs'] = (len(chunks), seconds)
+
+    token_counter = TokenCounter(count_typ=count_typ)
+    _, seconds = time_stage(lambda: [token_counter.count_tokens(chunk) for chunk in chunks], repeat)
+    timings['count_tokens'] = (len(chunks), seconds)
+
+    answers = make_answers(chunks, names)
+    json_parser = JsonStrToDict()
+    parsed, seconds = time_stage(lambda: [row for answer in answers for row in json_parser.json_to_dict(answer)],
+                                 repeat)
+    timings['json_to_dict'] = (len(answers), seconds)
+
+    name_ids = [f'{first}_{last}' for first, last in names]
+    _, seconds = time_stage(lambda: find_name_pages(name_ids, document.pages, exclude_pages=[],
+                                                    footnote_patterns=Constants.FOOTNOTE_RE_PATTERNS), repeat)
+    timings['find_name_pages'] = (len(name_ids), seconds)
+
+    names_df = pd.DataFrame(parsed, columns=Constants.EXTRACT_COLUMN_KEYS)
+    _, seconds = time_stage(lambda: clean_pandas_df(names_df.copy()), repeat)
+    timings['clean_pandas_df'] = (len(names_df), seconds)
+    return timings
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(page_counts: list, name_counts: list, citation_density: float, footnotes_per_page: int,
+                  count_typ: str, repeat: int) -> dict:
+    """Runs all stages for every (pages, names) combination and returns the results with the run metadata."""
+    Constants.USE_PDF_TEXT_CACHE = False  # time the extraction, not the text cache
+    results = []
+    print(f"{'stage':<31} | {'pages':>5} | {'names':>5} | {'items':>6} | {'median':>10} | {'min':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for pages in page_counts:
+            for name_count in name_counts:
+                names = make_names(name_count)
+                pdf_path = pathlib.Path(tmp_dir) / f'synthetic_{pages}_{name_count}.pdf'
+                make_pdf(pdf_path, pages, names, citation_density, footnotes_per_page)
+                for stage, (items, seconds) in run_case(pdf_path, names, count_typ, repeat).items():
+                    result = {'stage': stage, 'pages': pages, 'names': name_count, 'items': items,
+                              'median_s': statistics.median(seconds), 'min_s': min(seconds), 'repeat': repeat}
+                    results.append(result)
+                    print(f"{stage:<31} | {pages:>5} | {name_count:>5} | {items:>6} | "
+                          f"{result['median_s'] * 1000:>8.2f}ms | {result['min_s'] * 1000:>8.2f}ms")
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_commit': get_git_commit(),
+            'python': platform.python_version(),
+            'pymupdf': pymupdf.VersionBind,
+            'platform': platform.platform(),
+            'settings': {'citation_density': citation_density, 'footnotes_per_page': footnotes_per_page,
+                         'count_typ': count_typ, 'pdf_extract_workers': Constants.PDF_EXTRACT_WORKERS,
+                         'text_split_max_token_length': Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH},
+            'results': results}
+
+
+def compare_runs(base: dict, current: dict) -> None:
+    """Prints the median time of every stage and size of the current run relative to the base run."""
+    base_results = {(r['stage'], r['pages'], r['names']): r for r in base['results']}
+    print(f"compared to {base.get('git_commit')} ({base.get('created')}), ratio > 1 is slower")
+    print(f"{'stage':<31} | {'pages':>5} | {'names':>5} | {'base':>10} | {'current':>10} | {'ratio':>6}")
+    for result in current['results']:
+        base_result = base_results.get((result['stage'], result['pages'], result['names']))
+        if base_result is None:
+            continue
+        ratio = result['median_s'] / max(base_result['median_s'], 1e-12)
+        print(f"{result['stage']:<31} | {result['pages']:>5} | {result['names']:>5} | "
+              f"{base_result['median_s'] * 1000:>8.2f}ms | {result['median_s'] * 1000:>8.2f}ms | {ratio:>6.2f}")
+
+
+def plot_run(run: dict, output_path: pathlib.Path) -> None:
+    """Plots the median time over the page count, one panel per stage and one line per name list size."""
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print('Plotting needs matplotlib: pip install matplotlib')
+        return
+    fig, axes = plt.subplots(2, 3, figsize=(15, 8))
+    for ax, stage in zip(axes.flat, STAGES):
+        stage_results = [r for r in run['results'] if r['stage'] == stage]
+        for name_count in sorted({r['names'] for r in stage_results}):
+            points = sorted((r['pages'], r['median_s'] * 1000) for r in stage_results if r['names'] == name_count)
+            ax.plot([p for p, _ in points], [ms for _, ms in points], marker='o', label=f'{name_count} names')
+        ax.set_title(stage)
+        ax.set_xlabel('pages')
+        ax.set_ylabel('median ms')
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.legend()
+    fig.suptitle(f"{run.get('git_commit')} {run.get('created')}")
+    fig.tight_layout()
+    fig.savefig(output_path)
+    print(f'Plot written to {output_path}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Microbenchmarks of the CPU bound pipeline stages.')
+    parser.add_argument('--pages', type=int, nargs='+', default=[10, 100, 400], help='Page counts of the PDFs.')
+    parser.add_argument('--names', type=int, nargs='+', default=[50, 500], help='Sizes of the name list.')
+    parser.add_argument('--citation-density', type=float, default=0.1, help='Share of the lines with a citation.')
+    parser.add_argument('--footnotes', type=int, default=2, help='Footnotes per page.')
+    parser.add_argument('--count-typ', default='estimate', choices=['estimate', 'local', 'openAI'],
+                        help='Token counter of the split and count stages.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage, the median and minimum are stored.')
+    parser.add_argument('--output', type=pathlib.Path, help='Result file, default benchmarks/results/<timestamp>.json.')
+    parser.add_argument('--compare', type=pathlib.Path, help='Earlier result file to compare this run with.')
+    parser.add_argument('--plot', type=pathlib.Path, help='Only plot the scaling curves of this result file.')
+    args = parser.parse_args()
+
+    if args.plot:
+        plot_run(json.loads(args.plot.read_text(encoding='utf-8')), args.plot.with_suffix('.png'))
+        return
+    run = run_benchmark(args.pages, args.names, args.citation_density, args.footnotes, args.count_typ, args.repeat)
+    output_path = args.output or RESULTS_DIR / f"stage_benchmark_{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    output_path.write_text(json.dumps(run, indent=2), encoding='utf-8')
+    print(f'Results written to {output_path}')
+    if args.compare:
+        compare_runs(json.loads(args.compare.read_text(encoding='utf-8')), run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark of TokenCounter: counting per call with the tokenizer loaded on every call (the behaviour before the
+process-wide tokenizers) vs. the shared tokenizer, the batch API and the memo, on the lines of a book-like document
+whose running headers and footers repeat on every page.
+
+Run from the repository root: python -m benchmarks.token_counter_benchmark
+"""
+import random
+import timeit
+
+import tiktoken
+from sentencepiece import SentencePieceProcessor
+
+from Constants import Constants
+from utils.token_counter import TokenCounter
+
+BATCH_SIZE = 256  # paragraphs counted at once by TextTokenSplitter
+
+
+def make_lines(pages: int, lines_per_page: int = 35, seed: int = 0) -> list:
+    """
+    Lines of a book: the book title as header of the even pages and the chapter title of the odd pages, a copyright
+    footer on every page and unique body lines, as the text of a PDF is split into paragraphs.
+    """
+    rng = random.Random(seed)
+    words = ['theology', 'framework', 'epistemic', 'the', 'of', 'and', 'divine', 'argument', 'analysis', 'modal',
+             'ontology', 'reasoning', 'within', 'perfect', 'being', 'attributes', 'paradox', 'structures']
+    lines = []
+    for page in range(pages):
+        chapter = page // 20 + 1
+        lines.append('Epistemic Theology and Its Discontents' if page % 2 == 0
+                     else f'Chapter {chapter}: The Ontological Paradox Revisited')
+        for _ in range(lines_per_page):
+            line = ' '.join(rng.choice(words) for _ in range(rng.randint(8, 16)))
+            if rng.random() < 0.1:
+                line += f' as noted by Krieber ({rng.randint(1950, 2024)}, p. {rng.randint(1, 400)}).'
+            lines.append(line)
+        lines.append('© 2019 Academic Press. All rights reserved.')
+    return lines
+
+
+def count_reloading_tokenizer(lines: list, count_typ: str) -> list:
+    """Counting before the shared tokenizers: the tokenizer is loaded again for every text."""
+    if count_typ == 'openAI':
+        return [len(tiktoken.get_encoding(tiktoken.encoding_for_model(Constants.TOKENIZER_MODEL).name).encode(line))
+                for line in lines]
+    if count_typ == 'local':
+        return [len(SentencePieceProcessor(model_file=Constants.TOKENIZER_LOCAL_MODEL_PATH).EncodeAsIds(line))
+                for line in lines]
+    return [TokenCounter(count_typ).count_tokens(line) for line in lines]
+
+
+def count_in_batches(counter: TokenCounter, lines: list) -> list:
+    counts = []
+    for start in range(0, len(lines), BATCH_SIZE):
+        counts.extend(counter.count_tokens_batch(lines[start:start + BATCH_SIZE]))
+    return counts
+
+
+def run_benchmark(pages: int = 150) -> None:
+    lines = make_lines(pages)
+    repeated = len(lines) - len(set(lines))
+    print(f'{len(lines)} lines of {pages} pages, {repeated} ({repeated / len(lines):.0%}) repeat an earlier line')
+    for typ in ['estimate', 'openAI', 'local']:
+        try:
+            counter = TokenCounter(count_typ=typ)
+            expected = [counter.count_tokens(line) for line in lines]
+            assert count_in_batches(counter, lines) == expected
+            assert count_in_batches(TokenCounter(count_typ=typ, memo_size=1024), lines) == expected
+            timings = {'before (per call)': timeit.timeit(lambda: count_reloading_tokenizer(lines, typ), number=1),
+                       'count_tokens loop': timeit.timeit(lambda: [counter.count_tokens(line) for line in lines],
+                                                          number=1),
+                       'count_tokens_batch': timeit.timeit(lambda: count_in_batches(counter, lines), number=1),
+                       # a new counter per run, so the memo starts empty like for every document
+                       'count_tokens_batch + memo': timeit.timeit(
+                           lambda: count_in_batches(TokenCounter(count_typ=typ, memo_size=1024), lines), number=1)}
+        except (OSError, RuntimeError) as e:  # e.g. missing local tokenizer model
+            print(f'{typ}: skipped ({e})')
+            continue
+        base = timings['before (per call)']
+        for name, seconds in timings.items():
+            print(f'{typ:>8} | {name:<26} | {seconds * 1000:9.2f} ms | speedup x{base / seconds:6.1f}')
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -1,31 +1,24 @@
 import pathlib
+import time
 
-import pymupdf
 import re
 from Constants import Constants
+from indexer.name_matcher import NamePageMatcher
+from indexer.page_word_index import PageWordIndex
+from utils.pdf_document import PdfDocument
 
 
-def read_pdf_pages(pdf_path: str | pathlib.Path) -> dict[int:str]:
+def read_pdf_pages(pdf_path: str | pathlib.Path, word_index: PageWordIndex | None = None) -> dict[int:str]:
     """
     Reads a PDF file and extracts text from each page.
 
     :param pdf_path: The path to the PDF file.
     :type pdf_path: str
+    :param word_index: Optional inverted word index that is filled with the words of each page during extraction.
     :return: A dictionary where keys are page numbers (starting from 1) and values are the extracted text.
     :rtype: dict
     """
-    # Open the PDF file
-    doc = pymupdf.open(pdf_path)
-    pdf_text = {}
-
-    # Extract text from each page
-    for page in doc:
-        text = page.get_text()
-        page_number = page.number + 1  # Page numbers are zero-indexed in PyMuPDF
-        pdf_text[page_number] = text
-
-    doc.close()
-    return pdf_text
+    return PdfDocument.from_pdf(pdf_path, word_index=word_index).pages
 
 
 def filter_positive_matches(text, positive_pattern, negative_patterns,
@@ -75,65 +68,104 @@ def remove_split_char(input_text: str, split_char: str, return_part: int = 0) ->
 
 
 def find_name_pages(names: list, pdf_text: dict[int:str],
-                    exclude_pages: list, footnote_patterns: str,
-                    remove_part_split_char: str | None = None):
-    name_pages = {name: [] for name in names}
-
-    for name in names:
-        parts = name.split('_')
-        if len(parts) > 1:  # FIRT AND LAST NAME
-            last_name: str = parts[0]
-            first_name: str = parts[1]
-            if remove_part_split_char:
-                last_name = remove_split_char(input_text=last_name,
-                                              split_char='(')
-            # Pattern to match full name, last name, and possessive forms, but not as part of footnotes
-            name_pattern = rf"\b{first_name}[ ,]{last_name}(?:s|es|\b)|\b{last_name}(?:s|es|\b)[ ,]{first_name}"
-        else:  # ONLY ONE NAME PART
-            last_name: str = parts[0]
-            if remove_part_split_char:
-                last_name = remove_split_char(input_text=last_name,
-                                              split_char='(')
-                name_pattern = rf"\b{last_name}(?:s|es|\b)"
-
-        # Prepare regex for footnotes
-        negative_regex_last_name = [n.replace('name', last_name) for n in footnote_patterns]
-        negative_regex_all_names = [n.replace('name', f"{first_name} {last_name}") for n in footnote_patterns]
-        negative_regex = negative_regex_last_name + negative_regex_all_names
-        for page_number, text in pdf_text.items():
-            if page_number in exclude_pages:
-                continue  # Skip excluded pages
-            # replace nonbreak space with normal space for better more unified search results
-            text = text.replace(' ', ' ')
-            found_matches = filter_positive_matches(text=text,
-                                                    negative_patterns=negative_regex,
-                                                    positive_pattern=name_pattern,
-                                                    context_window_after=10,
-                                                    context_window_before=10,
-                                                    ignore_case=True)
-            if len(found_matches) > 0:
-                name_pages[name].append(page_number)
-
+                    exclude_pages: list, footnote_patterns: list,
+                    remove_part_split_char: str | None = None,
+                    word_index: PageWordIndex | None = None,
+                    name_scopes: dict | None = None,
+                    scope_fallback: bool = True) -> dict[str:list[int]]:
+    """
+    Finds the pages on which each name occurs. All name patterns are compiled once and each page is scanned
+    once for all names, see :class:`NamePageMatcher`.
+
+    :param names: Names in the form 'first_last' or 'name'.
+    :param pdf_text: Dictionary with page numbers as keys and page text as values.
+    :param exclude_pages: Page numbers to skip.
+    :param footnote_patterns: Regex patterns with the placeholder 'name' that mark footnote mentions to ignore.
+    :param remove_part_split_char: If set, the last name part is cut at this character.
+    :param word_index: Optional word index of the pages, names are then only checked on their candidate pages.
+    :param name_scopes: Optional dictionary mapping names to the pages they are searched on first.
+    :param scope_fallback: Whether names not found within their scope are searched in the whole document.
+    :return: Dictionary mapping every name to the list of pages it was found on.
+    """
+    matcher = NamePageMatcher(names=names,
+                              footnote_patterns=footnote_patterns,
+                              remove_part_split_char=remove_part_split_char,
+                              context_window_before=10,
+                              context_window_after=10,
+                              ignore_case=True)
+    name_pages = matcher.find_pages(pdf_text=pdf_text, exclude_pages=exclude_pages,
+                                    word_index=word_index, name_scopes=name_scopes)
+    if name_scopes is not None and scope_fallback:
+        not_found = [name for name, pages in name_pages.items() if not pages and name in name_scopes]
+        if not_found:
+            print(f'{len(not_found)} names not found within their pages, searching the whole document')
+            name_pages.update(matcher.find_pages(pdf_text=pdf_text, exclude_pages=exclude_pages,
+                                                 word_index=word_index, names=not_found))
     return name_pages
 
 
+def expand_page_scopes(name_scopes: dict, margin: int, pages: list) -> dict:
+    """
+    Expands the pages of every name scope by margin pages before and after, limited to the existing pages.
+    Covers names that continue on the page before or after a chunk boundary.
+    """
+    existing_pages = set(pages)
+    return {name: sorted({p + shift for p in scope for shift in range(-margin, margin + 1)} & existing_pages)
+            for name, scope in name_scopes.items()}
+
+
 def apply_page_offset_to_name_page_dict(name_to_pages: dict[str:int], offset: int) -> dict:
     """removes the offset value from all pages"""
     return {key: [i + offset for i in value] for key, value in name_to_pages.items()}
 
 
-def run_name_index(pdf_path: str,
+def run_name_index(pdf_path: str | None,
                    names_list: list,
                    exclude_pages: list,
-                   pages_offset: int = 0) -> dict[str:list[int]]:
-    # Extract names and read PDF
-    pdf_pages = read_pdf_pages(pdf_path)
+                   pages_offset: int = 0,
+                   use_word_index: bool = False,
+                   document: PdfDocument | None = None,
+                   name_scopes: dict | None = None,
+                   search_mode: str = Constants.NAME_PAGE_SEARCH_MODE) -> dict[str:list[int]]:
+    """
+    Finds the pages of all names in the PDF and applies the page offset.
+
+    :param pdf_path: The path to the PDF file, not used if an extracted document is given.
+    :param names_list: Names in the form 'first_last'.
+    :param exclude_pages: Page numbers to skip.
+    :param pages_offset: Offset added to all found page numbers.
+    :param use_word_index: Whether to use the inverted word index to find candidate pages.
+    :param document: Optional already extracted document.
+    :param name_scopes: Optional dictionary mapping names to the pages of the chunks they were extracted from.
+    :param search_mode: 'full' searches the whole document for every name, 'scoped' only the scope pages
+                        (plus Constants.NAME_SCOPE_PAGE_MARGIN pages) and 'scoped_fallback' searches the whole
+                        document for names not found within their scope.
+    :return: Dictionary mapping every name to the list of pages it was found on.
+    """
+    # Read the PDF only if no already extracted document is given
+    if document is None:
+        document = PdfDocument.from_pdf(pdf_path, word_index=PageWordIndex() if use_word_index else None)
+    word_index = document.get_word_index() if use_word_index else None
+    if search_mode not in ('full', 'scoped', 'scoped_fallback'):
+        raise ValueError(f"Unknown search mode '{search_mode}'.")
+    if search_mode == 'full' or name_scopes is None:
+        name_scopes = None
+    else:
+        name_scopes = expand_page_scopes(name_scopes, margin=Constants.NAME_SCOPE_PAGE_MARGIN,
+                                         pages=list(document.pages))
 
     # Use the function to find the pages for each name
+    search_start = time.perf_counter()
     name_to_pages = find_name_pages(names=names_list,
-                                    pdf_text=pdf_pages,
+                                    pdf_text=document.pages,
                                     exclude_pages=exclude_pages,
-                                    footnote_patterns=Constants.FOOTNOTE_RE_PATTERNS)
+                                    footnote_patterns=Constants.FOOTNOTE_RE_PATTERNS,
+                                    word_index=word_index,
+                                    name_scopes=name_scopes,
+                                    scope_fallback=search_mode == 'scoped_fallback')
+    print(f'Name page search took {time.perf_counter() - search_start:.3f}s for {len(names_list)} names')
+    if word_index is not None:
+        print(f'Word index stats: {word_index.get_stats()}')
 
     name_to_pages = apply_page_offset_to_name_page_dict(name_to_pages=name_to_pages,
                                                         offset=pages_offset)
@@ -0,0 +1,199 @@
+import re
+
+NBSP = '\u00a0'
+
+
+class NamePageMatcher:
+    """
+    Finds the pages on which a list of names occurs, compiling all name patterns only once.
+
+    Every name is turned into the same positive pattern (full name, possessive forms and comma separated
+    "last, first" forms) and negative footnote patterns as before. Instead of scanning every page once per name,
+    all name parts are merged into a single trie shaped regex. Each page is scanned once with this regex to collect
+    the name parts present on it and only the names whose parts were all found are verified with their own pattern.
+
+    :param names: Names in the form 'first_last' or 'name' (single name part).
+    :param footnote_patterns: Regex patterns with the placeholder 'name' that mark footnote mentions to ignore.
+    :param remove_part_split_char: If set, the last name part is cut at this character, e.g. '(' for 'Smith (2017)'.
+    :param context_window_before: Number of characters before a match to check for footnote patterns.
+    :param context_window_after: Number of characters after a match to check for footnote patterns.
+    :param ignore_case: Whether to perform case-insensitive matching.
+    """
+
+    def __init__(self, names: list, footnote_patterns: list,
+                 remove_part_split_char: str | None = None,
+                 context_window_before: int = 10, context_window_after: int = 10,
+                 ignore_case: bool = True) -> None:
+        self.names = list(names)
+        self.context_window_before = context_window_before
+        self.context_window_after = context_window_after
+        self.flags = re.IGNORECASE if ignore_case else 0
+
+        self.name_parts: dict[str, tuple] = {}
+        self.name_patterns: dict[str, tuple] = {}
+        self.name_anchors: dict[str, set] = {}
+        self.unanchored_names: list = []
+        for name in self.names:
+            name_parts = self.name_parts[name] = self._split_name(name, remove_part_split_char)
+            self.name_patterns[name] = self._compile_name_patterns(name_parts, footnote_patterns)
+            anchors = self._get_anchors(name_parts)
+            if anchors is None:
+                self.unanchored_names.append(name)
+            else:
+                self.name_anchors[name] = anchors
+
+        all_anchors = set().union(*self.name_anchors.values()) if self.name_anchors else set()
+        self.anchor_regex = self._compile_anchor_regex(all_anchors)
+        self.anchor_prefixes = self._build_anchor_prefixes(all_anchors)
+
+    def find_pages(self, pdf_text: dict[int:str], exclude_pages: list = (),
+                   word_index=None, name_scopes: dict | None = None, names: list | None = None) -> dict[str:list[int]]:
+        """
+        Searches all pages for all names.
+
+        :param pdf_text: Dictionary with page numbers as keys and page text as values.
+        :param exclude_pages: Page numbers to skip.
+        :param word_index: Optional :class:`PageWordIndex` of the pages. If given, each name is only verified on
+                           the candidate pages containing all of its name parts.
+        :param name_scopes: Optional dictionary mapping names to the pages they are searched on. Names without
+                            scope are searched on all pages.
+        :param names: Optional subset of the names to search, defaults to all names.
+        :return: Dictionary mapping every name to the sorted list of pages it was found on.
+        """
+        names = self.names if names is None else names
+        name_pages = {name: [] for name in names}
+        restrict_pages = word_index is not None or name_scopes is not None
+        page_candidates = self._get_page_candidates(pdf_text, names, word_index, name_scopes) if restrict_pages else {}
+        for page_number, text in pdf_text.items():
+            if page_number in exclude_pages:
+                continue
+            if not restrict_pages:
+                found_names = self.find_names_in_text(text, names=names)
+            elif page_number in page_candidates:
+                found_names = self.find_names_in_text(text, names=page_candidates[page_number],
+                                                      use_anchors=word_index is None)
+            else:
+                continue
+            for name in found_names:
+                name_pages[name].append(page_number)
+        return name_pages
+
+    def find_names_in_text(self, text: str, names: list | None = None, use_anchors: bool = True) -> list:
+        """
+        Returns all names found in the given text, in the order of the names list.
+
+        :param text: Text of a single page.
+        :param names: Optional subset of the names to check, defaults to all names.
+        :param use_anchors: Whether to pre-filter the names by scanning the text for their name parts first.
+        :return: List of names found in the text.
+        """
+        # replace nonbreak space with normal space for better more unified search results
+        text = text.replace(NBSP, ' ')
+        anchors_found = self._find_anchors(text) if use_anchors else None
+        found_names = []
+        for name in self.names if names is None else names:
+            anchors = self.name_anchors.get(name)
+            if anchors_found is not None and anchors is not None and not anchors <= anchors_found:
+                continue
+            positive_pattern, negative_patterns = self.name_patterns[name]
+            if self._has_positive_match(text, positive_pattern, negative_patterns):
+                found_names.append(name)
+        return found_names
+
+    def _get_page_candidates(self, pdf_text: dict[int:str], names: list,
+                             word_index=None, name_scopes: dict | None = None) -> dict[int, list]:
+        """Inverts the candidate pages of every name from the word index and the name scopes to page -> names."""
+        page_candidates: dict[int, list] = {}
+        for name in names:
+            candidates = set(pdf_text)
+            if word_index is not None:
+                index_candidates = word_index.candidate_pages(self.name_parts[name])
+                if index_candidates is not None:  # None means nothing to look up, check all pages
+                    candidates &= index_candidates
+            if name_scopes is not None and name in name_scopes:
+                candidates &= set(name_scopes[name])
+            for page_number in candidates:
+                page_candidates.setdefault(page_number, []).append(name)
+        return page_candidates
+
+    def _find_anchors(self, text: str) -> set:
+        anchors_found = set()
+        if self.anchor_regex is None:
+            return anchors_found
+        for match in self.anchor_regex.finditer(text):
+            anchors_found |= self.anchor_prefixes.get(self._normalize(match.group(1)), set())
+        return anchors_found
+
+    def _has_positive_match(self, text: str, positive_pattern: re.Pattern, negative_patterns: list) -> bool:
+        for match in positive_pattern.finditer(text):
+            start, end = match.span()
+            context_to_check = text[max(0, start - self.context_window_before):end + self.context_window_after]
+            if not any(neg.search(context_to_check) for neg in negative_patterns):
+                return True
+        return False
+
+    def _compile_name_patterns(self, name_parts: tuple, footnote_patterns: list) -> tuple:
+        last_name, first_name = name_parts
+        last_name_re = re.escape(last_name)
+        if first_name is not None:
+            first_name_re = re.escape(first_name)
+            # Pattern to match full name, last name, and possessive forms, but not as part of footnotes
+            name_pattern = (rf"\b{first_name_re}[ ,]{last_name_re}(?:s|es|\b)"
+                            rf"|\b{last_name_re}(?:s|es|\b)[ ,]{first_name_re}")
+            negative_names = [last_name_re, re.escape(f"{first_name} {last_name}")]
+        else:
+            name_pattern = rf"\b{last_name_re}(?:s|es|\b)"
+            negative_names = [last_name_re]
+        negative_regex = [n.replace('name', negative_name) for negative_name in negative_names
+                          for n in footnote_patterns]
+        return re.compile(name_pattern, self.flags), [re.compile(neg, self.flags) for neg in negative_regex]
+
+    @staticmethod
+    def _split_name(name: str, remove_part_split_char: str | None = None) -> tuple:
+        parts = name.split('_')
+        last_name: str = parts[0]
+        if remove_part_split_char:
+            last_name = last_name.split(remove_part_split_char)[0].strip()
+        first_name: str | None = parts[1] if len(parts) > 1 else None
+        return last_name, first_name
+
+    def _get_anchors(self, name_parts: tuple) -> set | None:
+        """
+        Returns the name parts that have to occur after a word boundary for the name pattern to match.
+        None means the name can not be pre-filtered and is always verified with its own pattern.
+        """
+        anchors = set()
+        for part in name_parts:
+            if not part:
+                continue
+            if not re.match(r'\w', part):
+                return None
+            anchors.add(self._normalize(part))
+        return anchors
+
+    def _normalize(self, text: str) -> str:
+        return text.lower() if self.flags & re.IGNORECASE else text
+
+    def _compile_anchor_regex(self, anchors: set) -> re.Pattern | None:
+        if not anchors:
+            return None
+        trie: dict = {}
+        for anchor in anchors:
+            node = trie
+            for char in anchor:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        # the lookahead does not consume text, so overlapping name parts are all found
+        return re.compile(rf"\b(?=({self._trie_to_regex(trie)}))", self.flags)
+
+    def _trie_to_regex(self, node: dict) -> str:
+        branches = [re.escape(char) + self._trie_to_regex(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        return f'(?:{body})?' if '' in node else body
+
+    @staticmethod
+    def _build_anchor_prefixes(anchors: set) -> dict[str, set]:
+        """The trie regex returns the longest anchor at a position, so shorter anchors that are prefixes count too."""
+        return {anchor: {other for other in anchors if anchor.startswith(other)} for anchor in anchors}
@@ -0,0 +1,97 @@
+import bisect
+import re
+import sys
+import time
+from array import array
+
+from indexer.name_matcher import NBSP
+
+WORD_RE = re.compile(r'\w+')
+
+
+class PageWordIndex:
+    """
+    Inverted index mapping normalized (casefolded, NBSP normalized) words to the pages they occur on.
+
+    The index is filled page by page, e.g. during :func:`read_pdf_pages`, and is used to find candidate pages
+    for a name, so the full name regex only has to run on those pages instead of on the whole document.
+    Postings are stored as compact unsigned int arrays in ascending page order.
+    """
+
+    def __init__(self) -> None:
+        self.postings: dict[str, array] = {}
+        self.build_time: float = 0.0
+        self.lookup_time: float = 0.0
+        self.lookup_count: int = 0
+        self._vocabulary: list | None = None
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return text.replace(NBSP, ' ').casefold()
+
+    def tokenize(self, text: str) -> list:
+        return WORD_RE.findall(self.normalize(text))
+
+    def add_page(self, page_number: int, text: str) -> None:
+        """
+        Adds all words of a page to the index. Pages have to be added in ascending order.
+
+        :param page_number: The page number of the text.
+        :param text: The text of the page.
+        """
+        start = time.perf_counter()
+        for word in set(self.tokenize(text)):
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = array('I')
+            posting.append(page_number)
+        self._vocabulary = None
+        self.build_time += time.perf_counter() - start
+
+    def pages_for_prefix(self, prefix: str) -> set:
+        """
+        Returns all pages containing a word starting with the (normalized) prefix.
+        Prefixes are used because the name patterns also match possessive and other suffixed forms.
+        """
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        pages = set()
+        position = bisect.bisect_left(self._vocabulary, prefix)
+        while position < len(self._vocabulary) and self._vocabulary[position].startswith(prefix):
+            pages.update(self.postings[self._vocabulary[position]])
+            position += 1
+        return pages
+
+    def candidate_pages(self, name_parts: list) -> set | None:
+        """
+        Intersects the postings of all words of the given name parts.
+
+        :param name_parts: Name parts, e.g. first and last name. Empty parts are ignored.
+        :return: Set of pages that may contain the name or None if the name has no words to look up.
+        """
+        start = time.perf_counter()
+        candidates = None
+        for part in name_parts:
+            for word in self.tokenize(part or ''):
+                pages = self.pages_for_prefix(word)
+                candidates = pages if candidates is None else candidates & pages
+                if not candidates:
+                    break
+        self.lookup_time += time.perf_counter() - start
+        self.lookup_count += 1
+        return candidates
+
+    def memory_size(self) -> int:
+        """Approximate memory of the index in bytes (dictionary, words and posting arrays)."""
+        size = sys.getsizeof(self.postings)
+        for word, posting in self.postings.items():
+            size += sys.getsizeof(word) + sys.getsizeof(posting)
+        return size
+
+    def get_stats(self) -> dict:
+        return {'words': len(self.postings),
+                'postings': sum(len(posting) for posting in self.postings.values()),
+                'memory_bytes': self.memory_size(),
+                'build_time_s': self.build_time,
+                'lookup_time_s': self.lookup_time,
+                'lookups': self.lookup_count}
@@ -1,70 +1,86 @@
+import os
+
 import gradio as gr
 import pandas as pd
+
+import pipeline
 from Constants import Constants
 from indexer.index_from_list import run_name_index
-from utils import str_utils, prompt_utils
-from API_Connector import openAI
+from utils.job_queue import IndexJob, JobQueue
 from utils.json_utils import JsonStrToDict
-from utils.other_utils import clean_pandas_df
+from utils.other_utils import flatten_list
+from utils.pdf_document import PdfDocument
+from utils.run_journal import RunJournal
 
 
-def split_pdf_text(pdf_file: str):
-    pdf_text = str_utils.get_total_pdf_text(pdf_file)
-    split_to_tokens = str_utils.TextTokenSplitter()
-    split_text: list = split_to_tokens.split_text_by_token_paragraphs(pdf_text)
+def split_pdf_text(document: PdfDocument, split_to_tokens=None):
+    split_to_tokens = split_to_tokens or pipeline.create_splitter()
+    split_text: list = split_to_tokens.split_document(document)
     return split_text
 
 
-def prompt_llm_for_persons(prompt_list):
-    openAI_connector = openAI.ConnectOpenAI(dummy=False, url=Constants.LLM_URL)
-    prompt_creator = prompt_utils.PromptCreator(Constants.SYSTEM_PROMPT)
-    set_up_examples(prompt_creator)
-    print(prompt_creator.get_prompt_history())
-    names_list: list = []
-    total_parts = len(prompt_list)
-
-    dict_list: list = []
-    json_parser = JsonStrToDict()
-    for nr, prompt in enumerate(prompt_list):
-        prompt_creator.add_user_prompt(Constants.USER_BASE_PROMPT + prompt)
-        prompts = prompt_creator.get_prompt_history()
-        print(f'Prompting for part {nr}/{total_parts} using {prompt_creator.count_tokens_in_prompt_history()} tokens')
-        ai_response = openAI_connector.send_prompt(model=Constants.MODEL_NAME,
-                                                   prompt=prompts,
-                                                   top_p=Constants.TOP_P,
-                                                   temp=Constants.TEMPERATURE)
-        print('AI RESPONSE is: ', ai_response)
-        current_dict = json_parser.json_to_dict(ai_response)
-        print(f'CURRENT dict is \n {current_dict}')
-
-        if len(current_dict) > 0:
-            print(f'Appending from {nr} with len: {len(current_dict)}')
-            dict_list.append(current_dict)
-        names_list.append(ai_response)
-        prompt_creator.delete_prompt_history()
-
-        #  add logic to search for and correct json then extract actual pdf page
-    df_list = [pd.DataFrame(d) for d in dict_list]
+def prompt_llm_for_persons(prompt_list, max_in_flight: int = Constants.LLM_MAX_IN_FLIGHT,
+                           request_timeout: float | None = Constants.LLM_REQUEST_TIMEOUT,
+                           journal: RunJournal | None = None, batch_size: int = Constants.CHUNK_BATCH_SIZE,
+                           max_batch_tokens: int = Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH):
+    """
+    Prompts the LLM for the person names in every text chunk.
+    With max_in_flight > 1 up to max_in_flight chunks are sent concurrently, the results keep the chunk order.
+    Each request builds its own prompt history, so no PromptCreator is shared between requests.
+
+    :param prompt_list: List of text chunks, either plain strings or TextChunks carrying their source pages.
+    :param max_in_flight: Maximum number of concurrent LLM requests.
+    :param request_timeout: Timeout in seconds per LLM request, None for no timeout.
+    :param journal: Optional journal of the run, chunks finished in an earlier run are not sent again.
+    :param batch_size: Number of short chunks sent together in one request.
+    :param max_batch_tokens: Token budget the chunks were planned with, i.e. the max_tokens of the splitter.
+    :return: Cleaned DataFrame with the extracted names.
+    """
+    openAI_connector = pipeline.create_connector()
+    stats_since = pipeline.stats_mark(openAI_connector)
+    parsed_names = pipeline.iter_journaled_names(
+        prompt_list, journal,
+        lambda unfinished_chunks: pipeline.iter_parsed_names(pipeline.iter_responses(
+            unfinished_chunks, openAI_connector, max_in_flight=max_in_flight, request_timeout=request_timeout,
+            total_parts=len(prompt_list), batch_size=batch_size, max_batch_tokens=max_batch_tokens)))
+    df_list: list = []
+    try:
+        for nr, (_, names_df) in enumerate(parsed_names):
+            if len(names_df) > 0:
+                print(f'Appending from {nr} with len: {len(names_df)}')
+                df_list.append(names_df)
+        if journal is not None:
+            journal.mark_finished()
+    finally:
+        parsed_names.close()
+        if journal is not None:
+            journal.close()
+        pipeline.close_connector(openAI_connector, stats_since)
     combined_df = pd.concat(df_list, ignore_index=True)
-    combined_df = clean_pandas_df(combined_df)
     return combined_df
 
 
-def set_up_examples(prompt_creator: prompt_utils.PromptCreator):
-    for user_prompt, assistant_answer in zip(Constants.EXAMLES_USER, Constants.EXAMPLES_ASSISTANT):
-        prompt_creator.add_user_prompt(user_prompt)
-        prompt_creator.add_assistant_message(assistant_answer)
-
-
-def index_for_names(pdf_file) -> pd.DataFrame:
-    split_text = split_pdf_text(pdf_file=pdf_file)
+def index_for_names(pdf_file, max_in_flight: int = Constants.LLM_MAX_IN_FLIGHT,
+                    batch_size: int = Constants.CHUNK_BATCH_SIZE) -> pd.DataFrame:
+    # the PDF is opened and extracted only once, chunking and name indexing share the document
+    document = PdfDocument.from_pdf(pdf_file)
+    splitter = pipeline.create_splitter()
+    split_text = list(pipeline.iter_prefiltered_chunks(split_pdf_text(document=document, split_to_tokens=splitter)))
     print('Test_len: ', len(split_text), '\n EXT: ', split_text)
-    names_df: pd.DataFrame = prompt_llm_for_persons(split_text)
+    journal = RunJournal.for_pdf(pdf_file, splitter.max_tokens, batch_size) if Constants.USE_RUN_JOURNAL else None
+    names_df: pd.DataFrame = prompt_llm_for_persons(split_text, max_in_flight=max_in_flight, journal=journal,
+                                                    batch_size=batch_size, max_batch_tokens=splitter.max_tokens)
     names_df['id'] = names_df[Constants.EXTRACT_COLUMN_KEYS[0]] + '_' + names_df[Constants.EXTRACT_COLUMN_KEYS[1]]
+    # collect the source pages of all chunks a name was extracted from before dropping the duplicates
+    source_pages = names_df.groupby('id')[Constants.SOURCE_PAGES_COLUMN].agg(
+        lambda pages: sorted(set(flatten_list(list(pages)))))
     # DROP TOTAL DUPLICATES
     names_df = names_df.drop_duplicates(subset=['id'])
     names_df = names_df.set_index('id')
-    name_to_pages = run_name_index(names_list=list(names_df.index), pdf_path=pdf_file, exclude_pages=[], pages_offset=19)
+    names_df[Constants.SOURCE_PAGES_COLUMN] = source_pages
+    name_to_pages = run_name_index(names_list=list(names_df.index), pdf_path=pdf_file, exclude_pages=[], pages_offset=19,
+                                   document=document,
+                                   name_scopes=names_df[Constants.SOURCE_PAGES_COLUMN].to_dict())
     names_df['pages'] = names_df.index.map(name_to_pages)
     # drop NAN,. None, null values and EMPTY list, i.e. not found
     names_df = names_df.dropna(subset=['pages'])
@@ -72,17 +88,73 @@ def index_for_names(pdf_file) -> pd.DataFrame:
     return names_df
 
 
+def run_index_job(job: IndexJob, request_budget) -> None:
+    """
+    Runs the pipeline for a background job, keeps its progress and partial result up to date.
+    The CPUs for the text extraction are shared by the Constants.JOB_MAX_RUNNING jobs running at the same time.
+    """
+    extract_workers = max((Constants.PDF_EXTRACT_WORKERS or os.cpu_count() or 1) // Constants.JOB_MAX_RUNNING, 1)
+    for names_df, progress in pipeline.stream_index_for_names(job.pdf_file, max_in_flight=Constants.JOB_MAX_IN_FLIGHT,
+                                                              request_budget=request_budget,
+                                                              extract_workers=extract_workers):
+        job.result = names_df
+        job.progress = progress
+        if job.cancel_event.is_set():
+            break
+
+
+job_queue = JobQueue(run_index_job)
+
+
+def submit_job(pdf_file) -> str:
+    if pdf_file is None:
+        raise gr.Error('Please select a document first.')
+    return job_queue.submit(pdf_file)
+
+
+def poll_job(job_id: str):
+    """Returns the current table and status text of the job."""
+    if not job_id:
+        return gr.skip(), ''
+    status = job_queue.status(job_id)
+    if status['status'] == 'unknown':
+        return gr.skip(), f'Job {job_id} is unknown or expired.'
+    if status['status'] == 'queued':
+        return gr.skip(), f"Queued, position {status['queue_position']}"
+    progress = status['progress']
+    text = status['status'].capitalize()
+    if progress:
+        eta = f"{progress['eta_s']:.0f}s" if progress['eta_s'] is not None else '-'
+        text += (f" | {progress['progress']:.0%} of the pages | {progress['chunks_done']} chunks | "
+                 f"{progress['chunks_per_minute']:.1f} chunks/min | {progress['names_found']} names | ETA {eta}")
+    if status['error']:
+        text += f" | {status['error']}"
+    names_df = status['result']  # from the same snapshot, the job may be pruned meanwhile
+    if names_df is None:
+        return gr.skip(), text
+    return (names_df if names_df.empty else names_df.reset_index()), text
+
+
+def cancel_job(job_id: str) -> str:
+    if job_queue.cancel(job_id):
+        return f'Cancelling job {job_id}, no further chunks are sent.'
+    return f'Job {job_id} is not running.'
+
+
 def main():
     with gr.Blocks() as demo:
         with gr.Row():
-            infile = gr.File(label='Document')
+            infile = gr.File(label='Document', type='filepath')
             output_table = gr.DataFrame()
         with gr.Column():
-            start_btn = gr.Button('Start', variant='primary')
-            start_btn.click(fn=index_for_names,
-                            inputs=infile,
-                            outputs=output_table
-                            )
+            job_id = gr.Textbox(label='Job id', info='Paste the id of an earlier job to look at its result')
+            progress_text = gr.Markdown()
+            with gr.Row():
+                start_btn = gr.Button('Start', variant='primary')
+                cancel_btn = gr.Button('Cancel', variant='stop')
+            start_btn.click(fn=submit_job, inputs=infile, outputs=job_id)
+            cancel_btn.click(fn=cancel_job, inputs=job_id, outputs=progress_text)
+            gr.Timer(2.0).tick(fn=poll_job, inputs=job_id, outputs=[output_table, progress_text])
 
     demo.launch()
 
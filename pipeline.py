@@ -0,0 +1,631 @@
+import contextlib
+import dataclasses
+import io
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from threading import Lock
+from typing import Iterable, Iterator
+
+import pandas as pd
+
+from API_Connector import openAI
+from API_Connector.api_abstract import connectToAPI
+from API_Connector.budgeted_api import BudgetedAPI
+from API_Connector.cached_api import CachedAPI
+from API_Connector.load_balancer import LoadBalancedAPI, get_shared_load_balancer
+from Constants import Constants
+from indexer.index_from_list import run_name_index
+from utils import prompt_utils, str_utils
+from utils.chunk_prefilter import ChunkPrefilter
+from utils.citation_extractor import CitationExtractor
+from utils.context_planner import ChunkBudgetPlanner
+from utils.json_utils import JsonStrToDict
+from utils.other_utils import clean_pandas_df, flatten_list
+from utils.pdf_document import PdfDocument
+from utils.run_journal import RunJournal
+from utils.token_counter import TokenCounter
+
+# Generator stages of the indexing pipeline: page extraction -> chunking -> LLM -> JSON parse -> page lookup.
+# Every stage consumes the iterator of the previous one, so results are available as soon as a chunk is done
+# and only the chunks in flight are held in memory.
+
+
+def create_connector(request_budget=None) -> connectToAPI:
+    """
+    Returns the process-wide LLM connector, wrapped in a new response cache if Constants.USE_LLM_CACHE is set.
+    Close it with close_connector, with the stats_mark taken at the start of the run for the stats of the run.
+
+    :param request_budget: Optional semaphore limiting the concurrent LLM requests, e.g. shared by several processes.
+    """
+    if Constants.LLM_BACKEND_URLS:
+        connector = get_shared_load_balancer(tuple(Constants.LLM_BACKEND_URLS))
+    else:
+        connector = openAI.get_shared_connector(Constants.LLM_URL)
+    if Constants.USE_LLM_CACHE:
+        connector = CachedAPI(connector)
+    if request_budget is not None:
+        connector = BudgetedAPI(connector, request_budget)
+    return connector
+
+
+def stats_mark(connector: connectToAPI) -> int:
+    """Returns the number of answers the shared connector streamed so far, marks the start of a run."""
+    while isinstance(connector, (BudgetedAPI, CachedAPI)):
+        connector = connector.connector
+    return connector.answers if isinstance(connector, openAI.ConnectOpenAI) else 0
+
+
+def close_connector(connector: connectToAPI, stats_since: int = 0) -> None:
+    """
+    Prints the cache and connector stats and closes the response cache, the shared connector stays open.
+
+    :param connector: Connector returned by create_connector.
+    :param stats_since: stats_mark of the connector at the start of the run.
+    """
+    if isinstance(connector, BudgetedAPI):
+        connector = connector.connector
+    if isinstance(connector, CachedAPI):
+        print(f'LLM cache stats: {connector.get_stats()}')
+        connector.close()
+        connector = connector.connector
+    if isinstance(connector, openAI.ConnectOpenAI):
+        print(f'LLM connector stats: {connector.get_stats(since=stats_since)}')
+    elif isinstance(connector, LoadBalancedAPI):
+        for backend_stats in connector.get_stats():
+            print(f'LLM backend stats: {backend_stats}')
+
+
+def set_up_examples(prompt_creator: prompt_utils.PromptCreator, examples_user: list = Constants.EXAMLES_USER,
+                    examples_assistant: list = Constants.EXAMPLES_ASSISTANT):
+    for user_prompt, assistant_answer in zip(examples_user, examples_assistant):
+        prompt_creator.add_user_prompt(user_prompt)
+        prompt_creator.add_assistant_message(assistant_answer)
+
+
+@lru_cache(maxsize=1)
+def get_prefix_prompt_creator() -> prompt_utils.PromptCreator:
+    """Returns the prompt with system prompt and examples, its tokens are counted only once per process."""
+    prompt_creator = prompt_utils.PromptCreator(Constants.SYSTEM_PROMPT)
+    set_up_examples(prompt_creator)
+    prompt_creator.freeze_prefix()
+    return prompt_creator
+
+
+@lru_cache(maxsize=1)
+def get_batch_prefix_prompt_creator() -> prompt_utils.PromptCreator:
+    """Returns the prompt with system prompt and the examples in the grouped answer format of the batch prompt."""
+    prompt_creator = prompt_utils.PromptCreator(Constants.SYSTEM_PROMPT)
+    set_up_examples(prompt_creator, Constants.BATCH_EXAMPLES_USER, Constants.BATCH_EXAMPLES_ASSISTANT)
+    prompt_creator.freeze_prefix()
+    return prompt_creator
+
+
+def create_chunk_prompt(prompt: str) -> prompt_utils.PromptCreator:
+    """Creates a new prompt history with system prompt, examples and the user prompt for one text chunk."""
+    prompt_creator = get_prefix_prompt_creator().copy()
+    prompt_creator.add_user_prompt(Constants.USER_BASE_PROMPT + prompt)
+    return prompt_creator
+
+
+def create_splitter() -> str_utils.TextTokenSplitter:
+    """
+    Returns the text splitter, packing the chunks up to the context window of the model if
+    Constants.PLAN_CHUNKS_FROM_CONTEXT is set, else up to Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH.
+    """
+    if Constants.PLAN_CHUNKS_FROM_CONTEXT:
+        return ChunkBudgetPlanner().create_splitter()
+    return str_utils.TextTokenSplitter(count_typ=Constants.CHUNK_TOKEN_COUNT_TYP)
+
+
+def iter_chunks(document: PdfDocument) -> Iterator[str_utils.TextChunk]:
+    """Chunking stage, yields the text chunks of the document one by one."""
+    return create_splitter().iter_split_document(document)
+
+
+def iter_prefiltered_chunks(chunks: Iterable, prefilter: ChunkPrefilter | None = None) -> Iterator:
+    """
+    Prefilter stage, skips the chunks without name or citation signals if Constants.USE_CHUNK_PREFILTER is set
+    and prints the skip report when all chunks are done.
+    """
+    if not Constants.USE_CHUNK_PREFILTER and prefilter is None:
+        yield from chunks
+        return
+    prefilter = prefilter if prefilter is not None else ChunkPrefilter()
+    yield from prefilter.iter_filter(chunks)
+    report = prefilter.get_report()
+    print(f"Prefilter sent {report['sent']} of {report['chunks']} chunks, skipped: {report['skipped_chunks']}")
+
+
+def prompt_chunk(connector: connectToAPI, chunk: str | str_utils.TextChunk, nr: int = 0, total_parts: int | str = '?',
+                 request_timeout: float | None = Constants.LLM_REQUEST_TIMEOUT, on_name=None) -> str:
+    """
+    Sends a single text chunk with its own prompt history to the LLM.
+
+    :param connector: The LLM connector.
+    :param chunk: The text chunk.
+    :param nr: Number of the chunk, only used for logging.
+    :param total_parts: Total number of chunks, only used for logging.
+    :param request_timeout: Timeout in seconds of the request, None for no timeout.
+    :param on_name: Optional callback called with (chunk, name dict) as soon as a name is streamed.
+    :return: The LLM response.
+    """
+    text = chunk.text if isinstance(chunk, str_utils.TextChunk) else chunk
+    prompt_creator = create_chunk_prompt(text)
+    print(f'Prompting for part {nr}/{total_parts} using {prompt_creator.count_tokens_in_prompt_history()} tokens')
+    stream_kwargs = {'on_name': lambda name: on_name(chunk, name)} if on_name is not None else {}
+    ai_response = connector.send_prompt(model=Constants.MODEL_NAME,
+                                        prompt=prompt_creator.get_prompt_history(),
+                                        top_p=Constants.TOP_P,
+                                        temp=Constants.TEMPERATURE,
+                                        timeout=request_timeout,
+                                        **stream_kwargs)
+    print('AI RESPONSE is: ', ai_response)
+    return ai_response
+
+
+def iter_ordered(items: Iterable, function, max_in_flight: int = Constants.LLM_MAX_IN_FLIGHT) -> Iterator[tuple]:
+    """
+    Yields (nr, item, function(nr, item)) in item order, running up to max_in_flight calls concurrently.
+    Only the items in flight are held in memory.
+    """
+    if max_in_flight <= 1:
+        for nr, item in enumerate(items):
+            yield nr, item, function(nr, item)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        in_flight: deque = deque()
+        for nr, item in enumerate(items):
+            in_flight.append((nr, item, executor.submit(function, nr, item)))
+            if len(in_flight) >= max_in_flight:
+                done_nr, done_item, future = in_flight.popleft()
+                yield done_nr, done_item, future.result()
+        while in_flight:
+            done_nr, done_item, future = in_flight.popleft()
+            yield done_nr, done_item, future.result()
+    finally:
+        # also when the generator is closed early: drop the calls not started yet and wait for the running ones
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_llm_responses(chunks: Iterable, connector: connectToAPI,
+                       max_in_flight: int = Constants.LLM_MAX_IN_FLIGHT,
+                       request_timeout: float | None = Constants.LLM_REQUEST_TIMEOUT,
+                       total_parts: int | str = '?', on_name=None) -> Iterator[tuple]:
+    """
+    LLM stage, yields (chunk, response) in chunk order.
+    At most max_in_flight requests are running at the same time and only those chunks are held in memory.
+
+    :param chunks: Iterable of text chunks.
+    :param connector: The LLM connector.
+    :param max_in_flight: Maximum number of concurrent LLM requests.
+    :param request_timeout: Timeout in seconds per LLM request, None for no timeout.
+    :param total_parts: Total number of chunks, only used for logging.
+    :param on_name: Optional callback called with (chunk, name dict) as soon as a name is streamed, possibly from
+                    a worker thread and before the response of the chunk is yielded.
+    """
+    def prompt_nr_chunk(nr: int, chunk) -> str:
+        return prompt_chunk(connector, chunk, nr, total_parts, request_timeout, on_name)
+
+    for _, chunk, ai_response in iter_ordered(chunks, prompt_nr_chunk, max_in_flight):
+        yield chunk, ai_response
+
+
+class BatchStats:
+    """Counters of the batched LLM stage."""
+
+    def __init__(self) -> None:
+        self.batches = 0
+        self.batched_chunks = 0
+        self.failed_batches = 0
+        self.prompt_tokens_saved = 0
+        self._lock = Lock()
+
+    def add_batch(self, chunk_count: int, prompt_tokens_saved: int, failed: bool) -> None:
+        with self._lock:
+            self.batches += 1
+            self.batched_chunks += chunk_count
+            if failed:  # the chunks were sent one by one, nothing saved
+                self.failed_batches += 1
+            else:
+                self.prompt_tokens_saved += prompt_tokens_saved
+
+    def __repr__(self) -> str:
+        return (f'BatchStats(batches={self.batches}, batched_chunks={self.batched_chunks}, '
+                f'failed_batches={self.failed_batches}, prompt_tokens_saved={self.prompt_tokens_saved})')
+
+
+def mark_chunk(chunk_id: int, text: str) -> str:
+    """Returns the text of a chunk in the batch prompt, starting with its "### CHUNK <id>" line."""
+    return f'### CHUNK {chunk_id}\n{text}'
+
+
+def batch_prompt_extra_tokens() -> int:
+    """
+    Returns the tokens the examples and base prompt of the batch prompt need more than those of a single chunk,
+    counted like the chunks (Constants.CHUNK_TOKEN_COUNT_TYP). The system prompt is the same in both.
+    """
+    token_counter = TokenCounter(count_typ=Constants.CHUNK_TOKEN_COUNT_TYP)
+    batch_tokens = token_counter.count_tokens_batch(
+        [*Constants.BATCH_EXAMPLES_USER, *Constants.BATCH_EXAMPLES_ASSISTANT, Constants.BATCH_USER_BASE_PROMPT])
+    single_tokens = token_counter.count_tokens_batch(
+        [*Constants.EXAMLES_USER, *Constants.EXAMPLES_ASSISTANT, Constants.USER_BASE_PROMPT])
+    return sum(batch_tokens) - sum(single_tokens)
+
+
+def iter_chunk_batches(chunks: Iterable, batch_size: int, max_batch_tokens: int) -> Iterator[list]:
+    """
+    Groups consecutive chunks into batches of at most batch_size chunks and max_batch_tokens estimated tokens.
+    The chunk markers and what the batch prompt needs more than the prompt of a single chunk are counted against
+    max_batch_tokens, so a batch fits into the context a single chunk of max_batch_tokens was planned for.
+    Chunks larger than the token limit are sent alone.
+    """
+    token_counter = TokenCounter(count_typ=Constants.CHUNK_TOKEN_COUNT_TYP)
+    max_batch_tokens -= max(batch_prompt_extra_tokens(), 0)
+    batch: list = []
+    batch_tokens = 0
+    for chunk in chunks:
+        tokens = token_counter.count_tokens(
+            mark_chunk(len(batch), chunk.text if isinstance(chunk, str_utils.TextChunk) else chunk))
+        if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_batch_tokens):
+            yield batch
+            batch, batch_tokens = [], 0
+        batch.append(chunk)
+        batch_tokens += tokens
+    if batch:
+        yield batch
+
+
+def create_batch_prompt(chunk_texts: list) -> prompt_utils.PromptCreator:
+    """Creates the prompt history with system prompt, examples and all chunks of a batch marked by their id."""
+    prompt_creator = get_batch_prefix_prompt_creator().copy()
+    marked_texts = '\n'.join(mark_chunk(chunk_id, text) for chunk_id, text in enumerate(chunk_texts))
+    prompt_creator.add_user_prompt(Constants.BATCH_USER_BASE_PROMPT + marked_texts)
+    return prompt_creator
+
+
+def prompt_chunk_batch(connector: connectToAPI, batch: list, stats: BatchStats, nr: int = 0,
+                       request_timeout: float | None = Constants.LLM_REQUEST_TIMEOUT) -> list:
+    """
+    Sends all chunks of a batch in a single request and returns one response per chunk.
+    If the grouped answer is malformed, the chunks are sent again one at a time.
+
+    :param connector: The LLM connector.
+    :param batch: List of text chunks.
+    :param stats: Batch counters to update.
+    :param nr: Number of the batch, only used for logging.
+    :param request_timeout: Timeout in seconds of the request, None for no timeout.
+    :return: List with a JSON response string for every chunk of the batch.
+    """
+    texts = [chunk.text if isinstance(chunk, str_utils.TextChunk) else chunk for chunk in batch]
+    if len(batch) == 1:
+        stats.add_batch(1, 0, failed=False)
+        return [prompt_chunk(connector, batch[0], nr, request_timeout=request_timeout)]
+
+    prompt_creator = create_batch_prompt(texts)
+    print(f'Prompting for batch {nr} with {len(batch)} chunks using '
+          f'{prompt_creator.count_tokens_in_prompt_history()} tokens')
+    ai_response = connector.send_prompt(model=Constants.MODEL_NAME,
+                                        prompt=prompt_creator.get_prompt_history(),
+                                        top_p=Constants.TOP_P,
+                                        temp=Constants.TEMPERATURE,
+                                        timeout=request_timeout)
+    print('AI RESPONSE is: ', ai_response)
+    grouped_names = JsonStrToDict().grouped_json_to_dict(ai_response, chunk_ids=list(range(len(batch))))
+    if grouped_names is None:
+        print(f'Malformed grouped answer for batch {nr}, retrying its {len(batch)} chunks one by one')
+        stats.add_batch(len(batch), 0, failed=True)
+        return [prompt_chunk(connector, chunk, nr, request_timeout=request_timeout) for chunk in batch]
+    single_prompt_tokens = sum(create_chunk_prompt(text).count_tokens_in_prompt_history() for text in texts)
+    stats.add_batch(len(batch), single_prompt_tokens - prompt_creator.count_tokens_in_prompt_history(), failed=False)
+    return [json.dumps(grouped_names[chunk_id]) for chunk_id in range(len(batch))]
+
+
+def iter_batched_llm_responses(chunks: Iterable, connector: connectToAPI,
+                               batch_size: int = Constants.CHUNK_BATCH_SIZE,
+                               max_batch_tokens: int = Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH,
+                               max_in_flight: int = Constants.LLM_MAX_IN_FLIGHT,
+                               request_timeout: float | None = Constants.LLM_REQUEST_TIMEOUT,
+                               stats: BatchStats | None = None) -> Iterator[tuple]:
+    """
+    Batched LLM stage, sends up to batch_size short chunks in one request and yields (chunk, response) in chunk
+    order, like iter_llm_responses. The response of every chunk is a JSON list of its names.
+
+    :param chunks: Iterable of text chunks.
+    :param connector: The LLM connector.
+    :param batch_size: Maximum number of chunks per request.
+    :param max_batch_tokens: Maximum number of (estimated) text tokens per request.
+    :param max_in_flight: Maximum number of concurrent LLM requests.
+    :param request_timeout: Timeout in seconds per LLM request, None for no timeout.
+    :param stats: Optional batch counters, e.g. to report the saved prompt tokens.
+    """
+    stats = stats if stats is not None else BatchStats()
+
+    def prompt_nr_batch(nr: int, batch: list) -> list:
+        return prompt_chunk_batch(connector, batch, stats, nr, request_timeout)
+
+    for _, batch, responses in iter_ordered(iter_chunk_batches(chunks, batch_size, max_batch_tokens),
+                                            prompt_nr_batch, max_in_flight):
+        yield from zip(batch, responses)
+    print(f'Batch stats: {stats}')
+
+
+def iter_responses(chunks: Iterable, connector: connectToAPI,
+                   max_in_flight: int = Constants.LLM_MAX_IN_FLIGHT,
+                   request_timeout: float | None = Constants.LLM_REQUEST_TIMEOUT,
+                   total_parts: int | str = '?',
+                   batch_size: int = Constants.CHUNK_BATCH_SIZE,
+                   max_batch_tokens: int = Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH,
+                   fast_path: bool = Constants.USE_CITATION_FAST_PATH) -> Iterator[tuple]:
+    """
+    LLM stage, runs the citation fast path if fast_path is set and batches the chunks if batch_size > 1,
+    see iter_fast_path_responses, iter_llm_responses and iter_batched_llm_responses.
+    """
+    if fast_path:
+        return iter_fast_path_responses(chunks, connector, max_in_flight=max_in_flight,
+                                        request_timeout=request_timeout, total_parts=total_parts,
+                                        batch_size=batch_size, max_batch_tokens=max_batch_tokens)
+    if batch_size > 1:
+        return iter_batched_llm_responses(chunks, connector, batch_size=batch_size, max_batch_tokens=max_batch_tokens,
+                                          max_in_flight=max_in_flight, request_timeout=request_timeout)
+    return iter_llm_responses(chunks, connector, max_in_flight=max_in_flight, request_timeout=request_timeout,
+                              total_parts=total_parts)
+
+
+def iter_fast_path_responses(chunks: Iterable, connector: connectToAPI,
+                             extractor: CitationExtractor | None = None, **llm_kwargs) -> Iterator[tuple]:
+    """
+    Citation fast path in front of the LLM stage, yields (chunk, response) in chunk order like iter_llm_responses.
+    The names of unambiguous citations are extracted with CitationExtractor and removed from the chunk text, only
+    the remaining text is sent to the LLM and its names are merged with the extracted ones.
+    Chunks whose remaining text has no name signal at all are not sent.
+
+    :param chunks: Iterable of text chunks.
+    :param connector: The LLM connector.
+    :param extractor: The citation extractor, a new one if None.
+    :param llm_kwargs: Keyword arguments of iter_responses.
+    """
+    extractor = extractor if extractor is not None else CitationExtractor()
+    pending: deque = deque()  # (chunk, extracted names, sent to the LLM) in chunk order
+    stats = {'chunks': 0, 'sent': 0, 'extracted_names': 0, 'removed_characters': 0}
+
+    def iter_remaining_chunks() -> Iterator:
+        for chunk in chunks:
+            text = chunk.text if isinstance(chunk, str_utils.TextChunk) else chunk
+            names, remaining_text = extractor.extract(text)
+            send = not names or ChunkPrefilter.score(remaining_text) > 0
+            pending.append((chunk, names, send))
+            stats['chunks'] += 1
+            stats['extracted_names'] += len(names)
+            stats['removed_characters'] += len(text) - len(remaining_text)
+            if send:
+                stats['sent'] += 1
+                yield (dataclasses.replace(chunk, text=remaining_text)
+                       if isinstance(chunk, str_utils.TextChunk) else remaining_text)
+
+    json_parser = JsonStrToDict()
+    for _, ai_response in iter_responses(iter_remaining_chunks(), connector, fast_path=False, **llm_kwargs):
+        while not pending[0][2]:
+            chunk, names, _ = pending.popleft()
+            yield chunk, json.dumps(names)
+        chunk, names, _ = pending.popleft()
+        yield chunk, json.dumps(names + json_parser.json_to_dict(ai_response)) if names else ai_response
+    while pending:
+        chunk, names, _ = pending.popleft()
+        yield chunk, json.dumps(names)
+    print(f'Citation fast path stats: {stats}')
+
+
+def iter_parsed_names(responses: Iterable[tuple]) -> Iterator[tuple]:
+    """
+    JSON parse stage, yields (chunk, names_df) with the cleaned names of every chunk, possibly empty.
+    Names of TextChunks carry the source pages of the chunk in Constants.SOURCE_PAGES_COLUMN.
+    """
+    json_parser = JsonStrToDict()
+    for chunk, ai_response in responses:
+        extra_fields = None
+        if isinstance(chunk, str_utils.TextChunk):
+            extra_fields = {Constants.SOURCE_PAGES_COLUMN: chunk.pages}
+        current_dict = json_parser.json_to_dict(ai_response, extra_fields=extra_fields)
+        print(f'CURRENT dict is \n {current_dict}')
+        names_df = pd.DataFrame(current_dict, columns=Constants.EXTRACT_COLUMN_KEYS + [Constants.SOURCE_PAGES_COLUMN])
+        names_df = clean_pandas_df(names_df, keep_cols=(Constants.SOURCE_PAGES_COLUMN,))
+        yield chunk, names_df
+
+
+def iter_journaled_names(chunks: Iterable, journal: RunJournal | None, name_stages) -> Iterator[tuple]:
+    """
+    Resume stage around the LLM and JSON parse stages: chunks finished in an earlier run are taken from the journal
+    instead of being sent again, the names of every newly finished chunk are recorded. Yields (chunk, names_df) in
+    chunk order like iter_parsed_names.
+
+    :param chunks: Iterable of text chunks.
+    :param journal: The journal of the run, None runs all chunks.
+    :param name_stages: Function running the LLM and parse stages on an iterable of chunks,
+                        e.g. lambda chunks: iter_parsed_names(iter_responses(chunks, connector)).
+    """
+    if journal is None:
+        yield from name_stages(chunks)
+        return
+    pending: deque = deque()  # (nr, chunk, names_df or None if sent) in chunk order
+
+    def iter_unfinished_chunks() -> Iterator:
+        for nr, chunk in enumerate(chunks):
+            names_df = journal.get(nr)
+            pending.append((nr, chunk, names_df))
+            if names_df is None:
+                yield chunk
+
+    stages = name_stages(iter_unfinished_chunks())
+    try:
+        for chunk, names_df in stages:
+            while pending[0][2] is not None:
+                _, done_chunk, done_names_df = pending.popleft()
+                yield done_chunk, done_names_df
+            nr, _, _ = pending.popleft()
+            journal.record(nr, names_df)
+            yield chunk, names_df
+    finally:
+        stages.close()
+    for _, done_chunk, done_names_df in pending:
+        yield done_chunk, done_names_df
+
+
+def evaluate_prefilter_recall(pdf_file, threshold: float = Constants.CHUNK_PREFILTER_THRESHOLD,
+                              max_in_flight: int = Constants.LLM_MAX_IN_FLIGHT) -> dict:
+    """
+    Evaluation mode of the prefilter: sends ALL chunks to the LLM and measures which share of the names and of the
+    chunks with names would have been kept with the prefilter.
+
+    :param pdf_file: The path to the PDF file.
+    :param threshold: Prefilter threshold to evaluate.
+    :param max_in_flight: Maximum number of concurrent LLM requests.
+    :return: Dict with the name recall, the recall of chunks with names, the skip ratio and the lost names.
+    """
+    document = PdfDocument.from_pdf(pdf_file)
+    prefilter = ChunkPrefilter(threshold=threshold)
+    connector = create_connector()
+    stats_since = stats_mark(connector)
+    all_ids: set = set()
+    kept_ids: set = set()
+    chunks_with_names = kept_chunks_with_names = 0
+    try:
+        responses = iter_llm_responses(iter_chunks(document), connector, max_in_flight=max_in_flight)
+        for nr, (chunk, names_df) in enumerate(iter_parsed_names(responses)):
+            kept = prefilter.keep(chunk, nr)
+            if names_df.empty:
+                continue
+            ids = set(add_name_ids(names_df)['id'])
+            all_ids.update(ids)
+            chunks_with_names += 1
+            if kept:
+                kept_ids.update(ids)
+                kept_chunks_with_names += 1
+    finally:
+        close_connector(connector, stats_since)
+
+    report = prefilter.get_report()
+    result = {'threshold': threshold,
+              'name_recall': len(kept_ids) / len(all_ids) if all_ids else 1.0,
+              'chunk_recall': kept_chunks_with_names / chunks_with_names if chunks_with_names else 1.0,
+              'skipped_ratio': report['skipped_ratio'],
+              'lost_names': sorted(all_ids - kept_ids)}
+    print(f'Prefilter evaluation: {result}')
+    return result
+
+
+def add_name_ids(names_df: pd.DataFrame) -> pd.DataFrame:
+    names_df = names_df.copy()
+    names_df['id'] = names_df[Constants.EXTRACT_COLUMN_KEYS[0]] + '_' + names_df[Constants.EXTRACT_COLUMN_KEYS[1]]
+    return names_df
+
+
+def iter_name_pages(parsed_names: Iterable[tuple], document: PdfDocument,
+                    exclude_pages: list, pages_offset: int,
+                    search_mode: str | None = None) -> Iterator[tuple]:
+    """
+    Page lookup stage, yields (chunk, new_names_df) with the names of the chunk and the pages they are found on.
+    Names that are not found on any page are dropped, like in index_for_names. The word index of the document is
+    built once, so every chunk only checks the candidate pages of its names.
+
+    In the 'full' search mode (see Constants.NAME_PAGE_SEARCH_MODE) every name is looked up only once, on its
+    first chunk. In the scoped modes a name is searched on the source pages of every chunk it is extracted from,
+    so the same name can be yielded again with further pages, see merge_name_pages.
+    """
+    search_mode = search_mode or Constants.NAME_PAGE_SEARCH_MODE
+    scoped = search_mode != 'full'
+    document.get_word_index()
+    seen_ids: set = set()
+    for chunk, names_df in parsed_names:
+        names_df = add_name_ids(names_df)
+        names_df = names_df.drop_duplicates(subset=['id'])
+        if not scoped:
+            names_df = names_df[~names_df['id'].isin(seen_ids)]
+        names_df = names_df.set_index('id')
+        seen_ids.update(names_df.index)
+        if names_df.empty:
+            yield chunk, names_df
+            continue
+        name_scopes = None
+        if scoped and Constants.SOURCE_PAGES_COLUMN in names_df.columns:
+            name_scopes = names_df[Constants.SOURCE_PAGES_COLUMN].to_dict()
+        with contextlib.redirect_stdout(io.StringIO()):  # the search stats of every chunk
+            name_to_pages = run_name_index(pdf_path=None, names_list=list(names_df.index),
+                                           exclude_pages=exclude_pages, pages_offset=pages_offset,
+                                           use_word_index=True, document=document,
+                                           name_scopes=name_scopes, search_mode=search_mode)
+        names_df['pages'] = names_df.index.map(name_to_pages)
+        names_df = names_df[~names_df['pages'].str.len().eq(0)]
+        yield chunk, names_df
+
+
+def merge_name_pages(result_parts: list) -> pd.DataFrame:
+    """Joins the names of all chunks, names found in several chunks get the union of their pages."""
+    names_df = pd.concat(result_parts)
+    if names_df.index.is_unique:
+        return names_df
+    page_columns = [column for column in ('pages', Constants.SOURCE_PAGES_COLUMN) if column in names_df.columns]
+    aggregations = {column: 'first' for column in names_df.columns}
+    aggregations.update({column: lambda pages: sorted(set(flatten_list(list(pages)))) for column in page_columns})
+    return names_df.groupby(level=0, sort=False).agg(aggregations)
+
+
+def stream_index_for_names(pdf_file, exclude_pages: list | None = None, pages_offset: int = 19,
+                           max_in_flight: int = Constants.LLM_MAX_IN_FLIGHT,
+                           request_budget=None,
+                           extract_workers: int | None = Constants.PDF_EXTRACT_WORKERS,
+                           batch_size: int = Constants.CHUNK_BATCH_SIZE) -> Iterator[tuple]:
+    """
+    Runs the whole pipeline as generator and yields (names_df, progress) after every chunk.
+    names_df contains all names found so far, progress is a dict with chunk count, throughput and ETA.
+
+    :param pdf_file: The path to the PDF file.
+    :param exclude_pages: Page numbers to skip in the page lookup.
+    :param pages_offset: Offset added to all found page numbers.
+    :param max_in_flight: Maximum number of concurrent LLM requests.
+    :param request_budget: Optional semaphore limiting the concurrent LLM requests, e.g. shared with other documents.
+    :param extract_workers: Number of processes extracting the PDF text, see PdfDocument.from_pdf.
+    :param batch_size: Number of short chunks sent together in one request.
+    """
+    start_time = time.perf_counter()
+    document = PdfDocument.from_pdf(pdf_file, workers=extract_workers)
+    total_pages = max(len(document), 1)
+    splitter = create_splitter()
+    chunks = iter_prefiltered_chunks(splitter.iter_split_document(document))
+    journal = RunJournal.for_pdf(pdf_file, splitter.max_tokens, batch_size) if Constants.USE_RUN_JOURNAL else None
+    connector = create_connector(request_budget)
+    stats_since = stats_mark(connector)
+    parsed_names = iter_journaled_names(chunks, journal, lambda unfinished_chunks: iter_parsed_names(
+        iter_responses(unfinished_chunks, connector, max_in_flight=max_in_flight, batch_size=batch_size,
+                       max_batch_tokens=splitter.max_tokens)))
+    found_names = iter_name_pages(parsed_names, document, exclude_pages=exclude_pages or [], pages_offset=pages_offset)
+    result_parts: list = []
+    names_df = pd.DataFrame()
+    try:
+        for chunks_done, (chunk, new_names_df) in enumerate(found_names, start=1):
+            if not new_names_df.empty:
+                result_parts.append(new_names_df)
+                names_df = merge_name_pages(result_parts)
+            elapsed = time.perf_counter() - start_time
+            done_fraction = chunk.end_page / total_pages if isinstance(chunk, str_utils.TextChunk) else 0.0
+            eta = elapsed / done_fraction - elapsed if done_fraction > 0 else None
+            yield names_df, {'chunks_done': chunks_done,
+                             'names_found': len(names_df),
+                             'chunks_per_minute': 60 * chunks_done / elapsed if elapsed > 0 else 0.0,
+                             'progress': done_fraction,
+                             'total_pages': len(document),
+                             'elapsed_s': elapsed,
+                             'eta_s': eta}
+        if journal is not None:
+            journal.mark_finished()
+    finally:
+        # a closed generator (e.g. a cancelled job) first waits for the requests in flight, they still use the cache
+        found_names.close()
+        parsed_names.close()
+        if journal is not None:
+            journal.close()
+        close_connector(connector, stats_since)
@@ -0,0 +1,87 @@
+import re
+from typing import Iterable, Iterator
+
+from Constants import Constants
+from utils.str_utils import TextChunk
+
+# (pattern, weight) of the signals that a text cites or mentions persons
+CITATION_SIGNALS = [
+    (re.compile(r'\(\s*(?:1[5-9]|20)\d{2}[a-z]?\s*[,;:)]'), 3.0),  # (2017, p. 45) or (2019)
+    (re.compile(r'\bet\s+al\b\.?'), 3.0),
+    (re.compile(r'\b(?:vgl|Vgl|cf|Cf|See|see|ibid|Ibid|ebd|Ebd)\.?\s+[A-Z]'), 2.0),  # footnote markers
+    (re.compile(r'\b(?:Dr|Prof|Mr|Mrs|Ms|Saint|St|Sir)\.?\s+[A-Z][a-z]'), 3.0),  # honorifics
+    (re.compile(r'\b[A-Z][a-z]+(?:\'s|s\')\s'), 1.0),  # possessives like Kant's
+    (re.compile(r'\b[A-Z][a-z]+,?\s+(?:1[5-9]|20)\d{2}\b'), 1.5),  # Krieber 2017
+    (re.compile(r'\b(?:pp?|S)\.\s*\d+'), 1.0),  # page references
+    (re.compile(r'(?<![.!?:]\s)(?<!^)\b[A-Z][a-z]+(?:[ \-][A-Z][a-z]+)+', flags=re.MULTILINE), 1.0),  # Paul Hawking
+]
+# single capitalized words inside a sentence, weak since nouns are capitalized in German texts
+CAPITALIZED_WORD = re.compile(r'(?<![.!?:]\s)(?<!^)\b[A-Z][a-z]{2,}\b', flags=re.MULTILINE)
+CAPITALIZED_WORD_WEIGHT = 0.25
+
+
+class ChunkPrefilter:
+    """
+    Cheap local prefilter in front of the LLM: scores every chunk for the likelihood of containing names or
+    citations and only passes chunks with a score of at least the threshold.
+    Chunks without any signal, e.g. tables, equations or prose without citations, are skipped and reported.
+
+    :param threshold: Minimum score of a chunk to be sent to the LLM.
+    """
+
+    def __init__(self, threshold: float = Constants.CHUNK_PREFILTER_THRESHOLD) -> None:
+        self.threshold = threshold
+        self.scored_chunks = 0
+        self.skipped: list = []  # (chunk nr, pages, score) of every skipped chunk
+
+    @staticmethod
+    def score(text: str) -> float:
+        """
+        Scores a text by the weighted number of name and citation signals.
+
+        :param text: The text of a chunk.
+        :return: The score, 0 if the text has no signal at all.
+        """
+        score = sum(weight * len(pattern.findall(text)) for pattern, weight in CITATION_SIGNALS)
+        return score + CAPITALIZED_WORD_WEIGHT * len(CAPITALIZED_WORD.findall(text))
+
+    def keep(self, chunk: str | TextChunk, nr: int = 0) -> bool:
+        """
+        Returns if the chunk should be sent to the LLM and records it in the report if not.
+
+        :param chunk: The text chunk.
+        :param nr: Number of the chunk, only used for the report.
+        """
+        text = chunk.text if isinstance(chunk, TextChunk) else chunk
+        score = self.score(text)
+        self.scored_chunks += 1
+        if score >= self.threshold:
+            return True
+        self.skipped.append((nr, chunk.pages if isinstance(chunk, TextChunk) else None, score))
+        return False
+
+    def iter_filter(self, chunks: Iterable) -> Iterator:
+        """Prefilter stage, yields only the chunks that should be sent to the LLM."""
+        for nr, chunk in enumerate(chunks):
+            if self.keep(chunk, nr):
+                yield chunk
+
+    def get_report(self) -> dict:
+        """Returns the number of scored, sent and skipped chunks and the skipped chunks themselves."""
+        return {'chunks': self.scored_chunks,
+                'sent': self.scored_chunks - len(self.skipped),
+                'skipped': len(self.skipped),
+                'skipped_ratio': len(self.skipped) / self.scored_chunks if self.scored_chunks else 0.0,
+                'skipped_chunks': [{'nr': nr, 'pages': pages, 'score': score}
+                                   for nr, pages, score in self.skipped]}
+
+
+if __name__ == "__main__":
+    texts = [*Constants.EXAMLES_USER,
+             "Table 3\n0.25 0.31 0.44\n0.12 0.19 0.27\n",
+             "the results of the analysis show that the framework holds for all cases considered here.",
+             "Dieser Gedanke findet sich bereits bei Hegel, vgl. Hegel 1807, S. 23."]
+    prefilter = ChunkPrefilter()
+    for text in texts:
+        print(f'{prefilter.score(text):6.2f} | {prefilter.keep(text)} | {text[:70]!r}')
+    print(prefilter.get_report())
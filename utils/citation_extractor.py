@@ -0,0 +1,151 @@
+import re
+
+from Constants import Constants
+
+NAME = r"[A-ZÄÖÜ][a-zäöüßéèáàíóúç]+(?:[-'][A-ZÄÖÜ][a-zäöüßéèáàíóúç]+)?"
+YEAR = r"(?:1[5-9]|20)\d{2}[a-z]?"
+PAGES = r"(?:,\s*(?:p|pp|S)\.\s*\d+(?:\s*[-–]\s*\d+)?f{0,2}\.?)?"
+AND = r"\s+(?:and|und|&)\s+"
+INITIALS = r"(?:[A-ZÄÖÜ]\.\s*)+"
+# words before a capitalized word that make it a place or an event rather than an author: "between Germany and France"
+PLACE_PREPOSITIONS = {'in', 'In', 'im', 'Im', 'of', 'between', 'across', 'at', 'to', 'from', 'nach', 'aus', 'zwischen'}
+# capitalized words that precede years or footnote markers but are no names
+NON_NAMES = {'In', 'The', 'See', 'Vgl', 'Cf', 'Ibid', 'Ebd', 'Table', 'Tab', 'Figure', 'Fig', 'Chapter', 'Kapitel',
+             'Section', 'Vol', 'Band', 'Bd', 'Nr', 'No', 'Part', 'Teil', 'Edition', 'Since', 'Seit', 'Until', 'Bis',
+             'Year', 'Jahr', 'Summer', 'Winter', 'Spring', 'Autumn', 'Fall', 'January', 'February', 'March', 'April',
+             'May', 'June', 'July', 'August', 'September', 'October', 'November', 'December', 'Januar', 'Februar',
+             'März', 'Juni', 'Juli', 'Oktober', 'Dezember', 'This', 'That', 'These', 'Dies', 'Diese', 'After', 'Before',
+             'Nach', 'Vor', 'Im', 'Am', 'Von', 'From', 'Et', 'Al'}
+
+
+class CitationExtractor:
+    """
+    Rule based fast path in front of the LLM: extracts the authors of mechanically recognizable citations such as
+    "Krieber (2017, p. 45)", "Krieber et al. (2017)", "J. Krieber (2017)", "Mandrel & Osterlich (2019)",
+    "(Krieber, 2017, p. 3; Mandrel et al. 2019)" and footnotes like "12\t\nSee Krieber", and removes them from the text.
+    Only the last names are known from these patterns, so the first name is "-" like in the LLM answers.
+
+    Capitalized words before a year may as well be places or events ("between Germany and France (1870)",
+    "(Bavaria, 2019)", "Treaty of Versailles (1919)"), so a citation is only taken with evidence of an author:
+    initials, "et al.", "&"/"und" or a page locator. Everything else is left in the text for the LLM.
+
+    :param footnote_patterns: Regex patterns with the placeholder 'name' marking footnote mentions. Only patterns with
+                              a marker word before the name are used, a bare capitalized word at the start of a
+                              footnote ("12\t\nAccording to ...") is no author.
+    """
+
+    def __init__(self, footnote_patterns: list = Constants.FOOTNOTE_RE_PATTERNS) -> None:
+        self.narrative_regex = re.compile(
+            rf"(?P<initials>{INITIALS})?\b(?P<names>{NAME}(?:(?:,\s*|{AND}){NAME})*)(?P<et_al>\s+et\s+al\.?)?"
+            rf"\s*\(\s*{YEAR}(?P<pages>{PAGES})\s*\)")
+        self.parenthetical_regex = re.compile(
+            rf"\((?P<refs>{NAME}(?:(?:,\s*|{AND}){NAME})*(?:\s+et\s+al\.?)?,?\s+{YEAR}{PAGES}"
+            rf"(?:\s*;\s*{NAME}(?:(?:,\s*|{AND}){NAME})*(?:\s+et\s+al\.?)?,?\s+{YEAR}{PAGES})*)\)")
+        self.reference_regex = re.compile(rf"(?P<initials>{INITIALS})?(?P<names>{NAME}(?:(?:,\s*|{AND}){NAME})*)"
+                                          rf"(?P<et_al>\s+et\s+al\.?)?,?\s+{YEAR}(?P<pages>{PAGES})")
+        self.name_regex = re.compile(NAME)
+        self.preceding_name_regex = re.compile(rf"\b({NAME})\s+$")
+        self.preceding_word_regex = re.compile(r"(\w+)\s+$")
+        self.footnote_regexes = [re.compile(pattern.replace('name+', 'name').replace('name', rf"(?P<names>{NAME})"))
+                                 for pattern in footnote_patterns
+                                 # a marker word before the name ("See", "vgl\."), not only the footnote number
+                                 if re.search(r'[^\W\d_]{2,}(?:\\\.)?$', pattern.split('name', 1)[0].rstrip())]
+
+    def extract(self, text: str) -> tuple:
+        """
+        Extracts the cited names and removes the citations from the text.
+
+        :param text: The text of a chunk.
+        :return: Tuple of the list of name dictionaries in the Constants.EXTRACT_COLUMN_KEYS schema, without
+                 duplicates, and the remaining text.
+        """
+        names: dict = {}  # ordered set of last names
+        spans: list = []
+        for match in self.narrative_regex.finditer(text):
+            if not self._is_author_citation(match):
+                continue
+            if not match.group('initials'):
+                # "Albert Einstein (1905)": the first name is not part of the pattern, leave it to the LLM
+                preceding = self.preceding_name_regex.search(text, max(0, match.start() - 40), match.start())
+                if preceding and preceding.group(1) not in NON_NAMES:
+                    continue
+                preceding = self.preceding_word_regex.search(text, max(0, match.start() - 40), match.start())
+                if preceding and preceding.group(1) in PLACE_PREPOSITIONS:
+                    continue
+            if self._add_names(match.group('names'), names):
+                spans.append(match.span())
+        for match in self.parenthetical_regex.finditer(text):
+            # the citation is only removed if all its references are taken, else the LLM gets all of it
+            references = list(self.reference_regex.finditer(match.group('refs')))
+            if references and all(self._is_author_citation(reference) for reference in references):
+                reference_names: dict = {}
+                if all(self._add_names(reference.group('names'), reference_names) for reference in references):
+                    names.update(reference_names)
+                    spans.append(match.span())
+        for footnote_regex in self.footnote_regexes:
+            for match in footnote_regex.finditer(text):
+                if self._add_names(match.group('names'), names):
+                    spans.append(match.span('names'))
+
+        rows = [{Constants.EXTRACT_COLUMN_KEYS[0]: '-', Constants.EXTRACT_COLUMN_KEYS[1]: last_name}
+                for last_name in names]
+        return rows, self._remove_spans(text, spans)
+
+    @staticmethod
+    def _is_author_citation(match: re.Match) -> bool:
+        """Returns if the citation has evidence of an author: initials, "et al.", "&"/"und" or a page locator."""
+        return bool(match.group('initials') or match.group('et_al') or match.group('pages')
+                    or re.search(r'\s(?:&|und)\s', match.group('names')))
+
+    def _add_names(self, names_str: str, names: dict) -> bool:
+        """Adds the names of a citation, returns False if the citation contains a word that is no name."""
+        cited_names = self.name_regex.findall(names_str)
+        if not cited_names or any(name in NON_NAMES for name in cited_names):
+            return False
+        for name in cited_names:
+            names[name] = None
+        return True
+
+    @staticmethod
+    def _remove_spans(text: str, spans: list) -> str:
+        """Removes the (possibly overlapping) character spans from the text."""
+        if not spans:
+            return text
+        parts = []
+        position = 0
+        for start, end in sorted(spans):
+            if start > position:
+                parts.append(text[position:start])
+            position = max(position, end)
+        parts.append(text[position:])
+        return ''.join(parts)
+
+
+if __name__ == "__main__":
+    extractor = CitationExtractor()
+    for text in [*Constants.EXAMLES_USER,
+                 "This view is contested (Krieber, 2017, p. 3; Mandrel & Osterlich 2019) and Smith et al. (2020)."]:
+        rows, remaining_text = extractor.extract(text)
+        print(rows, '\n', remaining_text, '\n')
+
+    # Regression check: names of citations with author evidence are extracted, places and sentence starts are not
+    expected_names = {
+        "As noted by Krieber (2017, p. 45), the quest continues.": ['Krieber'],
+        "As argued by J. Krieber (2017), the quest continues.": ['Krieber'],
+        "Mandrel & Osterlich (2019) disagree.": ['Mandrel', 'Osterlich'],
+        "This is contested (Krieber et al., 2017; Mandrel, 2019, p. 3).": ['Krieber', 'Mandrel'],
+        "12\t\nSee Krieber, Epistemic Theology, p. 3.": ['Krieber'],
+        "12\t\nAccording to the survey the turnout rose.": [],
+        "The war between Germany and France (1870) changed the map.": [],
+        "Turnout was highest in the south (Bavaria, 2019).": [],
+        "The Treaty of Versailles (1919) ended the war.": [],
+        "In Germany (2019, p. 4) the turnout rose.": [],
+        "In (2019) the Table (2020) shows no citation.": [],
+        "This is contested (Krieber, 2017; Bavaria, 2019).": [],
+    }
+    for text, expected in expected_names.items():
+        rows, remaining_text = extractor.extract(text)
+        found = [row[Constants.EXTRACT_COLUMN_KEYS[1]] for row in rows]
+        assert found == expected, f'{text!r}: expected {expected}, got {found}'
+        assert (remaining_text == text) == (not expected), f'{text!r}: the citation must be removed only if taken'
+    print('citation extractor self-check passed')
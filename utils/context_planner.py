@@ -0,0 +1,123 @@
+import re
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+import requests
+
+from Constants import Constants
+from utils.str_utils import TextTokenSplitter
+from utils.token_counter import TokenCounter
+
+
+def fetch_model_context_length(llm_url: str | None = None, model_name: str | None = None,
+                               timeout: float = 5.0) -> int | None:
+    """
+    Reads the context length of the model from an Ollama server (/api/show).
+    The num_ctx parameter of the model is the window Ollama actually runs with. If it is not set, the maximum
+    context of the model is capped at Constants.CONTEXT_LENGTH, since Ollama then runs with its default window.
+
+    :param llm_url: URL of the OpenAI compatible endpoint, e.g. http://localhost:11434/v1/, Constants.LLM_URL if None.
+    :param model_name: Name of the model, Constants.MODEL_NAME if None.
+    :param timeout: Timeout of the request in seconds.
+    :return: The context length or None if the server does not provide it.
+    """
+    llm_url = llm_url or Constants.LLM_URL
+    model_name = model_name or Constants.MODEL_NAME
+    url_parts = urlsplit(llm_url)
+    try:
+        response = requests.post(f'{url_parts.scheme}://{url_parts.netloc}/api/show',
+                                 json={'model': model_name}, timeout=timeout)
+        response.raise_for_status()
+        model_info = response.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f'Could not read the context length of {model_name}: {e}')
+        return None
+
+    num_ctx = re.search(r'^\s*num_ctx\s+(\d+)', model_info.get('parameters', ''), flags=re.MULTILINE)
+    if num_ctx:
+        return int(num_ctx.group(1))
+    max_context = [value for key, value in model_info.get('model_info', {}).items()
+                   if key.endswith('.context_length')]
+    if max_context:
+        return min(int(max_context[0]), Constants.CONTEXT_LENGTH)
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_model_context_length(llm_url: str, model_name: str) -> int | None:
+    """Returns the context length of the model on the server, read once per URL and model."""
+    return fetch_model_context_length(llm_url, model_name)
+
+
+def get_context_length() -> int | None:
+    """
+    Returns the context length of Constants.MODEL_NAME on the servers the requests go to, Constants.LLM_BACKEND_URLS
+    or Constants.LLM_URL. With several backends the smallest one, as every chunk may be sent to each of them.
+    None if a server does not provide it.
+    """
+    context_lengths = [get_model_context_length(url, Constants.MODEL_NAME)
+                       for url in Constants.LLM_BACKEND_URLS or [Constants.LLM_URL]]
+    return None if None in context_lengths else min(context_lengths)
+
+
+class ChunkBudgetPlanner:
+    """
+    Plans the token budget of the text chunks so each request fills the context window of the model:
+    context length - prompt overhead (system prompt, examples, user base prompt) - reserved output - safety margin.
+
+    If the server does not provide the context length, the fixed Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH is used.
+    A planned budget smaller than the fixed one is still used, as larger chunks would overflow the window and be
+    truncated by the server, but at least Constants.MIN_CHUNK_TOKEN_LENGTH tokens and with a warning: the documents
+    are split into many more requests, a small window is better raised on the server (num_ctx of the Ollama model).
+
+    :param context_length: Context length of the model, read from the server if None, see get_context_length.
+    :param output_reserve: Tokens reserved for the answer of the model.
+    :param safety_margin: Fraction of the context kept free, as the token counts of the chunks are estimates.
+    :param count_typ: Token counter type used for the overhead and the chunks, see TokenCounter.
+    :param min_budget: Smallest chunk budget used, however small the context window is.
+    """
+
+    def __init__(self, context_length: int | None = None,
+                 output_reserve: int = Constants.OUTPUT_TOKEN_RESERVE,
+                 safety_margin: float = Constants.CONTEXT_SAFETY_MARGIN,
+                 count_typ: str = Constants.CHUNK_TOKEN_COUNT_TYP,
+                 min_budget: int = Constants.MIN_CHUNK_TOKEN_LENGTH) -> None:
+        if context_length is None:
+            context_length = get_context_length()
+        self.context_length = context_length
+        self.output_reserve = output_reserve
+        self.safety_margin = safety_margin
+        self.count_typ = count_typ
+        self.min_budget = min_budget
+        self.token_counter = TokenCounter(count_typ=count_typ)
+
+    def prompt_overhead_tokens(self) -> int:
+        """Tokens of everything sent with each chunk: system prompt, examples and user base prompt."""
+        prompt_texts = [Constants.SYSTEM_PROMPT, *Constants.EXAMLES_USER, *Constants.EXAMPLES_ASSISTANT,
+                        Constants.USER_BASE_PROMPT]
+        return sum(self.token_counter.count_tokens_batch(prompt_texts))
+
+    def chunk_budget(self) -> int:
+        """
+        Returns the number of tokens left for the text of a chunk, Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH if the
+        context length is unknown and at least min_budget.
+        """
+        if self.context_length is None:
+            return Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH
+        overhead = self.prompt_overhead_tokens()
+        budget = int(self.context_length * (1 - self.safety_margin)) - overhead - self.output_reserve
+        if budget < Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH:
+            print(f'Warning: the context length {self.context_length} leaves only {budget} tokens per chunk next to '
+                  f'the prompt overhead of {overhead} tokens and {self.output_reserve} output tokens, less than the '
+                  f'fixed budget of {Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH} tokens, using '
+                  f'{max(budget, self.min_budget)} tokens. Raise the context length (num_ctx) of the model on the '
+                  f'server.')
+            budget = max(budget, self.min_budget)
+        return budget
+
+    def create_splitter(self) -> TextTokenSplitter:
+        """Returns a splitter packing the chunks up to the planned budget."""
+        budget = self.chunk_budget()
+        print(f'Chunk budget: {budget} tokens of a {self.context_length or "unknown"} token context')
+        return TextTokenSplitter(count_typ=self.count_typ, max_tokens=budget,
+                                 overlap_tokens=min(Constants.PARAGRAPH_SPLIT_OVERLAP, budget // 4))
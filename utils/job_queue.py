@@ -0,0 +1,190 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from Constants import Constants
+
+
+class JobCancelled(Exception):
+    """Raised inside a cancelled job when it tries to send another LLM request."""
+
+
+class FairRequestBudget:
+    """
+    Global cap of concurrent LLM requests shared fairly by the running jobs: with n active jobs, a job may use at most
+    ceil(cap / n) slots, so a long book cannot starve a small one. Unused shares are not lent to other jobs beyond
+    their fair share, which keeps the waiting time of a newly started job short.
+
+    :param max_in_flight: Maximum number of concurrent LLM requests of all jobs together.
+    """
+
+    def __init__(self, max_in_flight: int = Constants.JOB_MAX_IN_FLIGHT) -> None:
+        self.max_in_flight = max_in_flight
+        self.in_flight: dict = {}  # job id -> requests in flight of the active jobs
+        self._condition = threading.Condition()
+
+    def register(self, job_id: str) -> None:
+        with self._condition:
+            self.in_flight.setdefault(job_id, 0)
+            self._condition.notify_all()
+
+    def unregister(self, job_id: str) -> None:
+        with self._condition:
+            self.in_flight.pop(job_id, None)
+            self._condition.notify_all()
+
+    def fair_share(self) -> int:
+        return max(1, -(-self.max_in_flight // max(len(self.in_flight), 1)))
+
+    def acquire(self, job: 'IndexJob') -> None:
+        with self._condition:
+            while (sum(self.in_flight.values()) >= self.max_in_flight
+                   or self.in_flight[job.job_id] >= self.fair_share()):
+                if job.cancel_event.is_set():
+                    raise JobCancelled(job.job_id)
+                self._condition.wait(timeout=1.0)
+            if job.cancel_event.is_set():
+                raise JobCancelled(job.job_id)
+            self.in_flight[job.job_id] += 1
+
+    def release(self, job: 'IndexJob') -> None:
+        with self._condition:
+            self.in_flight[job.job_id] -= 1
+            self._condition.notify_all()
+
+
+class JobBudget:
+    """The view of a job on the fair budget, usable as request_budget of the pipeline (a context manager)."""
+
+    def __init__(self, budget: FairRequestBudget, job: 'IndexJob') -> None:
+        self.budget = budget
+        self.job = job
+
+    def __enter__(self) -> None:
+        self.budget.acquire(self.job)
+
+    def __exit__(self, *exc_info) -> None:
+        self.budget.release(self.job)
+
+
+class IndexJob:
+    """An indexing job of one document with its status, progress and (partial) result."""
+
+    def __init__(self, job_id: str, pdf_file: str) -> None:
+        self.job_id = job_id
+        self.pdf_file = pdf_file
+        self.status = 'queued'  # queued, running, done, failed or cancelled
+        self.progress: dict = {}
+        self.result = None  # DataFrame with the names found so far
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status in ('done', 'failed', 'cancelled')
+
+
+class JobQueue:
+    """
+    Runs indexing jobs in the background: submit returns a job id at once, the jobs run on a small thread pool and
+    share one fair budget of concurrent LLM requests. Finished jobs are kept for retention_seconds, at most
+    max_finished of them.
+
+    :param run_job: Function (job, request_budget) running the job and updating job.progress and job.result.
+    :param max_running: Maximum number of jobs running at the same time, further jobs wait in the queue.
+    :param max_in_flight: Maximum number of concurrent LLM requests of all jobs together.
+    :param max_finished: Maximum number of finished jobs kept.
+    :param retention_seconds: Time after which finished jobs are dropped.
+    """
+
+    def __init__(self, run_job,
+                 max_running: int = Constants.JOB_MAX_RUNNING,
+                 max_in_flight: int = Constants.JOB_MAX_IN_FLIGHT,
+                 max_finished: int = Constants.JOB_MAX_FINISHED,
+                 retention_seconds: float = Constants.JOB_RETENTION_SECONDS) -> None:
+        self.run_job = run_job
+        self.budget = FairRequestBudget(max_in_flight)
+        self.max_finished = max_finished
+        self.retention_seconds = retention_seconds
+        self.jobs: dict = {}  # job id -> IndexJob in submission order
+        self._executor = ThreadPoolExecutor(max_workers=max_running, thread_name_prefix='index-job')
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, pdf_file: str) -> str:
+        """Queues a job for the document and returns its id."""
+        with self._lock:
+            self._prune()
+            job = IndexJob(f'job-{next(self._ids)}-{int(time.time())}', pdf_file)
+            self.jobs[job.job_id] = job
+        self._executor.submit(self._run, job)
+        return job.job_id
+
+    def get(self, job_id: str) -> IndexJob | None:
+        with self._lock:
+            self._prune()
+            return self.jobs.get(job_id)
+
+    def status(self, job_id: str) -> dict:
+        """Returns status, progress, error, queue position and the names found so far (None before) of the job."""
+        job = self.get(job_id)
+        if job is None:
+            return {'status': 'unknown'}
+        with self._lock:
+            queued = [j for j in self.jobs.values() if j.status == 'queued']
+        return {'status': job.status,
+                'progress': dict(job.progress),
+                'error': job.error,
+                'queue_position': queued.index(job) + 1 if job in queued else 0,
+                'result': job.result}
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancels the job: no further chunk requests are sent, requests in flight still finish.
+
+        :return: False if the job is unknown or already finished.
+        """
+        job = self.get(job_id)
+        if job is None or job.is_finished:
+            return False
+        job.cancel_event.set()
+        return True
+
+    def shutdown(self) -> None:
+        for job in list(self.jobs.values()):
+            job.cancel_event.set()
+        self._executor.shutdown(wait=True)
+
+    def _run(self, job: IndexJob) -> None:
+        if job.cancel_event.is_set():
+            self._finish(job, 'cancelled')
+            return
+        job.status = 'running'
+        self.budget.register(job.job_id)
+        try:
+            self.run_job(job, JobBudget(self.budget, job))
+            self._finish(job, 'cancelled' if job.cancel_event.is_set() else 'done')
+        except JobCancelled:
+            self._finish(job, 'cancelled')
+        except Exception as e:
+            job.error = f'{type(e).__name__}: {e}'
+            self._finish(job, 'failed')
+        finally:
+            self.budget.unregister(job.job_id)
+
+    @staticmethod
+    def _finish(job: IndexJob, status: str) -> None:
+        job.status = status
+        job.finished = time.time()
+        print(f'Job {job.job_id} ({job.pdf_file}) {status}' + (f': {job.error}' if job.error else ''))
+
+    def _prune(self) -> None:
+        """Drops expired finished jobs and the oldest ones beyond max_finished, caller holds the lock."""
+        now = time.time()
+        finished = sorted((job for job in self.jobs.values() if job.is_finished), key=lambda job: job.finished)
+        for index, job in enumerate(finished):
+            if now - job.finished > self.retention_seconds or len(finished) - index > self.max_finished:
+                del self.jobs[job.job_id]
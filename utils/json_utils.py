@@ -9,169 +9,322 @@ import re
 from utils.other_utils import flatten_list
 
 
+BARE_VALUES = {'true': True, 'false': False, 'null': None, 'none': None, 'None': None}
+NUMBER_REGEX = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?')
+JSON_DECODER = json.JSONDecoder()
+STRING_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f'}
+
+
+class _Frame:
+    """An open JSON container while scanning."""
+    __slots__ = ('opener', 'container', 'key', 'colon')
+
+    def __init__(self, opener: str) -> None:
+        self.opener = opener
+        self.container = [] if opener == '[' else {}
+        self.key = None  # pending key of an object
+        self.colon = False  # the pending key was followed by ':'
+
+
 class JsonStrToDict:
-    def __init__(self, max_attempts: int = 3):
+    def __init__(self, max_length: int = 1_000_000, max_depth: int = 32):
         """
-        Initialize with a maximum number of attempts to fix a JSON string.
+        Lenient single pass JSON parser for LLM answers: tolerates stray prose around the JSON, single quotes,
+        unquoted keys and values, trailing commas, missing values and missing closing brackets.
+        Well-formed JSON is decoded by the json module, everything else by a state machine that visits every
+        character a constant number of times, without recursion.
+
+        :param max_length: Only the first max_length characters of an answer are parsed.
+        :param max_depth: Brackets nested deeper are ignored.
         """
-        self.max_attempts = max_attempts
+        self.max_length = max_length
+        self.max_depth = max_depth
 
-    def json_to_dict(self, json_str: str) -> list:
+    def json_to_dict(self, json_str: str, extra_fields: dict | None = None) -> list:
         """
-        Converts a JSON array within a string to a list of dictionaries.
-        Tries to fix malformed JSON strings recursively.
+        Converts the JSON arrays and objects within a string to a list of dictionaries.
 
         :param json_str: Input JSON string.
+        :param extra_fields: Optional fields added to every parsed dictionary, e.g. the source pages of the text.
         :return: List of dictionaries.
         """
         if json_str is None:
             print("Input string is None. Returning empty list.")
             return []
 
-        json_str = self._prefix_json_str(json_str)
-        match_all = re.findall(r"\[.*?]", json_str)
-        if len(match_all) == 0:
-            match_all = re.findall(r"\{.*?}", json_str)  # if no json list try with only {}
-            match_all = re.findall(r"\[.*?]", str(match_all))
         json_list = []
-
-        if match_all:
-            for element in match_all:
-                try:
-                    json_list.extend(json.loads(element))
-                except json.JSONDecodeError as e:
-                    if self.max_attempts > 0:
-                        print(f"JSON decoding failed: {e}. Attempting to fix...")
-                        fixed_json_str = self.fix_json_string(str(match_all))
-                        return self.json_to_dict(fixed_json_str)
-        return json_list
-
-    def fix_json_string(self, json_str: str) -> str:
+        for value in self.parse_values(json_str):
+            elements = value if isinstance(value, list) else [value]
+            for element in elements:
+                # nested lists like [[{...}]] are flattened one level
+                json_list.extend(element if isinstance(element, list) else [element])
+        json_list = [element for element in json_list if isinstance(element, dict)]
+        return self._add_extra_fields(json_list, extra_fields)
+
+    def grouped_json_to_dict(self, json_str: str, chunk_ids: list) -> dict | None:
         """
-        Attempts to fix a malformed JSON string by extracting key-value pairs.
-
-        :param json_str: Malformed JSON string.
-        :return: Fixed JSON string.
-        """
-        json_str = self._remove_invalid_characters(json_str)
-        potential_objects = self._extract_json_objects(json_str)
-
-        if not potential_objects:
-            return "[]"
-
-        fixed_data_list = self._process_potential_objects(potential_objects)
-        return json.dumps(fixed_data_list)
-
-    def rebuild_json_string(self, json_str: str) -> str:
-        """
-        Rebuilds a JSON string by splitting, cleaning, and reassembling key-value pairs.
+        Converts a chunk-tagged JSON object, e.g. {"0": [{...}], "1": []}, to a dictionary of name lists per chunk.
+        A chunk answered with a string like "no name found" has no names.
 
         :param json_str: Input JSON string.
-        :return: Rebuilt JSON string.
+        :param chunk_ids: Ids of all chunks that must be in the answer.
+        :return: Dictionary with the list of dictionaries of every chunk id or None if the answer is malformed.
         """
-        split_string = self._split_and_clean_string(json_str)
-        keys, values = self._extract_keys_and_values(split_string)
-        return str(dict(zip(keys, values)))
-
-    @staticmethod
-    def _prefix_json_str(json_str: str) -> str:
+        if json_str is None:
+            return None
+        grouped = next((value for value in self.parse_values(json_str) if isinstance(value, dict)), None)
+        if grouped is None:
+            return None
+
+        grouped_names = {}
+        for chunk_id in chunk_ids:
+            if str(chunk_id) not in grouped:
+                return None
+            names = grouped[str(chunk_id)]
+            if names is None or isinstance(names, str):
+                names = []
+            elif isinstance(names, dict):
+                names = [names]
+            if not isinstance(names, list):
+                return None
+            grouped_names[chunk_id] = [name for name in names if isinstance(name, dict)]
+        return grouped_names
+
+    def parse_values(self, json_str: str) -> list:
         """
-        Fixes common JSON string mistakes such as single quotes and newlines.
+        Scans the string once and returns all top-level JSON arrays and objects in it, text outside of them is
+        skipped. Containers still open at the end are closed, unfinished objects in them are dropped.
 
-        :param json_str: JSON string.
-        :return: Fixed JSON string.
+        :param json_str: Input string.
+        :return: List of the parsed top-level lists and dictionaries.
         """
-        return json_str.replace("\n", "").replace("'", '"')
+        text = json_str[:self.max_length]
+        values: list = []
+        stack: list = []
+        position, length = 0, len(text)
+        while position < length:
+            char = text[position]
+            if not stack:
+                if char in '[{':
+                    try:  # fast path for well-formed JSON, the lenient scan only runs if it fails
+                        value, position = JSON_DECODER.raw_decode(text, position)
+                        values.append(value)
+                        continue
+                    except json.JSONDecodeError:
+                        stack.append(_Frame(char))
+                position += 1
+            elif char.isspace():
+                position += 1
+            elif char == ',':
+                self._end_item(stack[-1])
+                position += 1
+            elif char == ':':
+                if stack[-1].key is not None:
+                    stack[-1].colon = True
+                position += 1
+            elif char in '[{':
+                if len(stack) < self.max_depth:
+                    stack.append(_Frame(char))
+                position += 1
+            elif char in ']}':
+                opener = '[' if char == ']' else '{'
+                # a closing bracket also closes the containers opened after its opener, e.g. [{"a": 1,]
+                if any(frame.opener == opener for frame in stack):
+                    while True:
+                        frame = stack.pop()
+                        self._close_frame(frame, stack, values)
+                        if frame.opener == opener:
+                            break
+                position += 1
+            elif char in '"\'':
+                value, position = self._read_string(text, position)
+                self._add_value(stack[-1], value)
+            else:
+                value, position = self._read_bare_value(text, position)
+                self._add_value(stack[-1], value)
+        while stack:  # missing closing brackets, e.g. a cut off answer
+            frame = stack.pop()
+            if frame.opener == '[':
+                self._close_frame(frame, stack, values)
+        return values
+
+    def _close_frame(self, frame: _Frame, stack: list, values: list) -> None:
+        self._end_item(frame)
+        if stack:
+            self._add_value(stack[-1], frame.container)
+        else:
+            values.append(frame.container)
 
     @staticmethod
-    def _remove_invalid_characters(json_str: str) -> str:
-        """
-        Removes invalid characters not part of the JSON structure.
-
-        :param json_str: JSON string.
-        :return: Cleaned JSON string.
-        """
-        return re.sub(r'[^\{\}\[\]\,\"\:\w\s\.\-]', "", json_str)
+    def _add_value(frame: _Frame, value) -> None:
+        if isinstance(frame.container, list):
+            frame.container.append(value)
+        elif frame.key is None:
+            if not isinstance(value, (list, dict)):
+                frame.key = value if isinstance(value, str) else json.dumps(value)
+        else:  # a value after a key, with or without ':'
+            frame.container[frame.key] = value
+            frame.key, frame.colon = None, False
 
     @staticmethod
-    def _extract_json_objects(json_str: str) -> list:
-        """
-        Extracts JSON-like objects (curly braces or square brackets).
-
-        :param json_str: JSON string.
-        :return: List of extracted JSON objects.
-        """
-        objects = re.findall(r"\{.*?}", json_str)
-        return objects or re.findall(r"\[.*?]", json_str)
-
-    def _process_potential_objects(self, potential_objects: list) -> list:
-        """
-        Processes potential JSON objects, fixing common issues.
-
-        :param potential_objects: List of JSON-like strings.
-        :return: List of fixed JSON dictionaries.
-        """
-        data_list = []
-        for obj_str in potential_objects:
-            fixed_obj_str = self._fix_common_json_issues(obj_str)
-            try:
-                data_list.append(json.loads(fixed_obj_str))
-            except json.JSONDecodeError as e:
-                rebuilt_str = self.rebuild_json_string(fixed_obj_str)
-                try:
-                    data_list.append(json.loads(rebuilt_str))
-                except json.JSONDecodeError:
-                    print(f"Failed to fix object: {fixed_obj_str} due to {e}")
-        return data_list
+    def _end_item(frame: _Frame) -> None:
+        """Ends the current object item at a ',', a key followed by ':' but no value gets None."""
+        if isinstance(frame.container, dict) and frame.key is not None:
+            if frame.colon:
+                frame.container[frame.key] = None
+            frame.key, frame.colon = None, False
 
     @staticmethod
-    def _fix_common_json_issues(json_str: str) -> str:
+    def _read_string(text: str, position: int) -> tuple:
         """
-        Fixes common JSON syntax issues like missing quotes.
+        Reads a string in single or double quotes. A quote only ends the string if it is followed by a structural
+        character or another quote, so quotes inside names like O'Neil do not end it.
 
-        :param json_str: JSON string.
-        :return: Fixed JSON string.
+        :return: Tuple of the string and the position after it.
         """
-        json_str = re.sub(r"'", '"', json_str)  # Replace single quotes
-        json_str = re.sub(r"(\w+)\s*:", r'"\1":', json_str)  # Quote keys
-        return re.sub(r':\s*([^,"\{\}\[\]]+)\s*(,|\})', r': "\1"\2', json_str)  # Quote values
+        quote = text[position]
+        chars = []
+        position += 1
+        length = len(text)
+        while position < length:
+            char = text[position]
+            if char == '\\' and position + 1 < length:
+                escaped = text[position + 1]
+                if escaped == 'u' and position + 6 <= length:
+                    try:
+                        chars.append(chr(int(text[position + 2:position + 6], 16)))
+                        position += 6
+                        continue
+                    except ValueError:
+                        pass
+                chars.append(STRING_ESCAPES.get(escaped, escaped))
+                position += 2
+                continue
+            if char == quote:
+                next_position = position + 1
+                while next_position < length and text[next_position].isspace():
+                    next_position += 1
+                if next_position >= length or text[next_position] in ',:]}"\'':
+                    return ''.join(chars), position + 1
+            chars.append(char)
+            position += 1
+        return ''.join(chars), position
 
     @staticmethod
-    def _split_and_clean_string(json_str: str) -> list:
+    def _read_bare_value(text: str, position: int) -> tuple:
         """
-        Splits JSON strings by separators and removes unwanted characters.
+        Reads an unquoted key or value up to the next structural character or line end.
 
-        :param json_str: JSON string.
-        :return: Cleaned list of split components.
+        :return: Tuple of the value (number, bool, None or string) and the position after it.
         """
-        split_string = json_str.split(",")
-        split_string = [s.split('"') for s in split_string]
-        split_string = flatten_list(split_string)
-        split_string = [s.split(":") for s in split_string]
-        split_string = flatten_list(split_string)
-        return [s for s in split_string if not JsonStrToDict.has_only_special_chars(s)]
+        start = position
+        length = len(text)
+        while position < length and text[position] not in ',:[]{}\n':
+            position += 1
+        token = text[start:position].strip()
+        if token in BARE_VALUES:
+            return BARE_VALUES[token], position
+        if NUMBER_REGEX.fullmatch(token):
+            return (float(token) if any(c in token for c in '.eE') else int(token)), position
+        return token, position
 
     @staticmethod
-    def _extract_keys_and_values(split_string: list) -> (list, list):
+    def _add_extra_fields(json_list: list, extra_fields: dict | None) -> list:
         """
-        Extracts keys and values from a split JSON string.
+        Adds the extra fields to every dictionary of the list.
 
-        :param split_string: List of JSON string components.
-        :return: Tuple of keys and values.
+        :param json_list: List of parsed JSON elements.
+        :param extra_fields: Fields to add, None to add nothing.
+        :return: List with the extended dictionaries.
         """
-        keys = [x for i, x in enumerate(split_string) if i % 2 == 0]
-        values = [x for i, x in enumerate(split_string) if i % 2 != 0]
-        return keys, values
-
-    @staticmethod
-    def has_only_special_chars(s: str) -> bool:
+        if not extra_fields:
+            return json_list
+        return [{**element, **extra_fields} if isinstance(element, dict) else element for element in json_list]
+
+
+class IncrementalJsonListParser:
+    """
+    Parses a streamed LLM answer chunk by chunk and returns every name object of the top-level JSON list as soon
+    as it is complete. The answer is done when the top-level list (or object) is closed and not followed by another
+    one, or when the "no name found" sentinel appears before any JSON. Only a top-level object, an empty list or a
+    list with objects ends the answer, a bracket group in the prose such as "Names found in [1]:" is skipped.
+
+    :param sentinel: Answer text meaning that there are no names.
+    """
+
+    def __init__(self, sentinel: str = 'no name found') -> None:
+        self.sentinel = sentinel
+        self.text = ''  # consumed answer text up to the end of the JSON
+        self.done = False
+        self.objects: list = []
+        self._json_parser = JsonStrToDict()
+        self._stack: list = []  # open brackets
+        self._quote: str | None = None  # quote char of the current string
+        self._escape = False
+        self._object_start = 0
+        self._group_start = 0  # position of the open top-level bracket
+        self._group_objects = 0  # objects completed in the open top-level list
+        self._closed = False  # a top-level container was closed, waiting for ',' or another container
+
+    def feed(self, delta: str) -> list:
         """
-        Checks if a string contains only special characters.
+        Consumes the next part of the answer.
 
-        :param s: Input string.
-        :return: True if only special characters, False otherwise.
+        :param delta: New answer text.
+        :return: List of the name dictionaries completed by this part.
         """
-        return not any(c.isalnum() for c in s)
+        if self.done:
+            return []
+        text = self.text + delta
+        new_objects = []
+        position = len(self.text)
+        for position in range(len(self.text), len(text)):
+            char = text[position]
+            if self._quote is not None:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == self._quote:
+                    self._quote = None
+                continue
+            if self._closed and not char.isspace():
+                if char not in ',[{':
+                    self.done = True
+                    break
+                self._closed = False
+            if char in '"\'' and self._stack:
+                # a single quote inside a word is an apostrophe, not a string
+                if char == '"' or not text[position - 1].isalnum():
+                    self._quote = char
+            elif char in '[{':
+                self._stack.append(char)
+                if len(self._stack) == 1:
+                    self._group_start = position
+                    self._group_objects = 0
+                elif char == '{' and self._stack == ['[', '{']:
+                    self._object_start = position
+            elif char in ']}' and self._stack:
+                opener = self._stack.pop()
+                if opener == '{' and self._stack == ['[']:
+                    self._group_objects += 1
+                    object_str = text[self._object_start:position + 1]
+                    try:
+                        new_objects.append(json.loads(object_str))
+                    except json.JSONDecodeError:
+                        parsed = self._json_parser.json_to_dict('[' + object_str + ']')
+                        new_objects.extend(element for element in parsed if isinstance(element, dict))
+                if not self._stack:
+                    # a list of scalars like "[1]" is no answer, keep looking for the JSON
+                    self._closed = (opener == '{' or self._group_objects > 0
+                                    or not text[self._group_start + 1:position].strip())
+        else:
+            position = len(text)
+        self.text = text[:position]
+        if not self._stack and not self.objects and not new_objects and self.sentinel in self.text.lower():
+            self.done = True
+        self.objects.extend(new_objects)
+        return new_objects
 
 
 if __name__ == "__main__":
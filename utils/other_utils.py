@@ -22,9 +22,22 @@ def flatten_list(nested_list):
 
 def clean_pandas_df(pandas_df: pd.DataFrame,
                     limit_cols: list = Constants.EXTRACT_COLUMN_KEYS,
-                    values_to_clean: tuple = (np.nan, "-", "", None, "None", "no name found", "none")):
+                    values_to_clean: tuple = (np.nan, "-", "", None, "None", "no name found", "none"),
+                    keep_cols: tuple = ()):
+    """
+    Cleans the limit_cols of the DataFrame and drops rows in which all of them are empty.
+
+    :param pandas_df: DataFrame to clean.
+    :param limit_cols: Columns to clean and keep.
+    :param values_to_clean: Values treated as empty.
+    :param keep_cols: Additional columns kept without cleaning, if they exist.
+    :return: The cleaned DataFrame.
+    """
     cleaned_df = pandas_df[limit_cols]
     cleaned_df = cleaned_df.replace(to_replace=values_to_clean, value=pd.NA)
     cleaned_df = cleaned_df.dropna(how='all')
     cleaned_df = cleaned_df.replace(to_replace=pd.NA, value="")
+    for col in keep_cols:
+        if col in pandas_df.columns:
+            cleaned_df[col] = pandas_df.loc[cleaned_df.index, col]
     return cleaned_df
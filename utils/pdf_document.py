@@ -0,0 +1,149 @@
+import bisect
+import math
+import multiprocessing
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+
+import pymupdf
+
+from Constants import Constants
+from indexer.page_word_index import PageWordIndex
+from utils.text_cache import PageTextCache
+
+PAGE_SEPARATOR = ' '
+# settings that change the extracted text, part of the text cache key
+EXTRACTION_SETTINGS = {'pymupdf': pymupdf.VersionBind, 'text_mode': 'text'}
+
+
+class PdfDocument:
+    """
+    Text of a PDF document, extracted once and shared between chunking and name indexing.
+
+    Holds the text of every page and a map from character offsets in the joined document text to page numbers.
+
+    :param pages: Dictionary with page numbers (starting from 1) as keys and page text as values.
+    :param pdf_path: Path of the source PDF, if any.
+    :param word_index: Optional inverted word index of the pages.
+    """
+
+    def __init__(self, pages: dict[int:str], pdf_path: str | pathlib.Path | None = None,
+                 word_index: PageWordIndex | None = None) -> None:
+        self.pages = pages
+        self.pdf_path = pdf_path
+        self.word_index = word_index
+        self.page_numbers: list = list(pages)
+        self.page_offsets: list = []
+        offset = 0
+        for text in pages.values():
+            self.page_offsets.append(offset)
+            offset += len(text) + len(PAGE_SEPARATOR)
+
+    @classmethod
+    def from_pdf(cls, pdf_path: str | pathlib.Path, word_index: PageWordIndex | None = None,
+                 workers: int | None = Constants.PDF_EXTRACT_WORKERS,
+                 parallel_min_pages: int = Constants.PDF_PARALLEL_MIN_PAGES,
+                 text_cache: PageTextCache | None = None) -> 'PdfDocument':
+        """
+        Opens and extracts the PDF exactly once, or loads its page texts from the text cache.
+        Documents with at least parallel_min_pages pages are extracted by a pool of worker processes, each
+        extracting a range of pages. Smaller documents are extracted in this process to avoid the spawn overhead.
+
+        :param pdf_path: The path to the PDF file.
+        :param word_index: Optional inverted word index that is filled with the words of each page during extraction.
+        :param workers: Number of worker processes, None uses the number of CPUs and 1 disables parallel extraction.
+        :param parallel_min_pages: Minimum number of pages for parallel extraction.
+        :param text_cache: Cache of already extracted texts, defaults to the cache in Constants.PDF_TEXT_CACHE_DIR
+                           if Constants.USE_PDF_TEXT_CACHE is set.
+        :return: The extracted document.
+        """
+        if text_cache is None and Constants.USE_PDF_TEXT_CACHE:
+            text_cache = PageTextCache()
+        cache_key = PageTextCache.make_key(pdf_path, EXTRACTION_SETTINGS) if text_cache is not None else None
+        page_texts = text_cache.load(cache_key) if text_cache is not None else None
+        if page_texts is None:
+            page_texts = extract_pages(pdf_path, workers, parallel_min_pages)
+            if text_cache is not None:
+                text_cache.store(cache_key, page_texts)
+
+        pages = {}
+        for page_number, text in enumerate(page_texts, start=1):  # 1-based page numbers, PyMuPDF indexes from 0
+            pages[page_number] = text
+            if word_index is not None:
+                word_index.add_page(page_number, text)
+        return cls(pages=pages, pdf_path=pdf_path, word_index=word_index)
+
+    @property
+    def text(self) -> str:
+        """The whole document text, pages joined like in get_total_pdf_text. Built on demand and not stored."""
+        return PAGE_SEPARATOR.join(self.pages.values())
+
+    def page_at_offset(self, offset: int) -> int:
+        """Returns the page number containing the character offset of the joined document text."""
+        position = bisect.bisect_right(self.page_offsets, offset) - 1
+        return self.page_numbers[max(position, 0)]
+
+    def get_word_index(self) -> PageWordIndex:
+        """Returns the word index of the document and builds it from the pages if it does not exist yet."""
+        if self.word_index is None:
+            self.word_index = PageWordIndex()
+            for page_number, text in self.pages.items():
+                self.word_index.add_page(page_number, text)
+        return self.word_index
+
+    def __len__(self) -> int:
+        return len(self.pages)
+
+
+def extract_pages(pdf_path: str | pathlib.Path, workers: int | None, parallel_min_pages: int) -> list:
+    """
+    Extracts the text of all pages, with a process pool for documents with at least parallel_min_pages pages.
+
+    :param pdf_path: The path to the PDF file.
+    :param workers: Number of worker processes, None uses the number of CPUs.
+    :param parallel_min_pages: Minimum number of pages for parallel extraction.
+    :return: List with the text of every page in page order.
+    """
+    doc = pymupdf.open(pdf_path)
+    page_count = doc.page_count
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and page_count >= max(parallel_min_pages, 2):
+        doc.close()
+        return extract_pages_parallel(pdf_path, page_count, workers)
+    page_texts = [page.get_text() for page in doc]
+    doc.close()
+    return page_texts
+
+
+def extract_page_range(pdf_path: str | pathlib.Path, start: int, end: int) -> list:
+    """
+    Extracts the text of the pages start (inclusive) to end (exclusive), zero-indexed. Runs in a worker process.
+
+    :param pdf_path: The path to the PDF file.
+    :param start: First page index.
+    :param end: Page index after the last page.
+    :return: List with the text of every page in the range.
+    """
+    doc = pymupdf.open(pdf_path)
+    page_texts = [doc[page_index].get_text() for page_index in range(start, end)]
+    doc.close()
+    return page_texts
+
+
+def extract_pages_parallel(pdf_path: str | pathlib.Path, page_count: int, workers: int) -> list:
+    """
+    Extracts all pages with a process pool. Every worker opens the file itself and extracts a contiguous page range.
+    The workers are spawned, not forked: the calling process runs threads (jobs, connection pools, sqlite connections)
+    whose locks a forked child could inherit in a locked state.
+
+    :param pdf_path: The path to the PDF file.
+    :param page_count: Number of pages of the PDF.
+    :param workers: Number of worker processes.
+    :return: List with the text of every page in page order.
+    """
+    range_size = math.ceil(page_count / workers)
+    starts = range(0, page_count, range_size)
+    ends = [min(start + range_size, page_count) for start in starts]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        page_ranges = executor.map(extract_page_range, [pdf_path] * len(starts), starts, ends)
+        return [text for page_texts in page_ranges for text in page_texts]
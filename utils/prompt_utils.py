@@ -1,3 +1,4 @@
+from Constants import Constants
 from utils.token_counter import TokenCounter
 
 
@@ -5,14 +6,24 @@ class PromptCreator:
     """
     A class for creating and managing conversational prompts, including user, assistant, and system prompts.
 
+    The token count of every message is stored with the message and a running total is kept, so counting the tokens
+    of the history only tokenizes messages that were not counted before. Messages are counted on the first query,
+    so no tokenizer is loaded if the tokens are never counted.
+    A fixed prefix (system prompt and examples) can be frozen, it is restored with its counts on every
+    delete_prompt_history and shared by copies of the creator.
+
     :param system_prompt: The initial system prompt content that serves as the foundation of the conversation.
     :type system_prompt: str
     """
 
     def __init__(self, system_prompt: str) -> None:
         self.system_prompt = system_prompt
-        self.prompt_history = [self.set_system_prompt()]
         self.token_counter = TokenCounter(count_typ='local')
+        self.prompt_history = []
+        self.token_counts = []  # token counts of the messages counted so far, always the first messages
+        self.total_tokens = 0  # sum of all counted messages
+        self._fixed_prefix = None  # (prompt_history, token_counts) restored by delete_prompt_history
+        self._append_message(self.set_system_prompt())
 
     def get_prompt_history(self) -> list:
         """
@@ -34,6 +45,7 @@ class PromptCreator:
             system_prompt = self.system_prompt
         else:
             self.system_prompt = system_prompt
+            self._fixed_prefix = None  # the prefix starts with the old system prompt
         return self._create_prompt(content=system_prompt)
 
     def add_user_prompt(self, content) -> None:
@@ -45,7 +57,7 @@ class PromptCreator:
         """
         user_prompt = self._create_prompt(content=content,
                                           role='user')
-        self.prompt_history.append(user_prompt)
+        self._append_message(user_prompt)
 
     def add_assistant_message(self, content) -> None:
         """
@@ -56,30 +68,83 @@ class PromptCreator:
         """
         assistant_prompt = self._create_prompt(content=content,
                                                role='assistant')
-        self.prompt_history.append(assistant_prompt)
+        self._append_message(assistant_prompt)
 
     def delete_prompt_history(self, delete_system_prompt=False):
         """
-        Delete the entire prompt history default behaviour except for the system prompt.
+        Delete the entire prompt history default behaviour except for the system prompt,
+        or except for the fixed prefix if one was frozen with freeze_prefix.
         if delete_system_prompt is set to true the system prompt is also deleted
 
         :return: None
         """
+        self.prompt_history = []
+        self.token_counts = []
+        self.total_tokens = 0
         if delete_system_prompt:
-            self.prompt_history = []
+            return
+        if self._fixed_prefix is not None:
+            prefix_history, prefix_counts = self._fixed_prefix
+            self.prompt_history = list(prefix_history)
+            self.token_counts = list(prefix_counts)
+            self.total_tokens = sum(prefix_counts)
         else:
-            self.prompt_history = [self.set_system_prompt()]
+            self._append_message(self.set_system_prompt())
 
     def delete_last_prompt_history_element(self):
+        if len(self.token_counts) == len(self.prompt_history):
+            self.total_tokens -= self.token_counts.pop(-1)
         self.prompt_history.pop(-1)
 
+    def freeze_prefix(self) -> None:
+        """
+        Freezes the current history, e.g. system prompt and examples, as fixed prefix.
+        The prefix is tokenized once now and restored with its token counts by delete_prompt_history.
+        """
+        self.count_tokens_in_prompt_history()
+        self._fixed_prefix = (list(self.prompt_history), list(self.token_counts))
+
+    def copy(self) -> 'PromptCreator':
+        """
+        Returns an independent copy of the creator sharing the already counted tokens and the fixed prefix,
+        e.g. to build the prompt of a single request from a prepared prefix.
+        """
+        prompt_copy = PromptCreator.__new__(PromptCreator)
+        prompt_copy.system_prompt = self.system_prompt
+        prompt_copy.token_counter = self.token_counter
+        prompt_copy.prompt_history = list(self.prompt_history)
+        prompt_copy.token_counts = list(self.token_counts)
+        prompt_copy.total_tokens = self.total_tokens
+        prompt_copy._fixed_prefix = self._fixed_prefix
+        return prompt_copy
+
+    def _append_message(self, message: dict) -> None:
+        self.prompt_history.append(message)
+
     @staticmethod
     def _create_prompt(content: str,
                        role: str = 'system') -> dict:
         return {"role": role, "content": content}
 
-    def count_tokens_in_prompt_history(self):
-        return sum([self.token_counter.count_tokens(p['content']) for p in self.prompt_history])
+    def count_tokens_in_prompt_history(self) -> int:
+        """
+        Returns the number of tokens of the whole prompt history. Only messages not counted before are tokenized.
+        """
+        uncounted = self.prompt_history[len(self.token_counts):]
+        if uncounted:
+            counts = self.token_counter.count_tokens_batch([p['content'] for p in uncounted])
+            self.token_counts.extend(counts)
+            self.total_tokens += sum(counts)
+        return self.total_tokens
+
+    def remaining_tokens(self, context_length: int = Constants.CONTEXT_LENGTH) -> int:
+        """
+        Returns how many tokens are left in the context window for further messages and the answer.
+
+        :param context_length: Context length of the model.
+        :return: Number of remaining tokens, negative if the history already exceeds the context.
+        """
+        return context_length - self.count_tokens_in_prompt_history()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import pathlib
+import threading
+import time
+
+import pandas as pd
+
+from Constants import Constants
+from utils.chunk_prefilter import CAPITALIZED_WORD, CAPITALIZED_WORD_WEIGHT, CITATION_SIGNALS
+from utils.text_cache import PageTextCache
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+# Settings changing the chunks or the answers of the LLM, a run is only resumed if none of them changed. The chunk
+# budget and the batch size the run actually uses and the prefilter rules are part of the key as well.
+JOURNAL_SETTINGS = ('MODEL_NAME', 'TEMPERATURE', 'TOP_P', 'CONTEXT_LENGTH', 'TEXT_SPLIT_MAX_TOKEN_LENGTH',
+                    'PLAN_CHUNKS_FROM_CONTEXT', 'OUTPUT_TOKEN_RESERVE', 'CONTEXT_SAFETY_MARGIN',
+                    'CHUNK_TOKEN_COUNT_TYP', 'PARAGRAPH_SPLIT_OVERLAP', 'SYSTEM_PROMPT', 'USER_BASE_PROMPT',
+                    'BATCH_USER_BASE_PROMPT', 'EXAMLES_USER', 'EXAMPLES_ASSISTANT', 'BATCH_EXAMPLES_USER',
+                    'BATCH_EXAMPLES_ASSISTANT', 'USE_CHUNK_PREFILTER', 'CHUNK_PREFILTER_THRESHOLD',
+                    'USE_CITATION_FAST_PATH')
+FILE_SUFFIX = '.jsonl'
+LOCK_SUFFIX = '.lock'
+
+
+class JournalLockedError(RuntimeError):
+    """Raised if another run, in this or another process, is writing the journal."""
+
+
+def _try_lock(lock_file) -> bool:
+    """Takes the exclusive lock of the open file without waiting, returns False if someone else holds it."""
+    try:
+        if os.name == 'nt':
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+def _unlock(lock_file) -> None:
+    if os.name == 'nt':
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+class RunJournal:
+    """
+    Append-only JSONL journal of an indexing run, keyed by the content hash of the PDF and the settings in
+    JOURNAL_SETTINGS. The parsed names of every chunk are appended and flushed to disk as soon as the chunk is done,
+    so a rerun after a crash or a server restart skips all finished chunks. A truncated last line of a crashed run
+    is ignored. Only one run at a time may write a journal, it holds an exclusive lock on the <journal>.lock file.
+
+    Lines: a header {"pdf", "started"}, one {"chunk", "columns", "rows"} per finished chunk and {"finished"} at the end.
+
+    :param path: Path of the journal file.
+    :param pdf_file: The path to the PDF file, only stored for listing the runs.
+    :raises JournalLockedError: If another run is writing the journal, e.g. a second job on the same PDF.
+    """
+
+    def __init__(self, path: str | pathlib.Path, pdf_file: str | None = None) -> None:
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.done: dict = {}  # chunk index -> names_df of the finished chunks
+        self.finished = False
+        self._lock = threading.Lock()
+        self._lock_file = open(self.path.with_suffix(LOCK_SUFFIX), 'a')
+        if not _try_lock(self._lock_file):
+            self._lock_file.close()
+            raise JournalLockedError(f'The run journal {self.path} is in use by another run of the same document.')
+        if self.path.exists():
+            self._load()
+            if self.done:
+                print(f'Resuming run {self.path.name}: {len(self.done)} chunks already done')
+        self._file = open(self.path, 'a', encoding='utf-8', newline='\n')
+        if not self.path.stat().st_size:
+            self._append({'pdf': str(pdf_file), 'started': time.time()})
+
+    @classmethod
+    def for_pdf(cls, pdf_file, chunk_budget: int, batch_size: int = Constants.CHUNK_BATCH_SIZE,
+                journal_dir: str | pathlib.Path = Constants.RUN_JOURNAL_DIR) -> 'RunJournal':
+        """
+        Opens the journal of the document with the current settings, a new one if there is none yet.
+
+        :param pdf_file: The path to the PDF file.
+        :param chunk_budget: Token budget the chunks were split with, e.g. planned from the context on the server.
+        :param batch_size: Number of short chunks the run sends together in one request.
+        :param journal_dir: Directory of the journals.
+        """
+        settings = {name: getattr(Constants, name) for name in JOURNAL_SETTINGS}
+        settings['chunk_budget'] = chunk_budget
+        settings['batch_size'] = batch_size
+        if Constants.USE_CHUNK_PREFILTER:
+            settings['prefilter_rules'] = [(pattern.pattern, weight) for pattern, weight in CITATION_SIGNALS] + \
+                                          [(CAPITALIZED_WORD.pattern, CAPITALIZED_WORD_WEIGHT)]
+        key = PageTextCache.make_key(pdf_file, settings)
+        return cls(pathlib.Path(journal_dir) / f'{key}{FILE_SUFFIX}', str(pathlib.Path(pdf_file).resolve()))
+
+    def get(self, chunk_nr: int) -> pd.DataFrame | None:
+        """Returns the names of the chunk if it was finished in an earlier run, else None."""
+        return self.done.get(chunk_nr)
+
+    def record(self, chunk_nr: int, names_df: pd.DataFrame) -> None:
+        """Appends the parsed names of a finished chunk."""
+        self.done[chunk_nr] = names_df
+        self._append({'chunk': chunk_nr, 'columns': list(names_df.columns), 'rows': names_df.values.tolist()})
+
+    def mark_finished(self) -> None:
+        self.finished = True
+        self._append({'finished': time.time()})
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+            _unlock(self._lock_file)
+            self._lock_file.close()
+
+    def _append(self, entry: dict) -> None:
+        line = json.dumps(entry, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _load(self) -> None:
+        data = self.path.read_bytes()
+        *lines, cut_off = data.split(b'\n')
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if 'chunk' in entry:
+                self.done[entry['chunk']] = pd.DataFrame(entry['rows'], columns=entry['columns'])
+            elif 'finished' in entry:
+                self.finished = True
+        if cut_off:
+            # drop the line cut off by a crash, so the next entry starts on a line of its own
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.truncate(len(data) - len(cut_off))
+
+
+def list_runs(journal_dir: str | pathlib.Path = Constants.RUN_JOURNAL_DIR) -> list:
+    """Returns a dict per journal with its file, PDF, chunk count, state and age, the newest first."""
+    runs = []
+    for path in pathlib.Path(journal_dir).glob(f'*{FILE_SUFFIX}'):
+        run = {'file': str(path), 'pdf': None, 'chunks_done': 0, 'finished': False,
+               'age_days': (time.time() - path.stat().st_mtime) / 86400}
+        with open(path, encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                run['pdf'] = entry.get('pdf', run['pdf'])
+                run['chunks_done'] += 'chunk' in entry
+                run['finished'] = run['finished'] or 'finished' in entry
+        runs.append(run)
+    return sorted(runs, key=lambda r: r['age_days'])
+
+
+def clean_runs(journal_dir: str | pathlib.Path = Constants.RUN_JOURNAL_DIR,
+               stale_days: float = Constants.RUN_JOURNAL_STALE_DAYS, include_finished: bool = False) -> list:
+    """
+    Deletes the stale journals: unfinished runs not touched for stale_days and runs of deleted PDFs.
+
+    :param journal_dir: Directory of the journals.
+    :param stale_days: Age in days after which an unfinished run is stale.
+    :param include_finished: Also delete finished runs older than stale_days.
+    :return: The deleted runs.
+    """
+    deleted = []
+    for run in list_runs(journal_dir):
+        too_old = run['age_days'] > stale_days and (include_finished or not run['finished'])
+        if too_old or (run['pdf'] and not os.path.exists(run['pdf'])):
+            os.remove(run['file'])
+            lock_path = pathlib.Path(run['file']).with_suffix(LOCK_SUFFIX)
+            if lock_path.exists():
+                os.remove(lock_path)
+            deleted.append(run)
+    return deleted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='List and clean up the journals of indexing runs.')
+    parser.add_argument('command', choices=['list', 'clean'])
+    parser.add_argument('--dir', default=Constants.RUN_JOURNAL_DIR, help='Directory of the run journals.')
+    parser.add_argument('--stale-days', type=float, default=Constants.RUN_JOURNAL_STALE_DAYS,
+                        help='Age in days after which an unfinished run is stale.')
+    parser.add_argument('--include-finished', action='store_true',
+                        help='Also delete finished runs older than --stale-days.')
+    args = parser.parse_args()
+    if args.command == 'list':
+        for run in list_runs(args.dir):
+            state = 'finished' if run['finished'] else 'unfinished'
+            print(f"{run['age_days']:6.1f}d  {state:<10}  {run['chunks_done']:>5} chunks  {run['pdf']}  ({run['file']})")
+    else:
+        for run in clean_runs(args.dir, args.stale_days, args.include_finished):
+            print(f"deleted {run['file']} ({run['pdf']})")
+
+
+if __name__ == "__main__":
+    main()
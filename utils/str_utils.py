@@ -1,16 +1,14 @@
-import math
-
-import pymupdf
+import re
+from dataclasses import dataclass
+from typing import Iterator
 
 from Constants import Constants
+from utils.pdf_document import PdfDocument
 from utils.token_counter import TokenCounter
 
 
 def get_total_pdf_text(pdf_path: str):
-    doc = pymupdf.open(pdf_path)
-    text_pages: list = [page.get_text() for page in doc]
-    pure_text: str = ' '.join(text_pages)
-    return pure_text
+    return PdfDocument.from_pdf(pdf_path).text
 
 
 def split_with_overlap(elemet_to_split: str | list, num_parts: int, overlap: int) -> list:
@@ -59,9 +57,34 @@ def clean_text(text: str, clean_side='both'):
         return text[start:end].strip()
 
 
+@dataclass
+class TextChunk:
+    """A text chunk together with the page span of the document it was taken from."""
+    text: str
+    start_page: int
+    end_page: int
+
+    @property
+    def pages(self) -> list:
+        return list(range(self.start_page, self.end_page + 1))
+
+
 class TextTokenSplitter:
-    def __init__(self):
-        self.text = None
+    """
+    Splits texts into chunks of paragraphs that fill a token budget.
+
+    :param count_typ: Token counter type used for the budget, see TokenCounter.
+    :param max_tokens: Token budget of a chunk, defaults to Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH.
+    :param overlap_tokens: Tokens shared by consecutive parts of a paragraph larger than the budget,
+                           defaults to Constants.PARAGRAPH_SPLIT_OVERLAP.
+    """
+
+    def __init__(self, count_typ: str = 'estimate', max_tokens: int | None = None,
+                 overlap_tokens: int | None = None):
+        self.chunk_spans: list = []
+        self.token_counter = TokenCounter(count_typ=count_typ)
+        self.max_tokens = max_tokens if max_tokens is not None else Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH
+        self.overlap_tokens = overlap_tokens if overlap_tokens is not None else Constants.PARAGRAPH_SPLIT_OVERLAP
 
     def split_text_by_token_paragraphs(self, text: str) -> list:
         """
@@ -74,67 +97,112 @@ class TextTokenSplitter:
         Returns:
             list: A list of text chunks that conform to the token length requirements.
         """
-        self.text = text
-        paragraphs = self._split_into_paragraphs()
-        tokens_per_paragraph = self._count_tokens_in_paragraphs(paragraphs)
         paragraphs_fitted: list = []
+        self.chunk_spans = []  # (start, end) character offsets in the text of every chunk
+        for chunk, span in self.iter_text_chunks(text):
+            paragraphs_fitted.append(chunk)
+            self.chunk_spans.append(span)
+        return paragraphs_fitted
+
+    def iter_text_chunks(self, text: str) -> Iterator[tuple[str, tuple]]:
+        """
+        Lazily splits the text into chunks, yielding every chunk as soon as it is complete.
+        Paragraphs are added to a chunk as long as the running token total stays within the budget, the pieces
+        of a chunk are joined once. Paragraphs larger than the budget are split on tokenizer offsets.
 
-        current_chunk: str = ""
-        for tokens, paragraph in zip(tokens_per_paragraph, paragraphs):
+        :param text: The input text to be split into chunks.
+        :return: Iterator of (chunk, (start, end)) with the character offsets of the chunk in the text.
+        """
+        current_pieces: list = []
+        current_tokens = 0
+        current_span = None
+        for tokens, paragraph, span in self._iter_paragraph_tokens(text):
             if tokens == 0:
                 continue
-            if len(current_chunk) + tokens + 2 < Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH:  # +2 for potential new lines
-                current_chunk = self._join_paragraph(current_chunk, paragraph)
-            else:
-                paragraphs_fitted.extend(self._process_large_paragraph(current_chunk, paragraph, tokens))
-                current_chunk: str = ""  # Reset after processing
+            separator_tokens = 1 if current_pieces else 0  # for the new line joining the paragraphs
+            if current_pieces and current_tokens + separator_tokens + tokens > self.max_tokens:
+                yield "\n".join(current_pieces), current_span
+                current_pieces, current_tokens, current_span, separator_tokens = [], 0, None, 0
+            if tokens > self.max_tokens:
+                for part in self._split_large_paragraph(paragraph):
+                    yield part, span
+                continue
+            current_pieces.append(paragraph)
+            current_tokens += separator_tokens + tokens
+            current_span = (current_span[0], span[1]) if current_span else span
 
-        if current_chunk:
-            paragraphs_fitted.append(current_chunk)
+        if current_pieces:
+            yield "\n".join(current_pieces), current_span
 
-        return paragraphs_fitted
+    def split_document(self, document: PdfDocument) -> list[TextChunk]:
+        """
+        Splits the text of an already extracted document, see split_text_by_token_paragraphs.
 
-    def _split_into_paragraphs(self) -> list:
-        split_texts = self.text.split('\n')
-        split_texts = [split.strip() for split in split_texts if len(split) > 0]
-        return split_texts
+        :param document: The extracted PDF document.
+        :return: A list of text chunks with the pages they were taken from.
+        """
+        return list(self.iter_split_document(document))
 
-    @staticmethod
-    def _count_tokens_in_paragraphs(paragraphs: list) -> list:
-        token_counter = TokenCounter()
-        return [token_counter.count_tokens(para) for para in paragraphs]
+    def iter_split_document(self, document: PdfDocument) -> Iterator[TextChunk]:
+        """
+        Lazily splits the text of an already extracted document into text chunks with the pages they were taken from.
 
-    @staticmethod
-    def _join_paragraph(current_chunk: str, paragraph: str) -> str:
-        return current_chunk + "\n" + paragraph if current_chunk else paragraph
-
-    def _process_large_paragraph(self, current_chunk: str, paragraph: str, tokens: int) -> list:
-        chunks = []
-        if current_chunk:
-            chunks.append(current_chunk)
-        if tokens > Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH:
-            chunks.extend(self._split_and_clean_paragraph(paragraph, tokens))
-        else:
-            chunks.append(paragraph)
-        return chunks
-
-    def _split_and_clean_paragraph(self, paragraph, tokens):
-        required_splits = math.ceil(tokens / Constants.TEXT_SPLIT_MAX_TOKEN_LENGTH)
-        chunks = split_with_overlap(elemet_to_split=paragraph, num_parts=required_splits,
-                                    overlap=Constants.PARAGRAPH_SPLIT_OVERLAP)
-        cleaned_chunks = self._clean_text_chunks(chunks)
-        return cleaned_chunks
+        :param document: The extracted PDF document.
+        :return: Iterator of text chunks.
+        """
+        for chunk, (start, end) in self.iter_text_chunks(document.text):
+            yield TextChunk(text=chunk,
+                            start_page=document.page_at_offset(start),
+                            end_page=document.page_at_offset(max(start, end - 1)))
+
+    def _iter_paragraph_tokens(self, text: str, batch_size: int = 256) -> Iterator[tuple[int, str, tuple]]:
+        """
+        Yields (tokens, paragraph, span) of all paragraphs of the text, counting the tokens of batch_size paragraphs at
+        once. The text is not kept on the splitter, so a long lived splitter does not keep the last document alive.
+        """
+        batch: list = []
+        for match in re.finditer(r'[^\n]+', text):
+            batch.append((match.group().strip(), match.span()))
+            if len(batch) == batch_size:
+                yield from self._count_paragraph_batch(batch)
+                batch = []
+        yield from self._count_paragraph_batch(batch)
+
+    def _count_paragraph_batch(self, batch: list) -> list:
+        tokens_per_paragraph = self._count_tokens_in_paragraphs([paragraph for paragraph, _ in batch])
+        return [(tokens, paragraph, span) for tokens, (paragraph, span) in zip(tokens_per_paragraph, batch)]
+
+    def _count_tokens_in_paragraphs(self, paragraphs: list) -> list:
+        return self.token_counter.count_tokens_batch(paragraphs)
+
+    def _split_large_paragraph(self, paragraph: str) -> list:
+        """
+        Splits a paragraph larger than the budget into parts of at most max_tokens tokens, consecutive parts share
+        overlap_tokens tokens. Parts are cut at token offsets and moved to the nearest space to not cut words.
+        """
+        offsets = self.token_counter.token_offsets(paragraph)
+        step = max(self.max_tokens - self.overlap_tokens, 1)
+        parts = []
+        for first_token in range(0, len(offsets), step):
+            last_token = first_token + self.max_tokens
+            start = self._snap_to_space(paragraph, offsets[first_token], forward=True) if first_token else 0
+            end = len(paragraph) if last_token >= len(offsets) else \
+                self._snap_to_space(paragraph, offsets[last_token], forward=False)
+            part = paragraph[start:end].strip()
+            if part:
+                parts.append(part)
+            if last_token >= len(offsets):
+                break
+        return parts
 
     @staticmethod
-    def _clean_text_chunks(chunks):
-        cleaned_chunks: list = []
-        clean_first_chunk = clean_text(chunks[0], 'end')  # remove only letters from start of first chunk
-        cleaned_chunks.append(clean_first_chunk)
-        for chunk in chunks[1:-1]:
-            cleaned_chunks.append(clean_text(chunk, 'both'))
-        clean_last_chunk = clean_text(chunks[-1], 'start')  # remove only letters from end of last chunk
-        cleaned_chunks.append(clean_last_chunk)
-        return cleaned_chunks
+    def _snap_to_space(text: str, offset: int, forward: bool, max_shift: int = 50) -> int:
+        """Moves the offset to the next (forward) or previous space within max_shift characters, if there is one."""
+        if forward:
+            space = text.find(' ', offset, offset + max_shift)
+            return space + 1 if space != -1 else offset
+        space = text.rfind(' ', max(offset - max_shift, 0), offset + 1)
+        return space if space > 0 else offset
 
 
 if __name__ == "__main__":
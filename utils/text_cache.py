@@ -0,0 +1,138 @@
+import hashlib
+import json
+import mmap
+import os
+import pathlib
+import struct
+import tempfile
+import zlib
+
+from Constants import Constants
+
+MAGIC = b'PGTXT01\0'
+HEADER = struct.Struct('<8sI')  # magic, page count
+TABLE_ENTRY = struct.Struct('<QI')  # offset, compressed length of a page
+FILE_SUFFIX = '.pgt'
+
+
+class PageTextCache:
+    """
+    On-disk cache of extracted per-page PDF text, keyed by the content hash of the PDF and the extraction settings.
+
+    Every document is stored in a single file: a header, an offset table and one zlib compressed blob per page.
+    Files are memory-mapped when read. Several processes may share the cache, every file is written to a temporary
+    file of its own and renamed.
+    If the cache exceeds max_size_bytes, the least recently used files are deleted.
+
+    :param cache_dir: Directory of the cache files.
+    :param max_size_bytes: Maximum total size of all cache files.
+    """
+
+    def __init__(self, cache_dir: str | pathlib.Path = Constants.PDF_TEXT_CACHE_DIR,
+                 max_size_bytes: int = Constants.PDF_TEXT_CACHE_MAX_BYTES) -> None:
+        self.cache_dir = pathlib.Path(cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(pdf_path: str | pathlib.Path, settings: dict) -> str:
+        """
+        Builds the cache key from the file content and the extraction settings.
+
+        :param pdf_path: The path to the PDF file.
+        :param settings: Extraction settings that change the extracted text, e.g. the pymupdf version.
+        :return: Hex digest used as cache key.
+        """
+        digest = hashlib.sha256()
+        with open(pdf_path, 'rb') as pdf_file:
+            for block in iter(lambda: pdf_file.read(1024 * 1024), b''):
+                digest.update(block)
+        digest.update(json.dumps(settings, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.cache_dir / f'{key}{FILE_SUFFIX}'
+
+    def __contains__(self, key: str) -> bool:
+        return self._path(key).exists()
+
+    def load(self, key: str) -> list | None:
+        """
+        Loads the text of all pages.
+
+        :param key: Cache key of the document.
+        :return: List with the text of every page or None if the document is not cached or the file is broken.
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as cache_file, mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                page_count = self._read_page_count(data)
+                page_texts = [self._read_page(data, page_index) for page_index in range(page_count)]
+        except (OSError, ValueError, zlib.error, struct.error):
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass  # evicted by another process meanwhile, the text was read anyway
+        return page_texts
+
+    def store(self, key: str, page_texts: list) -> None:
+        """
+        Stores the text of all pages and evicts old documents if the cache is too large.
+
+        :param key: Cache key of the document.
+        :param page_texts: List with the text of every page.
+        """
+        blobs = [zlib.compress(text.encode('utf-8')) for text in page_texts]
+        offset = HEADER.size + TABLE_ENTRY.size * len(blobs)
+        table = []
+        for blob in blobs:
+            table.append(TABLE_ENTRY.pack(offset, len(blob)))
+            offset += len(blob)
+
+        path = self._path(key)
+        # a unique temporary file, so processes storing the same document do not write into each other's file
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.tmp', delete=False) as cache_file:
+            try:
+                cache_file.write(HEADER.pack(MAGIC, len(blobs)))
+                cache_file.writelines(table)
+                cache_file.writelines(blobs)
+            except BaseException:
+                cache_file.close()
+                os.remove(cache_file.name)
+                raise
+        os.replace(cache_file.name, path)  # never leave half written files behind
+        self.evict(keep=path)
+
+    def evict(self, keep: pathlib.Path | None = None) -> None:
+        """
+        Deletes the least recently used cache files until the cache fits into max_size_bytes. Files deleted by another
+        process meanwhile are skipped.
+        """
+        files = []
+        for path in self.cache_dir.glob(f'*{FILE_SUFFIX}'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_size_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total_size -= size
+
+    @staticmethod
+    def _read_page_count(data: mmap.mmap) -> int:
+        magic, page_count = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise ValueError('Not a page text cache file.')
+        return page_count
+
+    @staticmethod
+    def _read_page(data: mmap.mmap, page_index: int) -> str:
+        offset, length = TABLE_ENTRY.unpack_from(data, HEADER.size + TABLE_ENTRY.size * page_index)
+        return zlib.decompress(data[offset:offset + length]).decode('utf-8')
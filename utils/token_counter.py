@@ -1,24 +1,129 @@
+from collections import OrderedDict
+from functools import lru_cache
+
 from sentencepiece import SentencePieceProcessor
 
 from Constants import Constants
 import tiktoken
 
+
+@lru_cache(maxsize=None)
+def get_open_ai_encoding(model_name: str = "gpt-4o-mini") -> tiktoken.Encoding:
+    """Returns the tiktoken encoding of the model, loaded once per process."""
+    encoding_name = tiktoken.encoding_for_model(model_name).name
+    return tiktoken.get_encoding(encoding_name)
+
+
+@lru_cache(maxsize=None)
+def get_local_tokenizer(model_file: str) -> SentencePieceProcessor:
+    """Returns the SentencePiece tokenizer of the model file, loaded once per process."""
+    return SentencePieceProcessor(model_file=model_file)
+
+
 class TokenCounter:
+    """
+    Counts the tokens of texts.
+
+    :param count_typ: 'estimate' (characters / Constants.AVG_TOKEN_CHARACKTER_COUNT), 'local' (SentencePiece model
+                      in Constants.TOKENIZER_LOCAL_MODEL_PATH) or 'openAI' (tiktoken of Constants.TOKENIZER_MODEL).
+    :param memo_size: Number of texts whose token counts are memoized (least recently used are dropped),
+                      e.g. for repeated running headers. 0 disables the memo.
+    """
+
     def __init__(self,
-                 count_typ='estimate'):
+                 count_typ='estimate',
+                 memo_size: int = 0):
         self.tokenizer_model = None
         self.count_typ = count_typ  # count_typ options are 'estimate', 'local' 'openAI'
+        self.memo_size = memo_size
+        self._memo: OrderedDict = OrderedDict()
 
     def count_tokens(self, text: str) -> int:
+        if self.memo_size > 0:
+            return self.count_tokens_batch([text])[0]
+        return self._count_tokens(text)
+
+    def count_tokens_batch(self, texts: list) -> list:
+        """
+        Counts the tokens of many texts at once, using the batch encoding of the tokenizers.
+
+        :param texts: List of texts.
+        :return: List with the token count of every text.
+        """
+        if self.memo_size <= 0:
+            return self._count_tokens_batch(texts)
+
+        counts: list = [None] * len(texts)
+        missing: dict = {}
+        for i, text in enumerate(texts):
+            if text in self._memo:
+                self._memo.move_to_end(text)
+                counts[i] = self._memo[text]
+            else:
+                missing.setdefault(text, []).append(i)
+        if missing:
+            for text, count in zip(missing, self._count_tokens_batch(list(missing))):
+                for i in missing[text]:
+                    counts[i] = count
+                self._memo[text] = count
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+        return counts
+
+    def _count_tokens(self, text: str) -> int:
         if self.count_typ == 'estimate':
             return int(round((len(text)/Constants.AVG_TOKEN_CHARACKTER_COUNT), 0))
         elif self.count_typ == 'local':
             if self.tokenizer_model is None:
-                self.tokenizer_model = SentencePieceProcessor(model_file=Constants.TOKENIZER_LOCAL_MODEL_PATH)
+                self.tokenizer_model = get_local_tokenizer(Constants.TOKENIZER_LOCAL_MODEL_PATH)
             return self._local_tokenizer(text)
         elif self.count_typ == 'openAI':
             return self._open_ai_tokenizer(string=text, model_name=Constants.TOKENIZER_MODEL)
 
+    def _count_tokens_batch(self, texts: list) -> list:
+        if not texts:
+            return []
+        if self.count_typ == 'estimate':
+            return [self._count_tokens(text) for text in texts]
+        elif self.count_typ == 'local':
+            if self.tokenizer_model is None:
+                self.tokenizer_model = get_local_tokenizer(Constants.TOKENIZER_LOCAL_MODEL_PATH)
+            return [len(tokens) for tokens in self.tokenizer_model.EncodeAsIds(texts)]
+        elif self.count_typ == 'openAI':
+            encoding = get_open_ai_encoding(Constants.TOKENIZER_MODEL)
+            return [len(tokens) for tokens in encoding.encode_batch(texts)]
+
+    def token_offsets(self, text: str) -> list:
+        """
+        Returns the character offset in the text at which every token starts.
+
+        :param text: The text to tokenize.
+        :return: Sorted list with one start offset per token, the first one is always 0.
+        """
+        if not text:
+            return []
+        if self.count_typ == 'estimate':
+            token_count = max(self._count_tokens(text), 1)
+            text_length = len(text)
+            return [i * text_length // token_count for i in range(token_count)]
+        elif self.count_typ == 'local':
+            if self.tokenizer_model is None:
+                self.tokenizer_model = get_local_tokenizer(Constants.TOKENIZER_LOCAL_MODEL_PATH)
+            # SentencePiece returns byte offsets into the utf-8 encoded input
+            char_at_byte = [i for i, char in enumerate(text) for _ in range(len(char.encode('utf-8')))]
+            char_at_byte.append(len(text))
+            pieces = self.tokenizer_model.encode(text, out_type='immutable_proto').pieces
+            offsets = [char_at_byte[min(piece.begin, len(char_at_byte) - 1)] for piece in pieces]
+        elif self.count_typ == 'openAI':
+            encoding = get_open_ai_encoding(Constants.TOKENIZER_MODEL)
+            _, offsets = encoding.decode_with_offsets(encoding.encode(text))
+        else:
+            raise ValueError(f"Unknown count_typ '{self.count_typ}'.")
+        offsets = [min(max(offset, 0), len(text)) for offset in offsets]
+        if offsets:
+            offsets[0] = 0
+        return offsets
+
     def _local_tokenizer(self, text: str) -> int:
         tokens = self.tokenizer_model.EncodeAsIds(text)
         return len(tokens)
@@ -26,8 +131,7 @@ class TokenCounter:
     @staticmethod
     def _open_ai_tokenizer(string: str, model_name: str = "gpt-4o-mini") -> int:
         """Returns the number of tokens in a text string."""
-        encoding_name = tiktoken.encoding_for_model(model_name).name
-        encoding = tiktoken.get_encoding(encoding_name)
+        encoding = get_open_ai_encoding(model_name)
         num_tokens = len(encoding.encode(string))
         return num_tokens
 